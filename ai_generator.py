@@ -1,136 +1,152 @@
-import openai
 import random
-from config import *
-
-# Generate client response using LLM
-def generate_client_response(conversation_history, latest_wandero_email):
-    try:
-        # Build conversation context
-        conversation_text = ""
-        for i, (sender, message) in enumerate(conversation_history):
-            conversation_text += f"{sender}: {message}\n\n"
-        
-        # Create realistic client prompt
-        prompt = f"""You are a realistic client planning a trip to {COMPANY_COUNTRY}. You are communicating with Wandero, a travel planning service.
-
-Company Context: {COMPANY_NAME} in {COMPANY_COUNTRY}
-
-Previous conversation:
-{conversation_text}
-
-Latest email from Wandero:
-{latest_wandero_email}
-
-Instructions:
-1. Act as a natural, realistic client who might:
-   - Provide requested information (but sometimes forget details)
-   - Ask clarifying questions
-   - Request changes to proposals
-   - Confirm plans
-   - Send follow-up emails with forgotten details
-   - Show excitement or concern about travel plans
-   - Ask about specific details (prices, dates, locations, etc.)
-
-2. Be conversational and natural - use casual language, ask questions, show personality
-3. If Wandero asks for information, provide realistic details about {COMPANY_COUNTRY} travel
-4. If Wandero sends a proposal, either confirm it or request specific changes
-5. Occasionally add forgotten details in follow-up messages
-6. Keep responses concise but informative
-7. Show genuine interest in the travel planning process
-8. Always focus on {COMPANY_COUNTRY} - ask about specific cities, regions, or attractions in {COMPANY_COUNTRY}
-9. DO NOT include "Subject:" or any email headers in the body - just write the email content directly
-10. Be human-like: occasionally make small typos, use informal language, forget to mention some details, and be a bit scattered in your thoughts
-11. Don't be too perfect - be realistic about what a real person would write in an email
-
-Generate a natural client response to Wandero's latest email:"""
-
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a realistic client planning a trip. Be natural, conversational, and authentic in your responses."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=300,
-            temperature=0.8
-        )
-        
-        client_response = response.choices[0].message.content.strip()
-        return client_response
-        
-    except Exception as e:
-        print(f"[LLM] Error generating response: {e}")
-        return "Thank you for your email. I'll get back to you soon with more details."
-
-# Generate initial client email using LLM
-def generate_initial_email():
-    try:
-        prompt = f"""You are a client planning a trip to {COMPANY_COUNTRY}. Generate an initial email to Wandero (a travel planning service) requesting help with trip planning.
-
-Company Context: {COMPANY_NAME} in {COMPANY_COUNTRY}
-
-Instructions:
-1. Write a natural, realistic initial email
-2. Include basic trip information (number of travelers, dates, destination preferences)
-3. Ask for help with planning a trip to {COMPANY_COUNTRY} specifically
-4. Be friendly and conversational
-5. Show excitement about the trip to {COMPANY_COUNTRY}
-6. Keep it concise but informative
-7. Use a realistic name (like "Sarah", "Michael", "Emma", "David", etc.) - DO NOT use placeholder text like [Your Name]
-8. Make it specific to {COMPANY_COUNTRY} travel - mention specific cities, regions, or attractions in {COMPANY_COUNTRY}
-9. DO NOT include "Subject:" or any email headers in the body - just write the email content directly
-10. Be human-like: occasionally make small typos, use informal language, forget to mention some details, and be a bit scattered in your thoughts
-11. Don't be too perfect - be realistic about what a real person would write in an email
-12. Use casual language like "hey", "thanks so much", "that sounds great", etc.
-
-Generate the initial email:"""
-
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a realistic client planning a trip. Write natural, conversational emails with real names (never use placeholders like [Your Name]). Be specific and authentic."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=200,
-            temperature=0.8
-        )
-        
-        return response.choices[0].message.content.strip()
-        
-    except Exception as e:
-        print(f"[LLM] Error generating initial email: {e}")
-        return f"Hello! I'm planning a trip and would love your help with organizing everything. We're a group of 4 people looking to visit {COMPANY_COUNTRY} next month. Could you help us plan the perfect itinerary?"
-
-# Generate follow-up email with forgotten details using LLM
-def generate_follow_up_email(conversation_history):
-    try:
-        prompt = f"""Based on the conversation history, generate a realistic follow-up email where the client remembers something they forgot to mention.
-
-Previous conversation:
-{chr(10).join([f"{sender}: {message}" for sender, message in conversation_history[-4:]])}
-
-Instructions:
-1. Write a natural follow-up email starting with something like "Oops, I forgot to mention..." or "By the way..."
-2. Add a realistic forgotten detail (dietary restrictions, accessibility needs, special requests, etc.)
-3. Keep it brief and casual
-4. Make it sound like a real person remembering something
-5. Be human-like: occasionally make small typos, use informal language, and be a bit scattered
-6. Use casual language like "hey", "btw", "thanks", etc.
-7. Don't be too perfect - be realistic about what a real person would write in a quick follow-up
-
-Generate the follow-up email:"""
-
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a client who forgot to mention something important. Write a natural follow-up email."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=150,
-            temperature=0.8
-        )
-        
-        return response.choices[0].message.content.strip()
-        
-    except Exception as e:
-        print(f"[LLM] Error generating follow-up: {e}")
-        return None 
\ No newline at end of file
+from datetime import datetime, timedelta, timezone
+
+from clock import get_clock
+from config import get_settings
+from conversation_context import count_tokens
+from llm_cache import CompletionCache
+from llm_gateway import LLMGateway
+from prompts import client_template, summary_template
+
+LLM_MODEL = "gpt-4o-mini"
+
+_completion_cache = None
+_llm_gateway = None
+
+# Completion cache shared by all generators (mode/path/TTL come from config unless configured explicitly)
+def get_completion_cache():
+    if _completion_cache is None:
+        configure_completion_cache()
+    return _completion_cache
+
+# Replace the shared completion cache, e.g. to switch to record or replay mode for a run
+# (arguments left as None use LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_SIZE and LLM_CACHE_TTL)
+def configure_completion_cache(mode=None, path=None, max_entries=None, ttl=None):
+    global _completion_cache
+    settings = get_settings()
+    if _completion_cache is not None:
+        _completion_cache.close()
+    _completion_cache = CompletionCache(path or settings.LLM_CACHE_PATH,
+                                        max_entries=max_entries or settings.LLM_CACHE_SIZE,
+                                        ttl=ttl if ttl is not None else settings.LLM_CACHE_TTL,
+                                        mode=mode or settings.LLM_CACHE_MODE)
+    return _completion_cache
+
+# Async gateway shared by every simulated client (must be created inside the running event loop)
+def get_llm_gateway():
+    if _llm_gateway is None:
+        configure_llm_gateway()
+    return _llm_gateway
+
+# Create the shared gateway with its concurrency cap, tokens-per-minute budget and retry limit
+# (None uses LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE and LLM_MAX_RETRIES; token prices for the
+# usage report come from LLM_PRICES; client replaces the
+# AsyncOpenAI client, e.g. with a fake one in benchmarks)
+def configure_llm_gateway(max_concurrency=None, tokens_per_minute=None, max_retries=None, client=None):
+    global _llm_gateway
+    settings = get_settings()
+    _llm_gateway = LLMGateway(max_concurrency or settings.LLM_MAX_CONCURRENCY,
+                              tokens_per_minute or settings.LLM_TOKENS_PER_MINUTE,
+                              max_retries if max_retries is not None else settings.LLM_MAX_RETRIES,
+                              cache=get_completion_cache(), client=client, api_key=settings.OPENAI_API_KEY,
+                              prices=settings.LLM_PRICES)
+    return _llm_gateway
+
+# Prompt token count from a completion, estimated locally if the API didn't report usage
+def _prompt_tokens(completion, messages):
+    if completion.usage.get('prompt_tokens') is not None:
+        return completion.usage['prompt_tokens']
+    return sum(count_tokens(message['content']) for message in messages)
+
+# Messages asking the LLM to fold aged-out turns into the running summary
+def build_summary_messages(previous_summary, turns, max_tokens=None):
+    max_tokens = max_tokens or get_settings().CONTEXT_SUMMARY_TOKENS
+    turns_text = "\n\n".join(f"{sender}: {message}" for sender, message in turns)
+    return summary_template(max_tokens).messages(summary=previous_summary or "(none yet)", turns=turns_text)
+
+# Fold turns that aged out of the prompt window into the running summary (ConversationContext.render_async)
+async def asummarize_turns(previous_summary, turns, max_tokens=None):
+    max_tokens = max_tokens or get_settings().CONTEXT_SUMMARY_TOKENS
+    messages = build_summary_messages(previous_summary, turns, max_tokens)
+    completion = await get_llm_gateway().complete(messages, max_tokens, temperature=0.2, model=LLM_MODEL,
+                                                  seed=get_settings().LLM_SEED, label="summary")
+    return completion.text
+
+# Names used for simulated clients when running several conversations at once
+CLIENT_NAMES = ["Sarah", "Michael", "Emma", "David", "Olivia", "James", "Sophie", "Daniel",
+                "Mia", "Lucas", "Hannah", "Noah", "Chloe", "Ethan", "Grace", "Leo"]
+
+# Budgets and dietary or accessibility needs personas are drawn from (None: nothing special)
+BUDGETS = ["around $1,500 per person", "about $3,000 per person", "mid-range, nothing too fancy",
+           "tight, under $4,000 for the whole group", "flexible, happy to splurge on a few things"]
+QUIRKS = [None, None, None, "vegetarian", "vegan", "gluten-free", "nut allergy", "one traveler uses a wheelchair",
+          "travelling with a toddler", "a bad knee, so no long hikes", "prefers ground-floor rooms", "gets seasick"]
+
+# Trip starts between one and six months ahead, for 5 to 21 days
+TRIP_START_DAYS = (30, 180)
+TRIP_DAYS = (5, 21)
+
+# Pick a random persona so parallel clients don't all write the same email
+def random_persona():
+    start = datetime.fromtimestamp(get_clock().time(), timezone.utc) + timedelta(days=random.randint(*TRIP_START_DAYS))
+    persona = {
+        'name': random.choice(CLIENT_NAMES),
+        'travelers': random.randint(1, 6),
+        'dates': f"{random.randint(*TRIP_DAYS)} days from {start.day} {start:%B %Y}",
+        'budget': random.choice(BUDGETS),
+    }
+    quirk = random.choice(QUIRKS)
+    if quirk:
+        persona['quirk'] = quirk
+    return persona
+
+# Messages for the client's reply to Wandero's latest email
+def build_client_response_messages(conversation_text, latest_wandero_email, persona=None):
+    return client_template('client_response', persona).messages(conversation=conversation_text, latest=latest_wandero_email)
+
+# Log and remember how big the client response prompt was and how much of it the provider had cached
+def _record_prompt_tokens(completion, messages, context):
+    prompt_tokens = _prompt_tokens(completion, messages)
+    prefix_hit = completion.usage.get('cached_tokens', 0)
+    print(f"[LLM] Client response prompt tokens: {prompt_tokens}"
+          f"{f' ({prefix_hit} from the prompt cache)' if prefix_hit else ''}{' (cached)' if completion.cached else ''}")
+    if context is not None:
+        context.record_prompt_tokens(prompt_tokens, prefix_hit)
+
+# Messages for the client's first email to Wandero
+def build_initial_email_messages(persona=None):
+    return client_template('initial_email', persona).messages()
+
+# Messages for a follow-up email with a forgotten detail
+def build_follow_up_messages(conversation_history, persona=None):
+    conversation = "\n".join(f"{sender}: {message}" for sender, message in conversation_history[-4:])
+    return client_template('follow_up', persona).messages(conversation=conversation)
+
+# Generators used by the simulator. They go through the shared LLMGateway and raise
+# LLMError when the API keeps failing instead of returning canned text, so a failed call
+# never ends up in the conversation as if the client had written it.
+
+# Generate client response through the gateway
+async def agenerate_client_response(conversation_history, latest_wandero_email, persona=None, context=None):
+    if context is not None:
+        context.sync(conversation_history)
+        conversation_text = await context.render_async(asummarize_turns)
+    else:
+        conversation_text = "".join(f"{sender}: {message}\n\n" for sender, message in conversation_history)
+    messages = build_client_response_messages(conversation_text, latest_wandero_email, persona)
+    completion = await get_llm_gateway().complete(messages, 300, temperature=0.8, model=LLM_MODEL, seed=get_settings().LLM_SEED,
+                                                  label="client_response")
+    _record_prompt_tokens(completion, messages, context)
+    return completion.text
+
+# Generate initial client email through the gateway
+async def agenerate_initial_email(persona=None):
+    completion = await get_llm_gateway().complete(build_initial_email_messages(persona), 200, temperature=0.8,
+                                                  model=LLM_MODEL, seed=get_settings().LLM_SEED, label="initial_email")
+    return completion.text
+
+# Generate follow-up email through the gateway
+async def agenerate_follow_up_email(conversation_history, persona=None):
+    completion = await get_llm_gateway().complete(build_follow_up_messages(conversation_history, persona), 150,
+                                                  temperature=0.8, model=LLM_MODEL, seed=get_settings().LLM_SEED, label="follow_up")
+    return completion.text
@@ -1,91 +1,289 @@
-import time
-import re
+from array import array
 from datetime import datetime
 
+from clock import get_clock
+from latency import LatencyHistogram
+from scoring import get_scoring_engine
+
+# Message-IDs kept in the References header: the thread's first email plus the most recent ones
+# (RFC 5322 allows trimming the middle of a long chain)
+MAX_REFERENCES = 20
+
+# A fixed set of named integer counters held in one array instead of a dict per instance. The
+# names and their slots are shared by the class; it supports the dict operations the analytics,
+# reports and metrics use (indexing, get, items, values, update and dict()).
+class Counters:
+    __slots__ = ('_values',)
+    NAMES = ()
+    INDEX = {}
+
+    def __init__(self, values=None):
+        self._values = array('q', bytes(8 * len(self.NAMES)))
+        if values:
+            self.update(values)
+
+    def __getitem__(self, name):
+        return self._values[self.INDEX[name]]
+
+    def __setitem__(self, name, value):
+        self._values[self.INDEX[name]] = value
+
+    def __contains__(self, name):
+        return name in self.INDEX
+
+    def __iter__(self):
+        return iter(self.NAMES)
+
+    def __len__(self):
+        return len(self.NAMES)
+
+    def get(self, name, default=None):
+        index = self.INDEX.get(name)
+        return default if index is None else self._values[index]
+
+    def keys(self):
+        return self.NAMES
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(zip(self.NAMES, self._values))
+
+    def update(self, values):
+        """Set counters from a mapping; names that no longer exist (from old checkpoints) are skipped"""
+        for name, value in dict(values).items():
+            index = self.INDEX.get(name)
+            if index is not None and isinstance(value, (int, float)):
+                self._values[index] = int(value)
+
+    def to_dict(self):
+        return dict(zip(self.NAMES, self._values))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+# Counters subclass for one group of names
+def counter_group(class_name, names):
+    return type(class_name, (Counters,), {'__slots__': (), 'NAMES': tuple(names),
+                                          'INDEX': {name: index for index, name in enumerate(names)}})
+
+# Analytics for testing Wandero's performance
+PerformanceCounters = counter_group('PerformanceCounters', (
+    'questions_answered',  # How many client questions they answered
+    'questions_ignored',  # How many questions they missed
+    'proposals_offered',  # How many travel proposals they made
+    'personalization_level',  # How personalized their responses are
+    'follow_up_questions',  # How well they ask for missing info
+    'upsell_attempts',  # How many times they try to upsell
+    'error_responses',  # How many generic/error responses
+    'specific_details_provided',  # How specific their recommendations are
+    'budget_consideration',  # Whether they consider client budget
+    'date_flexibility',  # Whether they offer date alternatives
+    'local_knowledge',  # How much local knowledge they show
+))
+
+IssueCounters = counter_group('IssueCounters', (
+    'missing_information',  # Didn't ask for important details
+    'slow_responses',  # Responses taking too long
+    'incomplete_answers',  # Didn't answer all questions
+    'poor_personalization',  # Didn't personalize to client needs
+    'lack_of_specifics',  # Vague recommendations
+    'no_follow_up',  # Didn't follow up on important points
+    'budget_ignored',  # Ignored budget constraints
+    'date_issues',  # Problems with date handling
+    'local_knowledge_gaps',  # Lack of local knowledge
+))
+
+StrengthCounters = counter_group('StrengthCounters', (
+    'quick_responses',  # Fast response times
+    'detailed_answers',  # Comprehensive responses
+    'good_questions',  # Asked relevant follow-up questions
+    'personalized_offers',  # Personalized recommendations
+    'budget_aware',  # Considered budget constraints
+    'flexible_dates',  # Offered date alternatives
+    'local_expertise',  # Showed local knowledge
+    'comprehensive_planning',  # Complete travel planning
+    'upsell_opportunities',  # Good upsell attempts
+))
+
 class ConversationAnalytics:
+    __slots__ = ('start_time', 'emails_sent', 'emails_received', 'response_times', 'last_send_time', 'last_message_id',
+                 'email_references', '_references_header', 'wandero_performance', 'wandero_issues', 'wandero_strengths')
+
     def __init__(self):
-        self.start_time = time.time()
+        self.start_time = get_clock().time()
         self.emails_sent = 0
         self.emails_received = 0
-        self.response_times = []
+        self.response_times = LatencyHistogram()  # Wandero response times (seconds)
         self.last_send_time = None
         self.last_message_id = None
-        self.email_references = []
-        
-        # Analytics for testing Wandero's performance
-        self.wandero_performance = {
-            'response_times': [],  # How fast Wandero responds
-            'response_quality': [],  # How well they answer questions
-            'questions_answered': 0,  # How many client questions they answered
-            'questions_ignored': 0,  # How many questions they missed
-            'proposals_offered': 0,  # How many travel proposals they made
-            'personalization_level': 0,  # How personalized their responses are
-            'follow_up_questions': 0,  # How well they ask for missing info
-            'upsell_attempts': 0,  # How many times they try to upsell
-            'error_responses': 0,  # How many generic/error responses
-            'specific_details_provided': 0,  # How specific their recommendations are
-            'budget_consideration': 0,  # Whether they consider client budget
-            'date_flexibility': 0,  # Whether they offer date alternatives
-            'local_knowledge': 0,  # How much local knowledge they show
-        }
-        
-        self.wandero_issues = {
-            'missing_information': 0,  # Didn't ask for important details
-            'slow_responses': 0,  # Responses taking too long
-            'incomplete_answers': 0,  # Didn't answer all questions
-            'poor_personalization': 0,  # Didn't personalize to client needs
-            'lack_of_specifics': 0,  # Vague recommendations
-            'no_follow_up': 0,  # Didn't follow up on important points
-            'budget_ignored': 0,  # Ignored budget constraints
-            'date_issues': 0,  # Problems with date handling
-            'local_knowledge_gaps': 0  # Lack of local knowledge
-        }
-        
-        self.wandero_strengths = {
-            'quick_responses': 0,  # Fast response times
-            'detailed_answers': 0,  # Comprehensive responses
-            'good_questions': 0,  # Asked relevant follow-up questions
-            'personalized_offers': 0,  # Personalized recommendations
-            'budget_aware': 0,  # Considered budget constraints
-            'flexible_dates': 0,  # Offered date alternatives
-            'local_expertise': 0,  # Showed local knowledge
-            'comprehensive_planning': 0,  # Complete travel planning
-            'upsell_opportunities': 0  # Good upsell attempts
-        }
-    
+        self.email_references = []  # bounded to MAX_REFERENCES, first ID kept
+        self._references_header = None  # email_references joined, rebuilt only after it changes
+        self.wandero_performance = PerformanceCounters()
+        self.wandero_issues = IssueCounters()
+        self.wandero_strengths = StrengthCounters()
+
+    # Fields saved in checkpoints so a resumed conversation keeps its analytics
+    STATE_FIELDS = ('start_time', 'emails_sent', 'emails_received', 'response_times', 'last_send_time',
+                    'last_message_id', 'email_references', 'wandero_performance', 'wandero_issues', 'wandero_strengths')
+
+    def to_state(self):
+        """JSON-serializable snapshot of every counter"""
+        state = {field: getattr(self, field) for field in self.STATE_FIELDS}
+        state['response_times'] = self.response_times.to_state()
+        state['email_references'] = list(self.email_references)
+        for group in self.COUNTER_GROUPS:
+            state[group] = state[group].to_dict()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild analytics from a to_state() snapshot"""
+        analytics = cls()
+        for field in cls.STATE_FIELDS:
+            if field not in state:
+                continue
+            value = state[field]
+            current = getattr(analytics, field)
+            if field == 'response_times':
+                # Older checkpoints stored the raw list of response times
+                histogram = LatencyHistogram.from_values(value) if isinstance(value, list) else LatencyHistogram.from_state(value)
+                setattr(analytics, field, histogram)
+            elif isinstance(current, Counters):
+                # Counters dropped since the snapshot was taken are skipped, new ones start at zero
+                current.update(value)
+            elif field == 'email_references':
+                for message_id in value:
+                    analytics._add_reference(message_id)
+            else:
+                setattr(analytics, field, value)
+        return analytics
+
+    # Additive counter groups; with the email counts and response times they make up a delta
+    COUNTER_GROUPS = ('wandero_performance', 'wandero_issues', 'wandero_strengths')
+
+    def snapshot(self):
+        """Copy of the additive counters, to compute the next delta_since() against"""
+        snapshot = {group: getattr(self, group).to_dict() for group in self.COUNTER_GROUPS}
+        snapshot.update(emails_sent=self.emails_sent, emails_received=self.emails_received,
+                        response_times=self.response_times.copy())
+        return snapshot
+
+    def delta_since(self, previous=None):
+        """Changes since an earlier snapshot() as (delta, new snapshot); delta is None when nothing changed.
+
+        Without a previous snapshot the delta is the whole state and is marked 'base', so whoever
+        applies it replaces what it had for this conversation (e.g. after a worker restart)."""
+        current = self.snapshot()
+        if previous is None:
+            previous = ConversationAnalytics().snapshot()
+            delta = {'base': True}
+        else:
+            delta = {}
+        for field in ('emails_sent', 'emails_received'):
+            if current[field] != previous[field]:
+                delta[field] = current[field] - previous[field]
+        for group in self.COUNTER_GROUPS:
+            changed = {name: value - previous[group].get(name, 0) for name, value in current[group].items()
+                       if value != previous[group].get(name, 0)}
+            if changed:
+                delta[group] = changed
+        added = current['response_times'].since(previous['response_times'])
+        if added:
+            delta['response_times'] = added.to_state()
+        return (delta or None), current
+
+    def apply_delta(self, delta):
+        """Add a delta_since() delta to these counters"""
+        self.emails_sent += delta.get('emails_sent', 0)
+        self.emails_received += delta.get('emails_received', 0)
+        for group in self.COUNTER_GROUPS:
+            counters = getattr(self, group)
+            for name, value in delta.get(group, {}).items():
+                counters[name] = counters.get(name, 0) + value
+        if 'response_times' in delta:
+            self.response_times.merge(LatencyHistogram.from_state(delta['response_times']))
+        return self
+
+    @classmethod
+    def from_transcript(cls, history, response_times=()):
+        """Re-run the analysis over a stored conversation.
+
+        history is the list of (sender, message) pairs in order; response_times are the measured
+        Wandero response times, one for the first reply after each client email.
+        """
+        analytics = cls()
+        response_times = iter(response_times)
+        client_questions = None
+        awaiting_reply = False
+        for sender, message in history:
+            if sender == "Client":
+                analytics.emails_sent += 1
+                client_questions = message
+                awaiting_reply = True
+                continue
+            analytics.record_email_received()
+            if awaiting_reply:
+                awaiting_reply = False
+                response_time = next(response_times, None)
+                if response_time is not None:
+                    analytics.response_times.record(response_time)
+            analytics.analyze_wandero_response(message, client_questions)
+            client_questions = None
+        return analytics
+
     def record_email_sent(self, message_id=None):
         """Record when an email is sent"""
         self.emails_sent += 1
-        self.last_send_time = time.time()
+        self.last_send_time = get_clock().time()
         if message_id:
-            self.last_message_id = message_id
-            self.email_references.append(message_id)
+            self._add_reference(message_id)
     
-    def record_email_received(self):
-        """Record when an email is received"""
+    def record_email_received(self, message_id=None):
+        """Record when an email is received (its Message-ID is what our next email replies to)"""
         self.emails_received += 1
+        if message_id:
+            self._add_reference(message_id)
+
+    def _add_reference(self, message_id):
+        """Make message_id the latest in the thread, trimming the middle of a long References chain"""
+        self.last_message_id = message_id
+        self.email_references.append(message_id)
+        if len(self.email_references) > MAX_REFERENCES:
+            del self.email_references[1]
+        self._references_header = None
     
-    def record_response_time(self):
-        """Record response time if we have a last send time"""
+    def record_response_time(self, received_at=None):
+        """Record response time if we have a last send time.
+
+        received_at is when the reply actually arrived (e.g. the IDLE push time);
+        it defaults to now, which includes any polling delay.
+        """
         if self.last_send_time:
-            response_time = time.time() - self.last_send_time
-            self.response_times.append(response_time)
+            if received_at is None or received_at < self.last_send_time:
+                received_at = get_clock().time()
+            response_time = received_at - self.last_send_time
+            self.response_times.record(response_time)
             return response_time
         return None
     
     def get_analytics_summary(self):
         """Get a summary of all analytics"""
-        total_time = time.time() - self.start_time
-        avg_response_time = sum(self.response_times) / len(self.response_times) if self.response_times else 0
+        total_time = get_clock().time() - self.start_time
+        latency = self.response_times.summary()
         
         summary = {
             'total_time_minutes': total_time / 60,
             'emails_sent': self.emails_sent,
             'emails_received': self.emails_received,
-            'avg_response_time_minutes': avg_response_time / 60,
-            'fastest_response_minutes': min(self.response_times) / 60 if self.response_times else 0,
-            'slowest_response_minutes': max(self.response_times) / 60 if self.response_times else 0,
-            'total_responses': len(self.response_times)
+            'avg_response_time_minutes': latency['mean'] / 60,
+            'fastest_response_minutes': latency['min'] / 60,
+            'slowest_response_minutes': latency['max'] / 60,
+            'p50_response_minutes': latency['p50'] / 60,
+            'p95_response_minutes': latency['p95'] / 60,
+            'p99_response_minutes': latency['p99'] / 60,
+            'total_responses': latency['count']
         }
         
         return summary
@@ -108,6 +306,8 @@ class ConversationAnalytics:
         if self.response_times:
             print(f"  • Fastest response: {summary['fastest_response_minutes']:.1f} minutes")
             print(f"  • Slowest response: {summary['slowest_response_minutes']:.1f} minutes")
+            print(f"  • Response time p50/p95/p99: {summary['p50_response_minutes']:.1f} / "
+                  f"{summary['p95_response_minutes']:.1f} / {summary['p99_response_minutes']:.1f} minutes")
         
         # Performance score
         print(f"\nOVERALL PERFORMANCE SCORE: {performance_score:.1f}/100")
@@ -164,7 +364,9 @@ class ConversationAnalytics:
     
     def analyze_wandero_response(self, wandero_message, client_questions=None):
         """Analyze Wandero's response for performance metrics"""
-        text_lower = wandero_message.lower()
+        # Every category hit, and question coverage when the client's questions are known
+        message_score = get_scoring_engine().score(wandero_message, client_questions)
+        hits = message_score.categories
         
         # Track response time (already handled in record_response_time)
         
@@ -173,11 +375,8 @@ class ConversationAnalytics:
         
         # Check if they answered client questions
         if client_questions:
-            questions_asked = len(re.findall(r'\?', client_questions))
-            questions_answered = 0
-            for question in client_questions.split('?'):
-                if question.strip() and any(word in text_lower for word in question.lower().split()):
-                    questions_answered += 1
+            questions_asked = message_score.questions_asked
+            questions_answered = message_score.questions_answered
             
             if questions_answered >= questions_asked * 0.8:
                 self.wandero_performance['questions_answered'] += questions_answered
@@ -187,29 +386,29 @@ class ConversationAnalytics:
                 self.wandero_issues['incomplete_answers'] += 1
         
         # Check for proposals/offers
-        if any(word in text_lower for word in ['proposal', 'offer', 'package', 'itinerary', 'plan']):
+        if 'proposals' in hits:
             self.wandero_performance['proposals_offered'] += 1
             self.wandero_strengths['comprehensive_planning'] += 1
         
         # Check for personalization
-        if any(word in text_lower for word in ['your', 'based on', 'specifically', 'customized']):
+        if 'personalization' in hits:
             self.wandero_performance['personalization_level'] += 1
             self.wandero_strengths['personalized_offers'] += 1
         else:
             self.wandero_issues['poor_personalization'] += 1
         
         # Check for follow-up questions
-        if any(word in text_lower for word in ['could you', 'would you', 'do you', 'what about', 'when']):
+        if 'follow_up' in hits:
             self.wandero_performance['follow_up_questions'] += 1
             self.wandero_strengths['good_questions'] += 1
         
         # Check for upsell attempts
-        if any(word in text_lower for word in ['premium', 'upgrade', 'additional', 'extra', 'luxury']):
+        if 'upsell' in hits:
             self.wandero_performance['upsell_attempts'] += 1
             self.wandero_strengths['upsell_opportunities'] += 1
         
         # Check for specific details
-        if any(word in text_lower for word in ['$', 'dollar', 'euro', 'price', 'cost', 'budget']):
+        if 'pricing' in hits:
             self.wandero_performance['specific_details_provided'] += 1
             self.wandero_performance['budget_consideration'] += 1
             self.wandero_strengths['budget_aware'] += 1
@@ -217,14 +416,14 @@ class ConversationAnalytics:
             self.wandero_issues['budget_ignored'] += 1
         
         # Check for date flexibility
-        if any(word in text_lower for word in ['alternative', 'different dates', 'flexible', 'change']):
+        if 'date_flexibility' in hits:
             self.wandero_performance['date_flexibility'] += 1
             self.wandero_strengths['flexible_dates'] += 1
         else:
             self.wandero_issues['date_issues'] += 1
         
         # Check for local knowledge
-        if any(word in text_lower for word in ['local', 'authentic', 'traditional', 'culture', 'custom']):
+        if 'local_knowledge' in hits:
             self.wandero_performance['local_knowledge'] += 1
             self.wandero_strengths['local_expertise'] += 1
         else:
@@ -237,9 +436,9 @@ class ConversationAnalytics:
         # Generic response detection is subjective and not reliable
         
         # Check response speed
-        if self.response_times and self.response_times[-1] < 300:  # Less than 5 minutes
+        if self.response_times and self.response_times.last < 300:  # Less than 5 minutes
             self.wandero_strengths['quick_responses'] += 1
-        elif self.response_times and self.response_times[-1] > 1800:  # More than 30 minutes
+        elif self.response_times and self.response_times.last > 1800:  # More than 30 minutes
             self.wandero_issues['slow_responses'] += 1
     
     def calculate_wandero_performance_score(self):
@@ -255,7 +454,7 @@ class ConversationAnalytics:
         
         # Response speed (25 points)
         if self.response_times:
-            avg_response_time = sum(self.response_times) / len(self.response_times)
+            avg_response_time = self.response_times.mean
             if avg_response_time < 300:  # Less than 5 minutes
                 score += 25
             elif avg_response_time < 900:  # Less than 15 minutes
@@ -305,5 +504,6 @@ class ConversationAnalytics:
     def get_threading_headers(self):
         """Get headers for email threading"""
         in_reply_to = self.last_message_id if self.last_message_id else None
-        references = ' '.join(self.email_references) if self.email_references else None
-        return in_reply_to, references 
\ No newline at end of file
+        if self._references_header is None and self.email_references:
+            self._references_header = ' '.join(self.email_references)
+        return in_reply_to, self._references_header 
\ No newline at end of file
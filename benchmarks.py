@@ -0,0 +1,595 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from types import SimpleNamespace
+
+from analytics import ConversationAnalytics
+from body_normalizer import normalize_body
+from conversation_context import ConversationContext, count_tokens
+from question_coverage import QuestionCoverage
+from scoring import LEXICONS, get_scoring_engine, split_questions, tokenize, tokenize_sentences
+
+# Benchmarks for the simulator's hot paths: reply scoring, client-response prompt building, the
+# LLM call path and MIME decoding of fetched mail. The OpenAI client and the IMAP server are
+# replaced by in-process fakes at the same seams the simulator uses (the gateway's client and the
+# IMAP session), so the numbers measure our code rather than the network.
+
+DEFAULT_BASELINE = 'benchmarks_baseline.json'
+
+# Offline commands must start within this many seconds (median cold start, including the interpreter)
+STARTUP_BUDGET = 0.5
+STARTUP_COMMANDS = ('report', 'rescore')
+# Modules the offline commands must not import
+HEAVY_MODULES = ('openai', 'imapclient', 'dotenv', 'tiktoken', 'ai_generator', 'email_client', 'simulator')
+
+# How much slower than the old substring scans the scoring engine may measure on a corpus (timing noise)
+SCORING_MARGIN = 0.25
+
+# How many times the old word-overlap check's time TF-IDF question coverage may take on a reply:
+# it indexes the reply's sentences (sets, document frequencies, norms) where the check made one set
+COVERAGE_BUDGET = 8
+
+# How many times the old analysis's time the full reply analysis (categories plus TF-IDF question
+# coverage) may take on a reply; what it adds over the old analysis is the coverage index
+ANALYSIS_BUDGET = 8
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+# Filler vocabulary for synthetic Wandero emails
+WORDS = ("the a we our trip day tour guide hotel breakfast included transfer airport city old town museum "
+         "walk dinner evening morning afternoon beach mountain river view room night stay travel group "
+         "proposal itinerary price budget local traditional flexible premium upgrade your could you when").split()
+
+# A client email full of questions, used as client_questions
+CLIENT_QUESTIONS = ("Hi! We are thinking about a trip in late May for two people. What dates would work best for the "
+                    "mountain tour? How much would the premium package cost per person? Is breakfast included at the "
+                    "hotel? Can we change the hotel if we don't like it? Do you offer airport transfers? Are there "
+                    "vegetarian options at dinner? What happens if our flight is delayed? Could we add an extra night "
+                    "in the old town?")
+
+# A reply that answers the first five of CLIENT_QUESTIONS and ignores the other three
+ANSWERING_REPLY = ("Hi there,\n\nThank you for reaching out! For two people in late May, the best dates for the mountain "
+                   "tour are May 24-31. The premium package costs $1,450 per person. Breakfast is included at every "
+                   "hotel. You can change hotels up to 14 days before arrival.\n\nAirport transfers are offered in "
+                   "both directions at no extra cost.\n\nBest regards,\nThe Wandero Team")
+
+# Reply returned by the fake LLM
+CANNED_REPLY = "hey, thanks so much! that sounds great, could you send a few more details about the hotels? thanks"
+
+# Email sizes (words) for the short and long corpora
+SHORT_EMAIL_WORDS = 120
+LONG_EMAIL_WORDS = 5000
+
+# Conversation lengths (rounds of client email + Wandero reply) for the prompt benchmarks
+HISTORY_ROUNDS = (5, 20, 50, 200)
+
+# Synthetic email of roughly num_words words, with sentence breaks and the odd price
+def synthetic_email(num_words, seed=0):
+    rng = random.Random(seed)
+    words = []
+    for index in range(num_words):
+        word = rng.choice(WORDS)
+        if index % 97 == 0:
+            word = f"${rng.randint(100, 5000)}"
+        words.append(word)
+        if index % 15 == 14:
+            words[-1] += '.'
+    return "Hi there,\n\n" + ' '.join(words) + "\n\nBest regards,\nThe Wandero Team"
+
+# Worst case for substring scanning: a long email that contains none of the keywords
+def keyword_free_email(num_words, seed=0):
+    rng = random.Random(seed)
+    filler = [word for word in WORDS if not any(term in word for terms in LEXICONS.values() for term in terms)]
+    return ' '.join(rng.choice(filler) for _ in range(num_words))
+
+# A reply that quotes the whole thread below it, as mail clients do: every earlier round nested one level deeper
+def quoting_reply(reply, rounds):
+    quoted = CLIENT_QUESTIONS
+    for index in range(rounds):
+        quoted = f"{synthetic_email(SHORT_EMAIL_WORDS, index)}\n\nOn Tue, 5 Mar 2024, Sarah <sarah@example.com> wrote:\n" + \
+                 '\n'.join(f"> {line}" for line in quoted.splitlines())
+    return f"{reply}\n\nOn Wed, 6 Mar 2024, Sarah <sarah@example.com> wrote:\n" + '\n'.join(f"> {line}" for line in quoted.splitlines())
+
+# Conversation history of the given number of rounds, as (sender, message) pairs
+def synthetic_history(rounds, seed=0):
+    history = []
+    for index in range(rounds):
+        history.append(("Client", CLIENT_QUESTIONS))
+        history.append(("Wandero", synthetic_email(SHORT_EMAIL_WORDS, seed + index)))
+    return history
+
+# Plain-text reply from Wandero as an EmailMessage
+def plain_email(uid, num_words, encoding=None):
+    msg = EmailMessage()
+    msg['From'] = 'hello@wandero.ai'
+    msg['To'] = 'client@example.com'
+    msg['Subject'] = f"Re: Trip Planning Request #{uid:04d}"
+    msg['Message-ID'] = f"<bench-{uid}@wandero.ai>"
+    msg.set_content(synthetic_email(num_words, uid), cte=encoding)
+    return msg
+
+# Reply with text and HTML alternatives plus a PDF attachment that must never be downloaded
+def multipart_email(uid, num_words, attachment_bytes=256 * 1024):
+    msg = plain_email(uid, num_words, encoding='quoted-printable')
+    msg.add_alternative(f"<html><body><p>{synthetic_email(num_words, uid)}</p></body></html>", subtype='html')
+    msg.add_attachment(os.urandom(attachment_bytes), maintype='application', subtype='pdf', filename='itinerary.pdf')
+    return msg
+
+# Stands in for the AsyncOpenAI client: answers at once with a canned reply and plausible usage.
+# The prompt tokens it reports as cached are the longest prefix shared with an earlier prompt,
+# counted the way OpenAI does (nothing under 1,024 tokens, then in 128-token steps).
+class FakeChatClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+        self.requests = 0
+        self.prompts = deque(maxlen=64)
+
+    async def create(self, model, messages, max_tokens, temperature, seed=None):
+        self.requests += 1
+        prompt_tokens = sum(count_tokens(message['content']) for message in messages)
+        text = "\n".join(message['content'] for message in messages)
+        shared = max((len(os.path.commonprefix([text, previous])) for previous in self.prompts), default=0)
+        self.prompts.append(text)
+        cached_tokens = count_tokens(text[:shared])
+        cached_tokens = cached_tokens // 128 * 128 if cached_tokens >= 1024 else 0
+        message = SimpleNamespace(content=CANNED_REPLY)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=count_tokens(CANNED_REPLY),
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+# BODYSTRUCTURE of an EmailMessage in imapclient's representation
+def _body_structure(part):
+    from imapclient.response_types import BodyData
+    if part.is_multipart():
+        return BodyData(([_body_structure(child) for child in part.iter_parts()], part.get_content_subtype().encode()))
+    payload = part.get_payload().encode()
+    params = (b'CHARSET', part.get_content_charset('utf-8').encode())
+    encoding = (part['Content-Transfer-Encoding'] or '7bit').encode()
+    return BodyData((part.get_content_maintype().encode(), part.get_content_subtype().encode(), params, None, None,
+                     encoding, len(payload)))
+
+# Transfer-encoded payload of every leaf part, keyed by IMAP section number
+def _section_payloads(part, prefix=""):
+    if not part.is_multipart():
+        return {prefix[:-1] if prefix else "1": part.get_payload().encode()}
+    sections = {}
+    for index, child in enumerate(part.iter_parts(), start=1):
+        sections.update(_section_payloads(child, f"{prefix}{index}."))
+    return sections
+
+# Stands in for an IMAPClient connection holding a fixed set of messages. Responses are built up
+# front, so timing covers only the simulator's search/fetch/decode path.
+class FakeIMAPServer:
+    def __init__(self, messages):
+        from imapclient.response_types import Address, Envelope
+        self.meta = {}
+        self.sections = {}
+        received = datetime.now(timezone.utc)
+        for uid, msg in enumerate(messages, start=1):
+            sender, host = str(msg['From']).split('@')
+            envelope = Envelope(None, str(msg['Subject']).encode(), (Address(None, None, sender.encode(), host.encode()),),
+                                None, None, None, None, None, None, str(msg['Message-ID']).encode())
+            self.meta[uid] = {b'ENVELOPE': envelope, b'BODYSTRUCTURE': _body_structure(msg), b'INTERNALDATE': received}
+            self.sections[uid] = _section_payloads(msg)
+
+    def search(self, criteria):
+        return sorted(self.meta)
+
+    def fetch(self, uids, items):
+        if items[0] == 'ENVELOPE':
+            return {uid: self.meta[uid] for uid in uids}
+        section = items[0][len('BODY.PEEK['):-1]
+        key = f'BODY[{section}]'.encode()
+        return {uid: {key: self.sections[uid].get(section)} for uid in uids}
+
+# Session wrapper handing the fake server to session.run() like IMAPSession does
+class FakeIMAPSession:
+    def __init__(self, server):
+        self.server = server
+
+    def run(self, operation, *args):
+        return operation(self.server, *args)
+
+# Run fn() repeatedly for at least min_time seconds, returns per-call timings in seconds
+def time_calls(fn, min_time=0.5, min_calls=5):
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < min_calls or time.perf_counter() < deadline:
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+# Value at quantile q of already sorted values
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+# Time fn() and measure its peak traced memory (in a separate run, tracemalloc slows calls down)
+def measure(name, fn, min_time=0.5):
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        fn()  # warm up caches and lazy setup
+        timings = sorted(time_calls(fn, min_time))
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'benchmark': name,
+        'ops_per_sec': len(timings) / sum(timings),
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'peak_kib': peak / 1024,
+    }
+
+# Previous implementation of the keyword checks: one substring scan per lexicon and per question word
+def legacy_analyze(wandero_message, client_questions):
+    text_lower = wandero_message.lower()
+    hits = set()
+    questions_answered = 0
+    for question in (client_questions or '').split('?'):
+        if question.strip() and any(word in text_lower for word in question.lower().split()):
+            questions_answered += 1
+    legacy_lexicons = {
+        'proposals': ['proposal', 'offer', 'package', 'itinerary', 'plan'],
+        'personalization': ['your', 'based on', 'specifically', 'customized'],
+        'follow_up': ['could you', 'would you', 'do you', 'what about', 'when'],
+        'upsell': ['premium', 'upgrade', 'additional', 'extra', 'luxury'],
+        'pricing': ['$', 'dollar', 'euro', 'price', 'cost', 'budget'],
+        'date_flexibility': ['alternative', 'different dates', 'flexible', 'change'],
+        'local_knowledge': ['local', 'authentic', 'traditional', 'culture', 'custom'],
+    }
+    for category, words in legacy_lexicons.items():
+        if any(word in text_lower for word in words):
+            hits.add(category)
+    return hits, questions_answered
+
+# Previous question-coverage check: a question counts as answered when any of its words, "the"
+# included, is a word of the reply
+def overlap_coverage(text, client_questions):
+    words = set(tokenize(text.lower()))
+    questions = [set(question) for question in map(tokenize, client_questions.lower().split('?')) if question]
+    return client_questions.count('?'), sum(1 for question in questions if not words.isdisjoint(question))
+
+# TF-IDF question coverage against the word-overlap check it replaced, on a reply answering five
+# of eight questions and on long replies. The overlap check calls nearly every reply a complete
+# answer; the guard fails if the TF-IDF scorer does the same for the partial answer or for a long
+# reply that answers nothing, or takes more than COVERAGE_BUDGET times the check's time on any.
+def bench_coverage(min_time):
+    rows, failures = [], []
+    corpora = {
+        'answer': ANSWERING_REPLY,
+        'long': synthetic_email(LONG_EMAIL_WORDS),
+        'long-no-keywords': keyword_free_email(LONG_EMAIL_WORDS),
+    }
+    coverage = QuestionCoverage()
+    for label, text in corpora.items():
+        tfidf = lambda: coverage.score(split_questions(CLIENT_QUESTIONS.lower()), tokenize_sentences(text.lower()))
+        overlap = measure(f"coverage/{label}/overlap", lambda: overlap_coverage(text, CLIENT_QUESTIONS), min_time)
+        row = measure(f"coverage/{label}/tfidf", tfidf, min_time)
+        rows += [overlap, row]
+        if row['ops_per_sec'] * COVERAGE_BUDGET < overlap['ops_per_sec']:
+            failures.append(f"tf-idf coverage is over {COVERAGE_BUDGET}x the overlap check's time on coverage/{label}")
+        asked, answered = tfidf()
+        _, overlap_answered = overlap_coverage(text, CLIENT_QUESTIONS)
+        print(f"[BENCH] coverage/{label}: overlap {overlap_answered}/{asked} answered, tf-idf {answered}/{asked}")
+        if label == 'answer' and not 0 < answered < asked:
+            failures.append(f"tf-idf coverage scored the partial answer {answered}/{asked}")
+        if label == 'long-no-keywords' and answered > asked // 2:
+            failures.append(f"tf-idf coverage scored an unrelated reply {answered}/{asked}")
+    return rows, failures
+
+# Body normalization of replies quoting the thread (Gmail style, the first and the 20th round),
+# an HTML-only reply and a reply without quotes. The guard fails if the quoted client questions
+# survive or the reply's own answers are cut.
+def bench_normalize(min_time):
+    rows, failures = [], []
+    corpora = {
+        'quoted': (quoting_reply(ANSWERING_REPLY, 0), False),
+        'quoted-20-rounds': (quoting_reply(ANSWERING_REPLY, 20), False),
+        'html': ("<html><body><p>" + ANSWERING_REPLY.replace("\n\n", "</p><p>") + "</p><div class=\"gmail_quote\">"
+                 "<blockquote>" + CLIENT_QUESTIONS + "</blockquote></div></body></html>", True),
+        'unquoted': (synthetic_email(SHORT_EMAIL_WORDS), False),
+    }
+    for label, (body, html) in corpora.items():
+        rows.append(measure(f"normalize/{label}", lambda: normalize_body(body, html), min_time))
+        normalized = normalize_body(body, html)
+        print(f"[BENCH] normalize/{label}: removed {normalized.removed_bytes} bytes, {normalized.removed_tokens} tokens")
+        if label != 'unquoted' and ('vegetarian' in normalized.text or 'Airport transfers' not in normalized.text):
+            failures.append(f"normalize/{label} kept the quoted questions or lost the answer")
+    return rows, failures
+
+# analyze_wandero_response on short and long replies, and the scoring engine's category matching
+# alone against the substring scans it replaced (which exit early on keyword-dense text and scan
+# the whole email once per term when it has no keywords). Fails when category matching is slower
+# than the scans on any corpus by more than SCORING_MARGIN, or when the full analysis takes more
+# than ANALYSIS_BUDGET times the old one's: question coverage is TF-IDF scoring rather than a word
+# lookup now, so the full analysis gets a budget instead of the margin.
+def bench_scoring(min_time):
+    rows, failures = [], []
+    corpora = {
+        'short': synthetic_email(SHORT_EMAIL_WORDS),
+        'long': synthetic_email(LONG_EMAIL_WORDS),
+        'long-no-keywords': keyword_free_email(LONG_EMAIL_WORDS),
+    }
+    engine = get_scoring_engine()
+    for label, text in corpora.items():
+        analytics = ConversationAnalytics()
+        row = measure(f"scoring/{label}", lambda: analytics.analyze_wandero_response(text, CLIENT_QUESTIONS), min_time)
+        legacy = measure(f"scoring/{label}/legacy", lambda: legacy_analyze(text, CLIENT_QUESTIONS), min_time)
+        categories = measure(f"scoring/{label}/categories", lambda: engine.score(text), min_time)
+        legacy_categories = measure(f"scoring/{label}/categories-legacy", lambda: legacy_analyze(text, None), min_time)
+        rows += [row, legacy, categories, legacy_categories]
+        if categories['ops_per_sec'] < legacy_categories['ops_per_sec'] * (1 - SCORING_MARGIN):
+            failures.append(f"scoring engine is slower than the substring scans on scoring/{label}")
+        if row['ops_per_sec'] * ANALYSIS_BUDGET < legacy['ops_per_sec']:
+            failures.append(f"reply analysis is over {ANALYSIS_BUDGET}x the old analysis's time on scoring/{label}")
+    return rows, failures
+
+# Client-response prompt building for growing histories: the whole thread joined into the prompt
+# versus a fresh ConversationContext (rolling extractive summary plus recent turns). Fails when
+# prompts stop starting with the same messages, which would defeat the provider's prompt cache.
+def bench_prompt(min_time):
+    from ai_generator import build_client_response_messages
+    rows, failures = [], []
+    persona = {'name': 'Sarah', 'travelers': 2}
+    for rounds in HISTORY_ROUNDS:
+        history = synthetic_history(rounds)
+        latest = history[-1][1]
+
+        def full_history():
+            text = "".join(f"{sender}: {message}\n\n" for sender, message in history)
+            return build_client_response_messages(text, latest, persona)
+
+        def with_context():
+            context = ConversationContext()
+            context.sync(history)
+            return build_client_response_messages(context.render(), latest, persona)
+
+        rows.append(measure(f"prompt/full-history/{rounds}", full_history, min_time))
+        rows.append(measure(f"prompt/context/{rounds}", with_context, min_time))
+
+    prefixes = {str(build_client_response_messages(text, text, persona)[:-1]) for text in ("a", "b")}
+    other = build_client_response_messages("a", "a", {'name': 'David', 'travelers': 5})
+    if len(prefixes) > 1 or other[0] != build_client_response_messages("b", "b", persona)[0]:
+        failures.append("client response prompts do not share a stable prefix across rounds and personas")
+    return rows, failures
+
+# agenerate_client_response end to end through the gateway, with the fake client in place of OpenAI
+def bench_llm(min_time):
+    import ai_generator
+    rows = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        ai_generator.configure_completion_cache(mode='off')
+        ai_generator.configure_llm_gateway(client=FakeChatClient())
+        for rounds in HISTORY_ROUNDS:
+            history = synthetic_history(rounds)
+            latest = history[-1][1]
+            call = lambda: loop.run_until_complete(
+                ai_generator.agenerate_client_response(history, latest, None, ConversationContext()))
+            rows.append(measure(f"llm/client-response/{rounds}", call, min_time))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return rows, []
+
+# Fetching and decoding a batch of replies: plain short/long bodies, base64 bodies, and multipart
+# messages whose attachment must not be fetched or decoded
+def bench_mime(min_time, batch=20):
+    from email_client import iter_new_emails
+    rows = []
+    corpora = {
+        'short': [plain_email(uid, SHORT_EMAIL_WORDS) for uid in range(batch)],
+        'long': [plain_email(uid, LONG_EMAIL_WORDS) for uid in range(batch)],
+        'long-base64': [plain_email(uid, LONG_EMAIL_WORDS, encoding='base64') for uid in range(batch)],
+        'multipart-attachment': [multipart_email(uid, SHORT_EMAIL_WORDS) for uid in range(batch)],
+    }
+    for label, messages in corpora.items():
+        session = FakeIMAPSession(FakeIMAPServer(messages))
+        rows.append(measure(f"mime/{label}/x{batch}", lambda: list(iter_new_emails(session=session)), min_time))
+    return rows, []
+
+# Timers for a large fleet: arm one poll deadline per conversation, cancel half of them (mail
+# arrived) and fire the rest, through the scheduler and through one loop.call_later per timer
+def bench_scheduler(min_time, conversations=(1000, 10000)):
+    from scheduler import TimerScheduler
+    rows = []
+    loop = asyncio.new_event_loop()
+    try:
+        for count in conversations:
+            def churn(schedule):
+                fired = []
+                timers = [schedule(1e-5 * (i % 50), fired.append, i) for i in range(count)]
+                for timer in timers[::2]:
+                    timer.cancel()
+                loop.run_until_complete(asyncio.sleep(0.001))
+                return fired
+
+            scheduler = TimerScheduler(loop)
+            rows.append(measure(f"scheduler/heap/{count}", lambda: churn(scheduler.call_later), min_time))
+            rows.append(measure(f"scheduler/call_later/{count}", lambda: churn(loop.call_later), min_time))
+    finally:
+        loop.close()
+    return rows, []
+
+# Conversation state as it was kept before compact records: (sender, message) tuples, analytics
+# counters in three dicts per instance and an unbounded References list
+def legacy_conversation(rounds, body):
+    from analytics import IssueCounters, PerformanceCounters, StrengthCounters
+    history = []
+    references = []
+    for index in range(rounds):
+        history.append(("Client", f"{index} {CLIENT_QUESTIONS}"))
+        history.append(("Wandero", f"{index} {body}"))
+        references += [f"<client-{index}@example.com>", f"<wandero-{index}@wandero.ai>"]
+    analytics = SimpleNamespace(start_time=time.time(), emails_sent=rounds, emails_received=rounds, last_send_time=None,
+                                last_message_id=references[-1], email_references=references,
+                                wandero_performance={'response_quality': [], **dict.fromkeys(PerformanceCounters.NAMES, 0)},
+                                wandero_issues=dict.fromkeys(IssueCounters.NAMES, 0),
+                                wandero_strengths=dict.fromkeys(StrengthCounters.NAMES, 0))
+    return history, analytics
+
+# The same conversation as a Transcript (with the given cold storage) and ConversationAnalytics
+def compact_conversation(rounds, body, cold_storage):
+    from transcript import Transcript
+    history = Transcript(keep_recent=8, cold_storage=cold_storage)
+    analytics = ConversationAnalytics()
+    for index in range(rounds):
+        history.append(("Client", f"{index} {CLIENT_QUESTIONS}"))
+        analytics.record_email_sent(f"<client-{index}@example.com>")
+        history.append(("Wandero", f"{index} {body}"))
+        analytics.record_email_received(f"<wandero-{index}@wandero.ai>")
+    return history, analytics
+
+# Memory retained per conversation (in the peak KiB column) for growing conversations, legacy
+# layout versus compact records. Fails if compressed compact records aren't smaller than the legacy layout.
+def bench_memory(min_time, conversations=200):
+    rows, failures = [], []
+    body = synthetic_email(SHORT_EMAIL_WORDS)
+    variants = {
+        'legacy': lambda rounds: legacy_conversation(rounds, body),
+        'compact': lambda rounds: compact_conversation(rounds, body, 'off'),
+        'compact-compress': lambda rounds: compact_conversation(rounds, body, 'compress'),
+        'compact-spill': lambda rounds: compact_conversation(rounds, body, 'spill'),
+    }
+    for rounds in (10, 50):
+        footprint = {}
+        for label, build in variants.items():
+            build(rounds)  # warm up lazy setup (spill file, class caches)
+            tracemalloc.start()
+            started = time.perf_counter()
+            kept = [build(rounds) for _ in range(conversations)]
+            elapsed = time.perf_counter() - started
+            retained, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del kept
+            footprint[label] = retained / conversations / 1024
+            rows.append({
+                'benchmark': f"memory/{label}/{rounds}-rounds",
+                'ops_per_sec': conversations / elapsed,
+                'p50_ms': elapsed / conversations * 1000,
+                'p99_ms': elapsed / conversations * 1000,
+                'peak_kib': footprint[label],
+            })
+        if footprint['compact-compress'] >= footprint['legacy']:
+            failures.append(f"compact conversations ({footprint['compact-compress']:.1f} KiB) are not smaller than "
+                            f"the legacy layout ({footprint['legacy']:.1f} KiB) at {rounds} rounds")
+    return rows, failures
+
+# Cold start of the offline CLI commands against an empty state store. Fails when the median is
+# over STARTUP_BUDGET or when a command pulls in the mail/LLM stack.
+def bench_startup(min_time):
+    from state_store import StateStore
+    rows, failures = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'state.db')
+        StateStore(db_path).close()
+        for command in STARTUP_COMMANDS:
+            argv = [command, '--state-db', db_path]
+            timings = sorted(time_calls(
+                lambda: subprocess.run([sys.executable, CLI_PATH, *argv], check=True, capture_output=True), min_time))
+            rows.append({
+                'benchmark': f"startup/{command}",
+                'ops_per_sec': len(timings) / sum(timings),
+                'p50_ms': percentile(timings, 0.50) * 1000,
+                'p99_ms': percentile(timings, 0.99) * 1000,
+                'peak_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            })
+            if percentile(timings, 0.50) > STARTUP_BUDGET:
+                failures.append(f"cli.py {command} cold start {percentile(timings, 0.50):.2f}s is over the {STARTUP_BUDGET}s budget")
+
+            check = (f"import sys; sys.argv[0] = {CLI_PATH!r}; sys.path.insert(0, {os.path.dirname(CLI_PATH)!r}); "
+                     f"import cli; cli.main({argv!r}); "
+                     f"print('loaded:', *(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+            output = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True).stdout
+            loaded = output.rsplit('loaded:', 1)[-1].strip()
+            if loaded:
+                failures.append(f"cli.py {command} imports {loaded}")
+    return rows, failures
+
+BENCHMARK_GROUPS = {
+    'startup': bench_startup,
+    'scoring': bench_scoring,
+    'coverage': bench_coverage,
+    'normalize': bench_normalize,
+    'prompt': bench_prompt,
+    'llm': bench_llm,
+    'mime': bench_mime,
+    'scheduler': bench_scheduler,
+    'memory': bench_memory,
+}
+
+# Benchmarks whose throughput dropped more than tolerance below the baseline
+def compare_to_baseline(rows, baseline, tolerance):
+    regressions = []
+    for row in rows:
+        previous = baseline.get(row['benchmark'])
+        if previous and row['ops_per_sec'] < previous['ops_per_sec'] * (1 - tolerance):
+            change = row['ops_per_sec'] / previous['ops_per_sec'] - 1
+            regressions.append(f"{row['benchmark']}: {previous['ops_per_sec']:.1f} -> {row['ops_per_sec']:.1f} ops/s ({change:+.0%})")
+    return regressions
+
+def print_rows(rows, baseline=None):
+    print(f"{'benchmark':<36} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak KiB':>10} {'vs base':>8}")
+    for row in rows:
+        previous = (baseline or {}).get(row['benchmark'])
+        change = f"{row['ops_per_sec'] / previous['ops_per_sec'] - 1:+.0%}" if previous else ""
+        print(f"{row['benchmark']:<36} {row['ops_per_sec']:>10.1f} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} "
+              f"{row['peak_kib']:>10.1f} {change:>8}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the Wandero client simulator")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARK_GROUPS), help='Benchmark groups to run (default all)')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Seconds to spend on each measurement')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed throughput drop before a regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    rows, failures = [], []
+    for group in args.only or BENCHMARK_GROUPS:
+        try:
+            group_rows, group_failures = BENCHMARK_GROUPS[group](args.min_time)
+        except ImportError as e:
+            print(f"[BENCH] Skipping {group}: {e}")
+            continue
+        rows += group_rows
+        failures += group_failures
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_rows(rows, baseline)
+
+    if args.save_baseline:
+        # Keep entries for groups that were not run this time
+        baseline.update({row['benchmark']: row for row in rows})
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'saved_at': time.time(), 'results': baseline}, f, indent=2)
+        print(f"[BENCH] Baseline saved to {args.baseline}")
+    else:
+        failures += compare_to_baseline(rows, baseline, args.tolerance)
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  • {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
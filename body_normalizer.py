@@ -0,0 +1,144 @@
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+from conversation_context import count_tokens
+
+# An email's new content (text) and the body it came from, kept for audit, with how much was cut
+NormalizedBody = namedtuple('NormalizedBody', ['text', 'original', 'removed_bytes', 'removed_tokens'])
+
+# Lines after a sign-off ("Best regards,") that still count as the signature: name, company, phone
+MAX_SIGNATURE_LINES = 4
+MAX_SIGNATURE_LINE_CHARS = 60
+
+# Cheap first check for the lines that may start a reply header, before the exact patterns below
+_HEADER_START = re.compile(r'\s*(?:on\s|am\s|le\s|el\s|il\s|-{3,}|_{10,}|from:|begin forwarded)', re.IGNORECASE)
+# "On Tue, 5 Mar 2024, Sarah <sarah@example.com> wrote:" (and its usual translations)
+_ATTRIBUTION_END = re.compile(r'(?:wrote|schrieb|a écrit|escribió|ha scritto)\s*:\s*$', re.IGNORECASE)
+# Outlook/Apple separators above a copy of the previous email
+_SEPARATOR = re.compile(r'\s*(?:-{3,}\s*(?:original message|forwarded message)\s*-{3,}|_{10,}\s*$|begin forwarded message)',
+                        re.IGNORECASE)
+# Outlook's header block: "From: ..." followed by "Sent:"/"Date:"/"To:"/"Subject:"
+_OUTLOOK_FROM = re.compile(r'\s*from:\s*\S', re.IGNORECASE)
+_OUTLOOK_FIELD = re.compile(r'\s*(?:sent|date|to|cc|subject):', re.IGNORECASE)
+# Mobile mail footers; whatever follows is the quoted thread
+_MOBILE_FOOTER = re.compile(r'\s*(?:sent from my|get outlook for)\s', re.IGNORECASE)
+_SIGN_OFF = re.compile(r'\s*(?:(?:best|kind|warm|warmest|many)\s+(?:regards|wishes|thanks)|regards|cheers|sincerely|'
+                       r'best|thanks|thank you|all the best|yours truly|warmly)\s*[,.!]?\s*$', re.IGNORECASE)
+_BLANK_RUNS = re.compile(r'\n{3,}')
+
+# Whether lines[index] starts the quoted copy of an earlier email
+def _reply_header(lines, index):
+    line = lines[index]
+    if not _HEADER_START.match(line):
+        return False
+    if _SEPARATOR.match(line):
+        return True
+    if _ATTRIBUTION_END.search(line):
+        return True
+    lowered = line.lstrip().lower()
+    # Attributions wrapped over two lines by the sending client
+    if lowered.startswith(('on ', 'am ', 'le ', 'el ', 'il ')) and index + 1 < len(lines) and _ATTRIBUTION_END.search(lines[index + 1]):
+        return True
+    if _OUTLOOK_FROM.match(line):
+        return any(_OUTLOOK_FIELD.match(following) for following in lines[index + 1:index + 4])
+    return False
+
+# Whether the text after a reply header goes on with unquoted answers between the quotes
+def _interleaved(lines, index):
+    following = [line.lstrip() for line in lines[index + 1:] if line.strip()]
+    return bool(following) and following[0].startswith('>') and any(not line.startswith('>') for line in following)
+
+# Index in lines where a trailing "Best regards, / Name / Company" block starts, or None
+def _signature_start(lines):
+    trailing = 0
+    for index in range(len(lines) - 1, -1, -1):
+        line = lines[index]
+        if not line.strip():
+            continue
+        if _SIGN_OFF.match(line):
+            return index
+        trailing += 1
+        if trailing > MAX_SIGNATURE_LINES or len(line.strip()) > MAX_SIGNATURE_LINE_CHARS:
+            return None
+    return None
+
+# Plain-text body without quoted lines, the quoted thread below a reply header, and the signature.
+# Replies quoting inline ("> question" then the answer) keep their answers.
+def strip_quoted_text(text):
+    lines = text.splitlines()
+    kept = []
+    for index, line in enumerate(lines):
+        stripped = line.lstrip()
+        if stripped.startswith('>'):
+            continue
+        if line.rstrip() == '--' or line == '-- ' or _MOBILE_FOOTER.match(line):
+            break
+        if _reply_header(lines, index):
+            if _interleaved(lines, index):
+                continue
+            break
+        kept.append(line)
+    start = _signature_start(kept)
+    # A body that is nothing but "Thanks!" keeps it
+    if start is not None and any(line.strip() for line in kept[:start]):
+        del kept[start:]
+    return _BLANK_RUNS.sub('\n\n', '\n'.join(kept)).strip()
+
+# Text of an HTML body, leaving out scripts, styles and quoted replies (blockquotes and the
+# quote containers Gmail, Outlook, Yahoo and Thunderbird wrap the previous email in)
+class _HTMLText(HTMLParser):
+    SKIP = frozenset(('script', 'style', 'head', 'title', 'blockquote'))
+    BREAKS = frozenset(('br', 'p', 'div', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table'))
+    QUOTE_MARKERS = ('quote', 'divrplyfwdmsg', 'moz-cite-prefix', 'appendonsend')
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = None  # tag being skipped
+        self._depth = 0  # nesting of that tag inside itself
+
+    def handle_starttag(self, tag, attrs):
+        if self._skipping is not None:
+            if tag == self._skipping:
+                self._depth += 1
+            return
+        marker = ' '.join(value for name, value in attrs if name in ('class', 'id') and value).lower()
+        if tag in self.SKIP or (marker and any(quote in marker for quote in self.QUOTE_MARKERS)):
+            self._skipping, self._depth = tag, 1
+            return
+        if tag in self.BREAKS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if self._skipping is not None:
+            if tag == self._skipping:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._skipping = None
+            return
+        if tag in self.BREAKS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self._skipping is None:
+            self.parts.append(data)
+
+def html_to_text(markup):
+    parser = _HTMLText()
+    parser.feed(markup)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.parts).splitlines())
+    return _BLANK_RUNS.sub('\n\n', '\n'.join(lines)).strip()
+
+# Reduce an email body to what its sender newly wrote. Runs before a reply reaches the history,
+# the prompts and the scoring, so quoted client text neither grows every later prompt nor earns
+# Wandero credit for the client's own words. html: the body is an HTML-only part.
+def normalize_body(body, html=False):
+    if not body:
+        return NormalizedBody("", body or "", 0, 0)
+    text = strip_quoted_text(html_to_text(body) if html else body)
+    if text == body.strip():
+        return NormalizedBody(text, body, 0, 0)
+    return NormalizedBody(text, body, len(body.encode('utf-8')) - len(text.encode('utf-8')),
+                          max(0, count_tokens(body) - count_tokens(text)))
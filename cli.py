@@ -0,0 +1,170 @@
+import argparse
+import os
+import sys
+
+# Command-line entry point. Each subcommand imports what it needs when it runs, so the offline
+# commands (rescore, report) start without loading the OpenAI SDK, the IMAP client or .env.
+#
+#   python cli.py run --clients 50 --transport memory   # the simulator (same options as simulator.py)
+#   python cli.py rescore --run-id default              # re-score stored transcripts with the current scoring
+#   python cli.py report --run-id default               # analytics saved in the checkpoints
+#   python cli.py export-wandero --run-id default -o wandero.json   # Wandero's replies, for --wandero-replay
+#   python cli.py fill-pool --pool personas.db --size 1000   # pre-generate personas for --persona-pool
+#   python cli.py bench --only scoring startup          # benchmarks (same options as benchmarks.py)
+
+# Subcommands whose remaining arguments are handed to another module's main()
+PASSTHROUGH = ('run', 'bench')
+
+def _open_store(path):
+    from state_store import StateStore
+    if not os.path.exists(path):
+        sys.exit(f"No state store at {path}")
+    return StateStore(path)
+
+def _conversation_prefix(run_id):
+    return f"{run_id}/" if run_id else ""
+
+# One line per conversation plus fleet-wide averages and response-time percentiles
+def _print_report(title, results):
+    from latency import LatencyHistogram
+    print("\n" + "=" * 50)
+    print(f"{title} ({len(results)} conversations)")
+    print("=" * 50)
+    scores = []
+    fleet_latency = LatencyHistogram()
+    for conversation_id, analytics in results:
+        score = analytics.calculate_wandero_performance_score()
+        scores.append(score)
+        fleet_latency.merge(analytics.response_times)
+        print(f"  • {conversation_id}: {analytics.emails_sent} sent | {analytics.emails_received} received | "
+              f"Score: {score:.1f}/100")
+    if scores:
+        print(f"\nAverage score: {sum(scores) / len(scores):.1f}/100")
+    if fleet_latency:
+        latency = fleet_latency.summary()
+        print(f"Wandero response times ({latency['count']} replies): p50 {latency['p50']/60:.1f} | "
+              f"p95 {latency['p95']/60:.1f} | p99 {latency['p99']/60:.1f} | max {latency['max']/60:.1f} minutes")
+
+def cmd_run(args, rest):
+    import simulator
+    simulator.main(rest)
+
+def cmd_bench(args, rest):
+    import benchmarks
+    benchmarks.main(rest)
+
+# Score every stored conversation again from its journaled transcript
+def cmd_rescore(args, rest):
+    from analytics import ConversationAnalytics
+    store = _open_store(args.state_db)
+    try:
+        results = []
+        for conversation_id in store.conversation_ids(_conversation_prefix(args.run_id)):
+            history = store.load_history(conversation_id)
+            response_times = [payload['seconds'] for _, payload, _ in store.load_events(conversation_id, 'response_time')]
+            analytics = ConversationAnalytics.from_transcript(history, response_times)
+            results.append((conversation_id, analytics))
+            if args.detail:
+                print(f"\n--- {conversation_id} ---")
+                analytics.print_summary()
+        _print_report("RESCORED", results)
+    finally:
+        store.close()
+
+# Summarize the analytics saved in each conversation's checkpoint
+def cmd_report(args, rest):
+    from analytics import ConversationAnalytics
+    store = _open_store(args.state_db)
+    try:
+        results = []
+        for conversation_id in store.conversation_ids(_conversation_prefix(args.run_id)):
+            saved = store.load_checkpoint(conversation_id)
+            analytics = ConversationAnalytics.from_state(saved['analytics'])
+            results.append((conversation_id, analytics))
+            if args.detail:
+                print(f"\n--- {conversation_id} ({'completed' if saved.get('completed') else 'in progress'}) ---")
+                analytics.print_summary()
+        _print_report("REPORT", results)
+    finally:
+        store.close()
+
+# Write every stored conversation's Wandero replies with their delays as a recording for
+# simulator.py --wandero-replay. A reply's delay runs from the client email before it to when the
+# reply was journaled, so a run without IDLE includes its polling lag.
+def cmd_export_wandero(args, rest):
+    import json
+    store = _open_store(args.state_db)
+    try:
+        threads = {}
+        for conversation_id in store.conversation_ids(_conversation_prefix(args.run_id)):
+            replies = []
+            sent_at = None
+            for sender, body, created_at in store.load_history(conversation_id, with_times=True):
+                if sender == "Client":
+                    sent_at = created_at
+                elif sent_at is not None:
+                    replies.append({'delay': round(created_at - sent_at, 3), 'body': body})
+            if replies:
+                threads[conversation_id.rpartition('/')[2]] = replies
+    finally:
+        store.close()
+    with open(args.output, 'w') as f:
+        json.dump({'threads': threads}, f, indent=1)
+    print(f"Wrote {sum(len(replies) for replies in threads.values())} replies from {len(threads)} conversations to {args.output}")
+
+# Generate personas and their initial emails ahead of a run until the pool holds --size of them
+def cmd_fill_pool(args, rest):
+    import asyncio
+    from config import ConfigError, get_settings
+    from persona_pool import open_persona_pool
+
+    try:
+        get_settings().validate(['OPENAI_API_KEY', 'COMPANY_NAME', 'COMPANY_COUNTRY'])
+    except ConfigError as e:
+        sys.exit(str(e))
+    pool = open_persona_pool(args.pool)
+    try:
+        missing = max(0, args.size - pool.available())
+        print(f"Generating {missing} openers ({pool.available()} already in {args.pool})")
+        added = asyncio.run(pool.fill(missing, args.concurrency))
+        print(f"Added {added} openers ({pool.failed} failed); {pool.available()} in the pool")
+    finally:
+        pool.close()
+
+COMMANDS = {
+    'run': cmd_run,
+    'rescore': cmd_rescore,
+    'report': cmd_report,
+    'bench': cmd_bench,
+    'export-wandero': cmd_export_wandero,
+    'fill-pool': cmd_fill_pool,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cli.py', description="Wandero Client Simulator")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('run', add_help=False, help="run the simulator (options as in simulator.py --help)")
+    subcommands.add_parser('bench', add_help=False, help="run the benchmarks (options as in benchmarks.py --help)")
+    for name, help_text in (('rescore', "re-score stored transcripts with the current scoring engine"),
+                            ('report', "summarize the analytics saved in the state store"),
+                            ('export-wandero', "write Wandero's stored replies as a recording for --wandero-replay")):
+        command = subcommands.add_parser(name, help=help_text)
+        command.add_argument('--state-db', default='wandero_state.db', help="SQLite state store written by the simulator")
+        command.add_argument('--run-id', default='default', help="run to report on (empty for every run)")
+        if name == 'export-wandero':
+            command.add_argument('-o', '--output', default='wandero_recording.json', help="recording file to write")
+        else:
+            command.add_argument('--detail', action='store_true', help="print the full analysis for each conversation")
+
+    fill_pool = subcommands.add_parser('fill-pool', help="pre-generate personas and initial emails for --persona-pool")
+    fill_pool.add_argument('--pool', default='personas.db', help="SQLite pool file to fill")
+    fill_pool.add_argument('--size', type=int, default=1000, help="openers the pool should hold afterwards")
+    fill_pool.add_argument('--concurrency', type=int, default=16, help="initial emails generated at once")
+
+    args, rest = parser.parse_known_args(argv)
+    if rest and args.command not in PASSTHROUGH:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    COMMANDS[args.command](args, rest)
+
+if __name__ == "__main__":
+    main()
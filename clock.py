@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import selectors
+import threading
+import time
+
+CLOCK_MODES = ('real', 'virtual')
+
+# Wall-clock time a virtual run starts at (2024-01-01 00:00 UTC), so replays timestamp identically
+VIRTUAL_EPOCH = 1704067200.0
+
+# Runs callbacks after a delay from one daemon thread holding a heap, so thousands of pending
+# callbacks (e.g. fake Wandero replies) cost one heap entry each rather than one timer thread each
+class TimerThread:
+    def __init__(self, name="clock-timers"):
+        self._heap = []  # (due, sequence, callback, args)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, callback, *args):
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), next(self._sequence), callback, args))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"[CLOCK] Timer callback failed: {e}")
+
+# Time as the simulated scenario sees it: analytics timestamps and response times, the state
+# store journal, the in-memory mailbox and the fake Wandero's reply delays. Timings of the
+# simulator itself (metrics, tracing, LLM latency) measure real work and keep using perf_counter.
+class Clock:
+    virtual = False
+
+    def __init__(self):
+        self._timers = None
+        self._lock = threading.Lock()
+
+    def time(self):
+        """Wall-clock seconds since the epoch"""
+        return time.time()
+
+    def monotonic(self):
+        """Seconds for measuring intervals"""
+        return time.monotonic()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds, from the clock's timer thread"""
+        with self._lock:
+            if self._timers is None:
+                self._timers = TimerThread()
+        self._timers.call_later(delay, callback, *args)
+
+    def run(self, main):
+        """asyncio.run() on an event loop that follows this clock"""
+        return asyncio.run(main)
+
+# Discrete-event clock: time only moves when the event loop has nothing left to run, and then
+# jumps straight to the next timer, so a scenario that waits for hours finishes as fast as its
+# work allows. Blocking calls run inline on the loop thread (they take no virtual time), which
+# keeps the run single-threaded and, with seeded randomness, reproducible to the event.
+# Anything doing real I/O would see time jump while it waits, so virtual time only suits the
+# offline parts: the in-memory transport and replayed LLM completions.
+class VirtualClock(Clock):
+    virtual = True
+
+    def __init__(self, start=VIRTUAL_EPOCH):
+        super().__init__()
+        self.start = start
+        self.elapsed = 0.0  # virtual seconds since start, all of them skipped rather than waited for
+        self._loop = None
+
+    def time(self):
+        return self.start + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) once virtual time has moved on by delay seconds"""
+        if self._loop is None:
+            raise RuntimeError("VirtualClock.call_later needs the clock's event loop (run it with clock.run())")
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, callback, *args)
+
+    def new_event_loop(self):
+        self._loop = VirtualTimeEventLoop(self)
+        return self._loop
+
+    def run(self, main):
+        with asyncio.Runner(loop_factory=self.new_event_loop) as runner:
+            return runner.run(main)
+
+# Selector that, instead of blocking until the next timer is due, moves the virtual clock there
+class _VirtualSelector:
+    def __init__(self, clock):
+        self.clock = clock
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # No timers at all: only a real event (e.g. the executor shutting down) can come next
+            return self._selector.select(None)
+        self.clock.advance(timeout)
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+# Event loop whose time() is the virtual clock and whose executor is the loop thread itself
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.monotonic()
+
+    def run_in_executor(self, executor, func, *args):
+        """Run the blocking call inline; in virtual time it takes no time"""
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+_clock = Clock()
+
+# Clock used by the simulator, analytics and the in-memory transport
+def get_clock():
+    return _clock
+
+# Switch the process to real or virtual time (before starting the event loop)
+def configure_clock(mode='real', start=None):
+    global _clock
+    if mode not in CLOCK_MODES:
+        raise ValueError(f"Unknown clock {mode!r}, expected one of {', '.join(CLOCK_MODES)}")
+    if mode == 'virtual':
+        _clock = VirtualClock(VIRTUAL_EPOCH if start is None else start)
+    else:
+        _clock = Clock()
+    return _clock
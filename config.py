@@ -1,28 +1,128 @@
 import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv(override=True)
-
-# Email configuration
-EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
-EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
-WANDERO_EMAIL = os.getenv('WANDERO_EMAIL')
-COMPANY_NAME = os.getenv('COMPANY_NAME')
-COMPANY_COUNTRY = os.getenv('COMPANY_COUNTRY')
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-
-# Gmail IMAP/SMTP settings
-IMAP_HOST = 'imap.gmail.com'
-SMTP_HOST = 'smtp.gmail.com'
-SMTP_PORT = 587
-
-# Debug: Print loaded values
-print(f"[DEBUG] Loaded WANDERO_EMAIL: {WANDERO_EMAIL}")
-print(f"[DEBUG] Loaded EMAIL_ADDRESS: {EMAIL_ADDRESS}")
-print(f"[DEBUG] Loaded COMPANY_NAME: {COMPANY_NAME}")
-print(f"[DEBUG] Loaded COMPANY_COUNTRY: {COMPANY_COUNTRY}")
-
-# Initialize OpenAI
-import openai
-openai.api_key = OPENAI_API_KEY 
\ No newline at end of file
+
+# Raised when an environment setting is present but invalid
+class ConfigError(ValueError):
+    pass
+
+def _int(value):
+    return int(value)
+
+def _float(value):
+    return float(value)
+
+def _floats(count):
+    def parse(value):
+        values = tuple(float(part) for part in value.split(','))
+        if len(values) != count:
+            raise ValueError(f"expected {count} comma-separated numbers")
+        return values
+    return parse
+
+def _choice(*choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}")
+        return value
+    return parse
+
+# Every setting: name -> (default, parser). The environment variable has the same name; empty
+# values count as unset. Nothing is read until a setting is first used.
+SETTINGS = {
+    # Email configuration
+    'EMAIL_ADDRESS': (None, str),
+    'EMAIL_PASSWORD': (None, str),
+    'WANDERO_EMAIL': (None, str),
+    'COMPANY_NAME': (None, str),
+    'COMPANY_COUNTRY': (None, str),
+    'OPENAI_API_KEY': (None, str),
+
+    # Gmail IMAP/SMTP settings (override to point at another mail server)
+    'IMAP_HOST': ('imap.gmail.com', str),
+    'SMTP_HOST': ('smtp.gmail.com', str),
+    'SMTP_PORT': (587, _int),
+
+    # Mail transport: 'imap' uses the servers above, 'memory' runs fully offline against an
+    # in-memory mailbox and a scripted fake Wandero whose reply delay follows WANDERO_LATENCY
+    'MAIL_TRANSPORT': ('imap', _choice('imap', 'memory')),
+    'WANDERO_LATENCY': ('lognormal:60,0.6', str),
+
+    # Prompt context limits: recent turns kept verbatim, token budget for the conversation part of
+    # the prompt, and the size of the rolling summary of older turns
+    'CONTEXT_KEEP_TURNS': (6, _int),
+    'CONTEXT_TOKEN_BUDGET': (1500, _int),
+    'CONTEXT_SUMMARY_TOKENS': (250, _int),
+
+    # LLM completion cache: mode is off, readwrite, record or replay (see llm_cache.py); TTL in
+    # seconds (unset = never expires). A fixed LLM_SEED makes recorded runs reproducible.
+    'LLM_CACHE_MODE': ('off', _choice('off', 'readwrite', 'record', 'replay')),
+    'LLM_CACHE_PATH': ('llm_cache.db', str),
+    'LLM_CACHE_SIZE': (1024, _int),
+    'LLM_CACHE_TTL': (None, _float),
+    'LLM_SEED': (None, _int),
+
+    # Shared LLM gateway limits: concurrent API calls, tokens-per-minute budget (unset = unlimited)
+    # and retries for rate-limit/server errors before a call fails
+    'LLM_MAX_CONCURRENCY': (8, _int),
+    'LLM_TOKENS_PER_MINUTE': (None, _int),
+    'LLM_MAX_RETRIES': (5, _int),
+    # USD per million input, cached input and output tokens (gpt-4o-mini), for the usage report
+    'LLM_PRICES': ((0.15, 0.075, 0.6), _floats(3)),
+
+    # Conversation transcripts: turns kept as plain text; older bodies are zlib-compressed in
+    # memory ('compress'), spilled to a temporary file ('spill') or left alone ('off')
+    'TRANSCRIPT_KEEP_RECENT': (8, _int),
+    'TRANSCRIPT_COLD_STORAGE': ('compress', _choice('off', 'compress', 'spill')),
+
+    # Pre-generated personas and initial emails (see persona_pool.py): SQLite file used when set,
+    # and the size a background refill brings it back to
+    'PERSONA_POOL_PATH': (None, str),
+    'PERSONA_POOL_SIZE': (200, _int),
+
+    # Port for the Prometheus metrics endpoint (unset = no endpoint)
+    'METRICS_PORT': (None, _int),
+}
+
+# Settings read from the environment on first access and cached. Importing this module has no
+# side effects: .env is only loaded by get_settings(), and OpenAI is configured where it is used.
+class Settings:
+    def __init__(self, environ=None):
+        self._environ = os.environ if environ is None else environ
+
+    def __getattr__(self, name):
+        if name not in SETTINGS:
+            raise AttributeError(f"Unknown setting {name}")
+        default, parse = SETTINGS[name]
+        raw = self._environ.get(name)
+        if raw is None or raw == "":
+            value = default
+        else:
+            try:
+                value = parse(raw)
+            except ValueError as e:
+                raise ConfigError(f"Invalid {name}={raw!r}: {e}") from None
+        setattr(self, name, value)  # cache; later reads skip __getattr__
+        return value
+
+    def validate(self, required=()):
+        """Parse every setting and check the required ones are set; raises ConfigError listing all problems"""
+        problems = []
+        for name in SETTINGS:
+            try:
+                getattr(self, name)
+            except ConfigError as e:
+                problems.append(str(e))
+        problems += [f"{name} is not set" for name in required if getattr(self, name, None) is None]
+        if problems:
+            raise ConfigError("; ".join(problems))
+        return self
+
+_settings = None
+
+# Shared settings, loading .env into the environment the first time
+def get_settings():
+    global _settings
+    if _settings is None:
+        from dotenv import load_dotenv
+        load_dotenv(override=True)
+        _settings = Settings()
+    return _settings
@@ -0,0 +1,134 @@
+from collections import deque
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _encoding = None
+
+# Count (or estimate, ~4 characters per token) the tokens in a piece of text
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+# Summary used when no LLM summarizer is available: first sentence of each aged-out turn
+def extractive_summary(previous_summary, turns, max_chars=160):
+    lines = [previous_summary] if previous_summary else []
+    for sender, message in turns:
+        first = message.strip().split('\n', 1)[0]
+        first = first.split('. ', 1)[0]
+        lines.append(f"{sender}: {first[:max_chars]}")
+    return '\n'.join(lines)
+
+# Prompt context for one conversation: the last keep_turns turns verbatim plus a rolling
+# summary of everything older. The summary is only recomputed when turns age out, and the
+# rendered text is kept inside token_budget so prompt size stays flat as the thread grows.
+class ConversationContext:
+    def __init__(self, keep_turns=6, token_budget=1500, summarizer=None):
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summarizer = summarizer or extractive_summary
+        self.summary = ""
+        self.turns = deque()
+        self.seen = 0  # how many history entries have been added
+        self.history_start = 0  # entries before the first one of the history sync() is given (a resume loads only the tail)
+        self.summaries_computed = 0
+        self.prompt_tokens = []  # prompt tokens reported for each LLM call using this context
+        self.cached_tokens = []  # how many of those the provider served from its prompt cache
+        self._aged_out = []
+
+    def add(self, sender, message):
+        """Add one turn; turns beyond keep_turns wait to be folded into the summary"""
+        self.turns.append((sender, message))
+        self.seen += 1
+        while len(self.turns) > self.keep_turns:
+            self._aged_out.append(self.turns.popleft())
+
+    def sync(self, history):
+        """Add any history entries not seen yet (only the new tail is processed)"""
+        for sender, message in history[self.seen - self.history_start:]:
+            self.add(sender, message)
+
+    def _fold(self):
+        """Fold aged-out turns into the rolling summary"""
+        if not self._aged_out:
+            return
+        try:
+            self.summary = self.summarizer(self.summary, self._aged_out)
+        except Exception as e:
+            print(f"[CONTEXT] Summarizer failed ({e}), using extractive summary")
+            self.summary = extractive_summary(self.summary, self._aged_out)
+        self.summaries_computed += 1
+        self._aged_out = []
+
+    async def _fold_async(self, summarizer):
+        """Same as _fold but with an async summarizer"""
+        if not self._aged_out:
+            return
+        try:
+            self.summary = await summarizer(self.summary, self._aged_out)
+        except Exception as e:
+            print(f"[CONTEXT] Summarizer failed ({e}), using extractive summary")
+            self.summary = extractive_summary(self.summary, self._aged_out)
+        self.summaries_computed += 1
+        self._aged_out = []
+
+    def _turns_text(self):
+        return '\n\n'.join(f"{sender}: {message}" for sender, message in self.turns)
+
+    def _over_budget(self):
+        # Always keep the latest turn verbatim
+        return len(self.turns) > 1 and count_tokens(self.summary) + count_tokens(self._turns_text()) > self.token_budget
+
+    def _compose(self):
+        summary = self.summary
+        summary_budget = self.token_budget - count_tokens(self._turns_text())
+        if count_tokens(summary) > max(summary_budget, 0):
+            # Keep the most recent part of an oversized summary
+            summary = summary[-max(summary_budget, 0) * 4:] if summary_budget > 0 else ""
+        if summary:
+            return f"Summary of earlier emails:\n{summary}\n\nRecent emails:\n{self._turns_text()}\n\n"
+        return f"{self._turns_text()}\n\n"
+
+    def render(self):
+        """Conversation text for the prompt: summary of older turns followed by recent turns verbatim"""
+        self._fold()
+        # Age out more turns while over budget
+        while self._over_budget():
+            self._aged_out.append(self.turns.popleft())
+            self._fold()
+        return self._compose()
+
+    async def render_async(self, summarizer):
+        """render() for the event loop, folding turns with an async summarizer"""
+        await self._fold_async(summarizer)
+        while self._over_budget():
+            self._aged_out.append(self.turns.popleft())
+            await self._fold_async(summarizer)
+        return self._compose()
+
+    def record_prompt_tokens(self, tokens, cached_tokens=0):
+        """Remember the prompt size of an LLM call made with this context (and its prompt-cache hit)"""
+        self.prompt_tokens.append(tokens)
+        self.cached_tokens.append(cached_tokens)
+
+    def to_state(self):
+        """JSON-serializable snapshot (saved with the conversation checkpoint)"""
+        return {
+            'summary': self.summary,
+            'turns': [list(turn) for turn in self.turns],
+            'aged_out': [list(turn) for turn in self._aged_out],
+            'seen': self.seen,
+            'summaries_computed': self.summaries_computed,
+        }
+
+    def load_state(self, state):
+        """Restore a to_state() snapshot"""
+        self.summary = state.get('summary', "")
+        self.turns = deque(tuple(turn) for turn in state.get('turns', []))
+        self._aged_out = [tuple(turn) for turn in state.get('aged_out', [])]
+        self.seen = state.get('seen', len(self.turns))
+        self.summaries_computed = state.get('summaries_computed', 0)
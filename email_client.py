@@ -1,139 +1,798 @@
 from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientAbortError
+import base64
+import imaplib
+import quopri
+import re
 import smtplib
+import ssl
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from datetime import datetime
 from email.message import EmailMessage
-from email import message_from_bytes
-from email.header import decode_header
-from config import *
+from email.header import decode_header, make_header
+from email.utils import make_msgid
+from config import get_settings
+from metrics import get_metrics
+from body_normalizer import normalize_body
+from tracing import span
+from transcript import Transcript
 
 # Conversation history
-conversation_history = []
+conversation_history = Transcript()
+
+# Open an authenticated IMAP connection with the folder selected (raises on failure)
+def _imap_login(folder='INBOX', readonly=False):
+    settings = get_settings()
+    with span('imap.connect', folder=folder):
+        server = IMAPClient(settings.IMAP_HOST, ssl=True)
+        server.login(settings.EMAIL_ADDRESS, settings.EMAIL_PASSWORD)
+        server.select_folder(folder, readonly=readonly)
+    return server
 
 # Connect to IMAP (for receiving emails)
 def connect_imap():
     try:
-        server = IMAPClient(IMAP_HOST, ssl=True)
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        server.select_folder('INBOX')
-        return server
+        return _imap_login()
     except Exception as e:
         print(f"[IMAP] Connection error: {e}")
         return None
 
+# Errors that mean the IMAP connection itself is gone and must be re-established
+IMAP_CONNECTION_ERRORS = (IMAPClientAbortError, imaplib.IMAP4.abort, OSError)
+
+# Long-lived IMAP connection reused across checks instead of logging in on every poll
+class IMAPSession:
+    def __init__(self, folder='INBOX'):
+        self.folder = folder
+        self.server = None
+        self.handshakes = 0
+        self.reconnects = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        """Open, authenticate and select the folder"""
+        server = _imap_login(self.folder)
+        self.handshakes += 1
+        return server
+
+    def _drop(self):
+        """Forget a broken connection so the next call reconnects"""
+        if self.server is not None:
+            try:
+                self.server.shutdown()
+            except Exception:
+                pass
+        self.server = None
+
+    def run(self, operation, *args):
+        """Run operation(server, *args), reconnecting once if the connection dropped"""
+        with self.lock:
+            for attempt in range(2):
+                if self.server is None:
+                    self.server = self._connect()
+                try:
+                    return operation(self.server, *args)
+                except IMAP_CONNECTION_ERRORS as e:
+                    print(f"[IMAP] Connection lost ({e}), reconnecting...")
+                    self._drop()
+                    self.reconnects += 1
+                    if attempt:
+                        raise
+
+    def close(self):
+        """Log out and close the connection"""
+        with self.lock:
+            if self.server is not None:
+                try:
+                    self.server.logout()
+                except Exception:
+                    pass
+            self.server = None
+
+_imap_session = None
+
+# Shared IMAP session used when callers don't pass their own
+def get_imap_session():
+    global _imap_session
+    if _imap_session is None:
+        _imap_session = IMAPSession()
+    return _imap_session
+
+# Dedicated IMAP connection sitting in IDLE that reports new mail the moment the server pushes it.
+# Listeners are called from the watcher thread; when the server lacks IDLE the watcher stops and
+# callers simply fall back to polling on their own timeout.
+class MailboxWatcher:
+    def __init__(self, folder='INBOX', renew_interval=600, check_timeout=5, retry_delay=30):
+        self.folder = folder
+        self.renew_interval = renew_interval  # RFC 2177 asks clients to re-issue IDLE within 29 minutes
+        self.check_timeout = check_timeout
+        self.retry_delay = retry_delay
+        self.listeners = []
+        self.handshakes = 0
+        self.pushes = 0
+        self.last_push_time = None
+        self.supports_idle = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """Register callback() to be called whenever new mail arrives"""
+        self.listeners.append(callback)
+
+    def start(self):
+        """Start the IDLE thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="imap-idle", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the IDLE thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_timeout + 1)
+            self._thread = None
+
+    def _notify(self):
+        self.pushes += 1
+        self.last_push_time = time.time()
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[IMAP] IDLE listener error: {e}")
+
+    def _idle_once(self, server):
+        """Stay in IDLE until new mail arrives, the renew interval passes or we are stopped"""
+        deadline = time.time() + self.renew_interval
+        server.idle()
+        try:
+            while not self._stop.is_set() and time.time() < deadline:
+                responses = server.idle_check(timeout=self.check_timeout)
+                if any(len(response) > 1 and response[1] in (b'EXISTS', b'RECENT') for response in responses):
+                    return True
+            return False
+        finally:
+            server.idle_done()
+
+    def _run(self):
+        while not self._stop.is_set():
+            server = None
+            try:
+                server = _imap_login(self.folder, readonly=True)
+                self.handshakes += 1
+                self.supports_idle = b'IDLE' in server.capabilities()
+                if not self.supports_idle:
+                    print("[IMAP] Server does not support IDLE, falling back to polling")
+                    return
+                print("[IMAP] IDLE watcher connected")
+                while not self._stop.is_set():
+                    if self._idle_once(server):
+                        self._notify()
+            except Exception as e:
+                print(f"[IMAP] IDLE watcher error: {e}. Reconnecting in {self.retry_delay} seconds...")
+                self._stop.wait(self.retry_delay)
+            finally:
+                if server is not None:
+                    try:
+                        server.logout()
+                    except Exception:
+                        pass
+
+# Open an authenticated SMTP connection (raises on failure)
+def _smtp_login():
+    settings = get_settings()
+    with span('smtp.connect'):
+        smtp = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT)
+        try:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.login(settings.EMAIL_ADDRESS, settings.EMAIL_PASSWORD)
+        except Exception:
+            smtp.close()
+            raise
+    return smtp
+
 # Connect to SMTP (for sending emails)
 def connect_smtp():
     try:
-        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        return smtp
+        return _smtp_login()
     except Exception as e:
         print(f"[SMTP] Connection error: {e}")
         return None
 
-# Send email via Gmail SMTP
-def send_email(subject, body, to_email=WANDERO_EMAIL, in_reply_to=None, references=None):
-    smtp = connect_smtp()
-    if not smtp:
-        print("[SMTP] Could not send email: SMTP connection failed.")
-        return False
+# Errors that mean an SMTP connection is unusable and has to be replaced
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, ssl.SSLError)
+
+# Pool of authenticated SMTP connections kept warm between sends.
+# Connections idle longer than health_check_after are checked with NOOP before reuse.
+class SMTPPool:
+    def __init__(self, size=4, health_check_after=30):
+        self.size = size
+        self.health_check_after = health_check_after
+        self._idle = []  # (smtp, last_used) pairs, most recently used last
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._outbox = deque()
+        self.connections_opened = 0
+        self.reconnects = 0
+        self.sent = 0
+        self.failed = 0
+        self.send_time_total = 0.0
+        self.send_time_max = 0.0
+
+    def _open(self):
+        smtp = _smtp_login()
+        self.connections_opened += 1
+        return smtp
+
+    def _is_healthy(self, smtp, last_used):
+        """Recently used connections are trusted; older ones must answer NOOP"""
+        if time.time() - last_used < self.health_check_after:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _discard(self, smtp):
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Take a live connection from the pool, opening one if none is idle"""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    smtp, last_used = self._idle.pop()
+                if self._is_healthy(smtp, last_used):
+                    return smtp
+                self._discard(smtp)
+                self.reconnects += 1
+            return self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, smtp, broken=False):
+        """Return a connection to the pool (broken ones are closed instead)"""
+        if broken:
+            self._discard(smtp)
+        else:
+            with self._lock:
+                self._idle.append((smtp, time.time()))
+        self._slots.release()
+
+    def _send_on(self, smtp, msg):
+        """Send one message on smtp, returning the connection to use next (replaced if it dropped)"""
+        started = time.perf_counter()
+        try:
+            smtp.send_message(msg)
+        except SMTP_CONNECTION_ERRORS:
+            # The server closed a warm connection; reconnect once and retry. A failure from here on
+            # leaves no connection to hand back, so it is raised as a connection error.
+            self._discard(smtp)
+            self.reconnects += 1
+            smtp = None
+            try:
+                smtp = self._open()
+                smtp.send_message(msg)
+            except Exception as e:
+                if smtp is not None:
+                    self._discard(smtp)
+                raise smtplib.SMTPServerDisconnected(f"Resending after a reconnect failed: {e}") from e
+        elapsed = time.perf_counter() - started
+        self.sent += 1
+        self.send_time_total += elapsed
+        self.send_time_max = max(self.send_time_max, elapsed)
+        return smtp
+
+    def send(self, msg):
+        """Send one message over a pooled connection"""
+        try:
+            smtp = self.acquire()
+        except Exception as e:
+            self.failed += 1
+            print(f"[SMTP] Connection error: {e}")
+            return False
+        # A connection that failed a send is never trusted again
+        broken = True
+        try:
+            smtp = self._send_on(smtp, msg)
+            broken = False
+            return True
+        except Exception as e:
+            self.failed += 1
+            print(f"[SMTP] Failed to send email: {e}")
+            return False
+        finally:
+            self.release(smtp, broken=broken)
+
+    def queue(self, msg):
+        """Add a message to the outbox for the next flush()"""
+        self._outbox.append(msg)
+
+    def flush(self):
+        """Send every queued message over one connection (replaced after a failed send), returns (sent, failed)"""
+        sent = failed = 0
+        if not self._outbox:
+            return sent, failed
+        try:
+            smtp = self.acquire()
+        except Exception as e:
+            print(f"[SMTP] Connection error: {e}")
+            return sent, failed
+        broken = False
+        try:
+            while self._outbox:
+                msg = self._outbox.popleft()
+                try:
+                    smtp = self._send_on(smtp, msg)
+                    sent += 1
+                except SMTP_CONNECTION_ERRORS as e:
+                    # Connection is gone even after a retry; keep the rest queued for next time
+                    self._outbox.appendleft(msg)
+                    broken = True
+                    print(f"[SMTP] Flush stopped, connection lost: {e}")
+                    break
+                except Exception as e:
+                    self.failed += 1
+                    failed += 1
+                    print(f"[SMTP] Failed to send queued email: {e}")
+                    # A connection that failed a send is never trusted again; the rest go out on a fresh one
+                    self.release(smtp, broken=True)
+                    smtp = None
+                    if not self._outbox:
+                        break
+                    try:
+                        smtp = self.acquire()
+                    except Exception as e:
+                        print(f"[SMTP] Flush stopped, connection error: {e}")
+                        break
+        finally:
+            if smtp is not None:
+                self.release(smtp, broken=broken)
+        return sent, failed
+
+    def stats(self):
+        """Counters for sends through this pool"""
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'queued': len(self._outbox),
+            'connections_opened': self.connections_opened,
+            'reconnects': self.reconnects,
+            'avg_send_seconds': self.send_time_total / self.sent if self.sent else 0.0,
+            'max_send_seconds': self.send_time_max,
+        }
+
+    def close(self):
+        """Quit every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            try:
+                smtp.quit()
+            except Exception:
+                self._discard(smtp)
+
+_smtp_pool = None
+
+# Shared SMTP pool used when callers don't pass their own
+def get_smtp_pool():
+    global _smtp_pool
+    if _smtp_pool is None:
+        _smtp_pool = SMTPPool()
+    return _smtp_pool
+
+# A new globally unique Message-ID on the sender's domain (explicit so make_msgid never does a DNS lookup)
+def new_message_id():
+    address = get_settings().EMAIL_ADDRESS or ""
+    return make_msgid(domain=address.rpartition('@')[2] or 'wandero-simulator')
+
+# Build an outgoing email with its Message-ID and threading headers (to_email defaults to WANDERO_EMAIL)
+def build_email(subject, body, to_email=None, in_reply_to=None, references=None, message_id=None):
+    settings = get_settings()
     msg = EmailMessage()
-    msg['From'] = EMAIL_ADDRESS
-    msg['To'] = to_email
+    msg['From'] = settings.EMAIL_ADDRESS
+    msg['To'] = to_email or settings.WANDERO_EMAIL
     msg['Subject'] = subject
-    
+    msg['Message-ID'] = message_id or new_message_id()
+
     # Add threading headers for proper email threading
     if in_reply_to:
         msg['In-Reply-To'] = in_reply_to
     if references:
         msg['References'] = references
-    
+
     msg.set_content(body)
+    return msg
+
+# Send email through the configured transport (Gmail SMTP unless another transport is configured).
+# Returns the Message-ID it went out with, or None if it could not be sent.
+def send_email(subject, body, to_email=None, in_reply_to=None, references=None, pool=None):
+    msg = build_email(subject, body, to_email, in_reply_to, references)
+    sender = pool or get_transport()
+    transport = getattr(sender, 'name', 'smtp_pool')
+    with get_metrics().timer('mail_send_seconds', transport=transport), span('mail.send', transport=transport):
+        sent = sender.send(msg)
+    if sent:
+        print(f"[SMTP] Email sent to {msg['To']} with subject: {subject}")
+        return msg['Message-ID']
+    print("[SMTP] Could not send email.")
+    return None
+
+# Queue an email on the pool; call get_smtp_pool().flush() to send the batch over one connection.
+# Returns the Message-ID the email will be sent with.
+def queue_email(subject, body, to_email=None, in_reply_to=None, references=None, pool=None):
+    pool = pool or get_smtp_pool()
+    msg = build_email(subject, body, to_email, in_reply_to, references)
+    pool.queue(msg)
+    return msg['Message-ID']
+
+# A message from the mailbox with only its text body decoded (references is the raw space-separated
+# References header). body is the new content only; normalized keeps the original body and what was
+# cut from it (see body_normalizer.py). uidvalidity is the folder's UIDVALIDITY the uid belongs to
+# (None when unknown: one-shot searches and the offline mailbox).
+InboundEmail = namedtuple('InboundEmail', ['uid', 'subject', 'sender', 'message_id', 'in_reply_to', 'received_at', 'body',
+                                           'references', 'normalized', 'uidvalidity'], defaults=("", None, None))
+
+# References header fetched alongside the envelope (IMAP ENVELOPE carries In-Reply-To but not References)
+REFERENCES_FIELD = 'BODY.PEEK[HEADER.FIELDS (REFERENCES)]'
+REFERENCES_KEY = b'BODY[HEADER.FIELDS (REFERENCES)]'
+
+# Message-IDs in a header value, in order
+def message_ids(value):
+    return re.findall(r'<[^<>\s]+>', value or "")
+
+# Strip reply/forward prefixes so "Re: Trip Planning Request #0001" files under the original subject
+def thread_subject(subject):
+    return re.sub(r'^(\s*(re|fwd?|aw)\s*:\s*)+', '', subject or "", flags=re.IGNORECASE).strip()
+
+# Turn an ENVELOPE string (bytes, possibly RFC 2047 encoded) into text
+def _decode_envelope_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
     try:
-        smtp.send_message(msg)
-        print(f"[SMTP] Email sent to {to_email} with subject: {subject}")
-        smtp.quit()
-        return True
-    except Exception as e:
-        print(f"[SMTP] Failed to send email: {e}")
-        return False
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
 
-# Check for new emails from Wandero (returns latest email text or None)
-def check_for_new_email(last_uid=None, from_email=WANDERO_EMAIL, wait_time=10):
-    server = connect_imap()
-    if not server:
-        print("[IMAP] Could not check email: IMAP connection failed.")
-        return None, None
+# First address in an ENVELOPE address list as "mailbox@host"
+def _envelope_address(addresses):
+    if not addresses:
+        return ""
+    address = addresses[0]
+    return f"{_decode_envelope_text(address.mailbox)}@{_decode_envelope_text(address.host)}"
+
+# Parameter value from a BODYSTRUCTURE parameter list like (b'CHARSET', b'utf-8')
+def _body_param(params, name):
+    if not params:
+        return None
+    for key, value in zip(params[::2], params[1::2]):
+        if isinstance(key, bytes) and key.upper() == name:
+            return value.decode('ascii', errors='replace') if isinstance(value, bytes) else value
+    return None
+
+# Walk a BODYSTRUCTURE and return (section, encoding, charset, is_html) of the first text/<subtype> part
+def _find_text_part(structure, prefix="", subtype=b'plain'):
+    if structure.is_multipart:
+        for index, part in enumerate(structure[0], start=1):
+            found = _find_text_part(part, f"{prefix}{index}.", subtype)
+            if found:
+                return found
+        return None
+    main_type, sub_type = structure[0], structure[1]
+    if not (isinstance(main_type, bytes) and main_type.lower() == b'text' and sub_type.lower() == subtype):
+        return None
+    # A non-multipart message's own body is section 1
+    section = prefix[:-1] if prefix else "1"
+    encoding = (structure[5] or b'7bit').decode('ascii', errors='replace').lower()
+    charset = _body_param(structure[2], b'CHARSET') or 'utf-8'
+    return section, encoding, charset, subtype == b'html'
+
+# Undo the transfer encoding of a fetched body section and decode its charset
+def _decode_body_section(data, encoding, charset):
+    if not data:
+        return ""
+    if encoding == 'base64':
+        data = base64.b64decode(data)
+    elif encoding == 'quoted-printable':
+        data = quopri.decodestring(data)
     try:
-        # Search for unseen emails from Wandero
-        print(f"[IMAP] Searching for new emails from: {from_email}")
-        print(f"[IMAP] Your email: {EMAIL_ADDRESS}")
-        print(f"[IMAP] Wandero email: {WANDERO_EMAIL}")
-        print(f"[IMAP] Last processed UID: {last_uid}")
-        
-        # Try different search approaches
-        try:
-            # Search for unseen emails from the specific sender
-            search_criteria = ['UNSEEN', 'FROM', from_email]
-            print(f"[IMAP] Search criteria: {search_criteria}")
-            messages = server.search(search_criteria)
-            print(f"[IMAP] Found {len(messages)} unseen messages from {from_email}")
-            
-            # If we have a last_uid, only look for newer messages
-            if last_uid and messages:
-                # Filter for messages newer than last_uid
-                newer_messages = [msg for msg in messages if msg > last_uid]
-                print(f"[IMAP] Found {len(newer_messages)} newer messages")
-                messages = newer_messages
-            
-            if messages:
-                # Get the newest message
-                latest_msg_id = max(messages)
-                print(f"[IMAP] Processing message {latest_msg_id}")
-                
-                try:
-                    raw_msg = server.fetch([latest_msg_id], ['RFC822'])[latest_msg_id][b'RFC822']
-                    msg = message_from_bytes(raw_msg)
-                    sender = msg['From']
-                    print(f"[IMAP] Message {latest_msg_id} from: {sender}")
-                    
-                    subject, encoding = decode_header(msg['Subject'])[0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode(encoding or 'utf-8')
-                    
-                    # Get email body
-                    body = ""
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == 'text/plain':
-                                try:
-                                    body = part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8')
-                                    break
-                                except:
-                                    continue
-                    else:
-                        try:
-                            body = msg.get_payload(decode=True).decode(msg.get_content_charset() or 'utf-8')
-                        except:
-                            body = msg.get_payload()
-                    
-                    print(f"[IMAP] New email with subject: {subject}")
-                    server.logout()
-                    return body, latest_msg_id
-                except Exception as fetch_error:
-                    print(f"[IMAP] Error fetching message {latest_msg_id}: {fetch_error}")
-                    server.logout()
-                    return None, None
-            else:
-                print(f"[IMAP] No new emails from {from_email} found")
-                server.logout()
-                return None, None
-                
-        except Exception as search_error:
-            print(f"[IMAP] Search error: {search_error}")
-            server.logout()
-            return None, None
+        return data.decode(charset, errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+# Fetch envelopes for all uids in one round trip, then only their text sections (text/plain, else text/html).
+# BODY.PEEK leaves the messages unread: new mail is found by UID, not by the \\Seen flag.
+# Returns raw fetch data; decoding is left to iter_new_emails so it happens lazily.
+def _fetch_emails(server, uids):
+    meta = server.fetch(uids, ['ENVELOPE', 'BODYSTRUCTURE', 'INTERNALDATE', REFERENCES_FIELD])
+    parts = {}
+    by_section = defaultdict(list)
+    for uid, data in meta.items():
+        # HTML-only mail (no text/plain alternative) falls back to its text/html part
+        part = _find_text_part(data[b'BODYSTRUCTURE']) or _find_text_part(data[b'BODYSTRUCTURE'], subtype=b'html')
+        if part:
+            parts[uid] = part
+            by_section[part[0]].append(uid)
+
+    # Most messages share a section number ("1" or "1.1"), so this is usually a single FETCH
+    bodies = {}
+    for section, section_uids in by_section.items():
+        key = f'BODY[{section}]'.encode()
+        for uid, data in server.fetch(section_uids, [f'BODY.PEEK[{section}]']).items():
+            bodies[uid] = data.get(key)
+
+    return [(uid, meta[uid], parts.get(uid), bodies.get(uid)) for uid in sorted(meta)]
+
+# UIDs matching criteria that came from from_email (and are in the subject's thread), newer than after_uid
+def _search_uids(server, criteria, from_email, subject=None, after_uid=None):
+    criteria = criteria + ['FROM', from_email]
+    if subject:
+        criteria += ['SUBJECT', subject]
+    with span('imap.search'):
+        messages = server.search(criteria)
+    # 'UID n:*' always matches the newest message, even when its UID is below n
+    if after_uid:
+        messages = [msg for msg in messages if msg > after_uid]
+    return messages
+
+# Fetch data for the found messages (see _fetch_emails)
+def _fetch_found(server, messages, from_email):
+    if not messages:
+        print(f"[IMAP] No new emails from {from_email} found")
+        return []
+    print(f"[IMAP] Fetching {len(messages)} new messages")
+    with span('imap.fetch', messages=len(messages)):
+        return _fetch_emails(server, messages)
+
+# Search for every matching email newer than last_uid on an open IMAP connection (one-shot, without a
+# sync cursor). From a known UID the server only looks at newer messages; without one, every match is new.
+def _search_new_emails(server, last_uid, from_email, subject):
+    print(f"[IMAP] Searching for new emails from: {from_email}")
+    print(f"[IMAP] Last processed UID: {last_uid}")
+    criteria = ['UID', f'{last_uid + 1}:*'] if last_uid else ['ALL']
+    messages = _search_uids(server, criteria, from_email, subject, last_uid)
+    print(f"[IMAP] Found {len(messages)} new messages from {from_email}")
+    return _fetch_found(server, messages, from_email)
+
+# Where a folder's sync left off. UIDs only mean anything while UIDVALIDITY stays the same;
+# highestmodseq is None on servers without CONDSTORE. Flag changes (another client reading mail) move
+# HIGHESTMODSEQ without adding mail, so only UIDNEXT decides whether a poll has to search.
+SyncCursor = namedtuple('SyncCursor', ['uidvalidity', 'uidnext', 'highestmodseq', 'synced_at'])
+
+# Message-IDs remembered (and saved with the cursor) to skip mail seen before a UIDVALIDITY reset
+MAX_SYNC_SEEN_IDS = 2000
+
+# Incremental sync of one folder. Each poll asks for the folder's UIDVALIDITY/UIDNEXT (and
+# HIGHESTMODSEQ with CONDSTORE) in one STATUS; when UIDNEXT hasn't moved there is nothing new and
+# the poll ends there, otherwise only 'UID <cursor>:*' is searched. The server never scans the
+# whole folder, so a poll costs the same however large the mailbox grows, and read flags set by
+# other clients don't matter. The very first sync (no saved cursor, no last_uid) only takes the
+# folder's UIDVALIDITY/UIDNEXT as its cursor: mail already there predates the run. The cursor is
+# saved in the state store so a restarted simulator carries on where it stopped. If UIDVALIDITY
+# changes (the folder was rebuilt, every UID is void) the sync searches the days since its last poll
+# again and skips Message-IDs it already returned; the latest of those are saved with the cursor, so
+# this holds across restarts too. Consumers that remember UIDs compare them only within one
+# UIDVALIDITY (see InboundEmail.uidvalidity).
+class MailboxSync:
+    def __init__(self, folder='INBOX', store=None, name='default'):
+        self.folder = folder
+        self.store = store
+        self.key = f"{name}:{folder}"
+        self.cursor = None
+        self._seen_ids = OrderedDict()
+        self._unsaved_ids = []  # Message-IDs returned since the cursor was last saved
+        if store is not None:
+            saved = store.load_mailbox_cursor(self.key)
+            if saved:
+                self.cursor = SyncCursor(**saved)
+            self._seen_ids.update(dict.fromkeys(store.load_mailbox_seen_ids(self.key)))
+        self.condstore = None
+        self.polls = 0
+        self.unchanged = 0
+        self.searches = 0
+        self.resets = 0
+
+    def _status(self, server):
+        if self.condstore is None:
+            self.condstore = b'CONDSTORE' in server.capabilities()
+        items = [b'UIDVALIDITY', b'UIDNEXT'] + ([b'HIGHESTMODSEQ'] if self.condstore else [])
+        status = server.folder_status(self.folder, items)
+        return SyncCursor(status[b'UIDVALIDITY'], status[b'UIDNEXT'], status.get(b'HIGHESTMODSEQ'), time.time())
+
+    def poll(self, server, from_email, subject=None, last_uid=None):
+        """Fetch data (see _fetch_emails) for mail from from_email since the last poll. last_uid only
+        matters when there is no saved cursor: the sync then starts right after it."""
+        self.polls += 1
+        current = self._status(server)
+        cursor = self.cursor
+        if cursor is None and last_uid:
+            cursor = SyncCursor(current.uidvalidity, last_uid + 1, None, current.synced_at)
+        if cursor is None:
+            print(f"[IMAP] First sync of {self.folder}: new mail starts at UID {current.uidnext}")
+            self._advance(current)
+            return []
+        if cursor.uidvalidity != current.uidvalidity:
+            since = datetime.fromtimestamp(cursor.synced_at).date()
+            print(f"[IMAP] UIDVALIDITY of {self.folder} changed ({cursor.uidvalidity} -> {current.uidvalidity}), "
+                  f"resyncing mail since {since:%d-%b-%Y}")
+            self.resets += 1
+            criteria, after_uid = ['SINCE', since], None
+        elif current.uidnext <= cursor.uidnext:
+            self.unchanged += 1
+            return []
+        else:
+            criteria, after_uid = ['UID', f'{cursor.uidnext}:*'], cursor.uidnext - 1
+        self.searches += 1
+        messages = _search_uids(server, criteria, from_email, subject, after_uid)
+        return self._finish(server, messages, from_email, current, skip_seen=criteria[0] == 'SINCE')
+
+    def _finish(self, server, messages, from_email, current, skip_seen=False):
+        fetched = _fetch_found(server, messages, from_email)
+        fresh = []
+        for item in fetched:
+            message_id = _decode_envelope_text(item[1][b'ENVELOPE'].message_id)
+            if skip_seen and message_id in self._seen_ids:
+                continue
+            fresh.append(item)
+            if message_id:
+                self._seen_ids[message_id] = None
+                self._unsaved_ids.append(message_id)
+                if len(self._seen_ids) > MAX_SYNC_SEEN_IDS:
+                    self._seen_ids.popitem(last=False)
+        uidnext = max([current.uidnext] + [uid + 1 for uid in messages])
+        self._advance(current._replace(uidnext=uidnext))
+        return fresh
+
+    def _advance(self, cursor):
+        """Move the cursor, saving it (and the Message-IDs returned since) when it changed"""
+        changed = self.cursor is None or self.cursor[:3] != cursor[:3]
+        self.cursor = cursor
+        if (changed or self._unsaved_ids) and self.store is not None:
+            self.store.save_mailbox_cursor(self.key, cursor._asdict(), self._unsaved_ids, MAX_SYNC_SEEN_IDS)
+            self._unsaved_ids = []
+
+    def stats(self):
+        return {
+            'sync_polls': self.polls,
+            'sync_polls_unchanged': self.unchanged,
+            'sync_searches': self.searches,
+            'sync_uidvalidity_resets': self.resets,
+        }
+
+# Yield every new email from Wandero in UID order (text body only, attachments are never downloaded), its body
+# reduced to new content by normalize_body
+# Pass subject to only match replies in one conversation's thread (used when several clients share a mailbox)
+# Scans of the whole thread-less mailbox (the router's) go through the IMAP transport's MailboxSync
+# cursor; a subject filter or an explicit session gets a one-shot search after last_uid.
+def iter_new_emails(last_uid=None, from_email=None, subject=None, session=None):
+    from_email = from_email or get_settings().WANDERO_EMAIL
+    transport = get_transport()
+    if session is None and transport.name != 'imap':
+        with get_metrics().timer('mail_fetch_seconds', transport=transport.name), span('mail.fetch', transport=transport.name):
+            emails = transport.fetch_new(last_uid, from_email, subject)
+        for email in emails:
+            yield _with_normalized_body(email)
+        return
+    sync = None
+    if session is None and not subject:
+        sync = transport.sync
+        session, operation = get_imap_session(), sync.poll
+        args = (from_email, subject, last_uid)
+    else:
+        session, operation = session or get_imap_session(), _search_new_emails
+        args = (last_uid, from_email, subject)
+    try:
+        with get_metrics().timer('mail_fetch_seconds', transport='imap'):
+            fetched = session.run(operation, *args)
     except Exception as e:
         print(f"[IMAP] Error checking for new email: {e}")
-        server.logout()
-        return None, None 
\ No newline at end of file
+        return
+    uidvalidity = sync.cursor.uidvalidity if sync is not None and sync.cursor else None
+    for uid, meta, part, data in fetched:
+        envelope = meta[b'ENVELOPE']
+        with span('mime.decode'):
+            body = _decode_body_section(data, part[1], part[2]) if part else ""
+        internal_date = meta.get(b'INTERNALDATE')
+        references = meta.get(REFERENCES_KEY) or b""
+        email = InboundEmail(
+            uid=uid,
+            subject=_decode_envelope_text(envelope.subject),
+            sender=_envelope_address(envelope.from_),
+            message_id=_decode_envelope_text(envelope.message_id),
+            in_reply_to=_decode_envelope_text(envelope.in_reply_to),
+            received_at=internal_date.timestamp() if internal_date else None,
+            body=body,
+            references=" ".join(message_ids(references.decode('ascii', errors='replace'))),
+            uidvalidity=uidvalidity,
+        )
+        email = _with_normalized_body(email, html=bool(part and part[3]))
+        print(f"[IMAP] New email {uid} from {email.sender} with subject: {email.subject}")
+        yield email
+
+# The email with its body cut down to new content (quotes, reply headers, signature); the original
+# stays in email.normalized
+def _with_normalized_body(email, html=False):
+    with span('body.normalize'):
+        normalized = normalize_body(email.body, html)
+    return email._replace(body=normalized.text, normalized=normalized)
+
+# Check for new emails from Wandero (returns latest email text or None)
+def check_for_new_email(last_uid=None, from_email=None, wait_time=10, subject=None, session=None):
+    latest = None
+    for latest in iter_new_emails(last_uid, from_email, subject, session):
+        pass
+    if latest is None:
+        return None, None
+    return latest.body, latest.uid
+
+# Transport backed by real IMAP/SMTP servers (Gmail by default, see IMAP_HOST/SMTP_HOST)
+# (store and sync_name: where the mailbox sync cursor is saved, see MailboxSync)
+class ImapSmtpTransport:
+    name = 'imap'
+
+    def __init__(self, store=None, sync_name='default'):
+        self.sync = MailboxSync(store=store, name=sync_name)
+
+    def send(self, msg):
+        return get_smtp_pool().send(msg)
+
+    def fetch_new(self, last_uid=None, from_email=None, subject=None):
+        return list(iter_new_emails(last_uid, from_email, subject))
+
+    def start_watcher(self):
+        return MailboxWatcher().start()
+
+    def stats(self):
+        session = get_imap_session()
+        smtp = get_smtp_pool().stats()
+        return {
+            'imap_handshakes': session.handshakes,
+            'imap_reconnects': session.reconnects,
+            **self.sync.stats(),
+            'smtp_sent': smtp['sent'],
+            'smtp_failed': smtp['failed'],
+            'smtp_connections_opened': smtp['connections_opened'],
+            'smtp_avg_send_seconds': smtp['avg_send_seconds'],
+            'smtp_max_send_seconds': smtp['max_send_seconds'],
+        }
+
+    def close(self):
+        get_smtp_pool().close()
+        get_imap_session().close()
+
+_transport = None
+
+# Transport used by send_email and iter_new_emails
+def get_transport():
+    if _transport is None:
+        configure_transport(get_settings().MAIL_TRANSPORT)
+    return _transport
+
+# Select the transport: 'imap' for real mail servers or 'memory' for the offline mailbox with a fake Wandero.
+# Options go to the transport (imap: store and sync_name for the sync cursor; memory: latency, or replay
+# with a recorded Wandero file).
+def configure_transport(name='imap', **options):
+    global _transport
+    if _transport is not None:
+        _transport.close()
+    if name == 'imap':
+        _transport = ImapSmtpTransport(**options)
+    elif name == 'memory':
+        from memory_transport import MemoryTransport
+        _transport = MemoryTransport(get_settings().WANDERO_EMAIL or 'hello@wandero.ai', **options)
+    else:
+        raise ValueError(f"Unknown mail transport {name!r}, expected 'imap' or 'memory'")
+    return _transport
@@ -0,0 +1,140 @@
+import math
+
+# Streaming latency histogram with log-spaced buckets (HDR-style). Every bucket is `precision`
+# wider than the one below it, so any reported percentile is within that relative error of the
+# true value. Recording is O(1) and memory is bounded by the number of occupied buckets (about
+# 2,000 at 1% precision for 1 ms to a week), however many values are recorded. Histograms with
+# the same precision merge exactly, so per-conversation and per-process histograms add up to a
+# fleet-wide distribution.
+class LatencyHistogram:
+    def __init__(self, precision=0.01, lowest=0.001):
+        self.precision = precision
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self._log_base) + 1
+
+    def _bucket_value(self, index):
+        """Representative value of a bucket (geometric middle of its bounds)"""
+        if index == 0:
+            return self.lowest
+        return self.lowest * math.exp((index - 0.5) * self._log_base)
+
+    def record(self, value):
+        """Add one measurement (seconds)"""
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+
+    def merge(self, other):
+        """Add another histogram's counts into this one (both must use the same buckets)"""
+        if (other.precision, other.lowest) != (self.precision, self.lowest):
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+            self.last = other.last
+        return self
+
+    def copy(self):
+        histogram = LatencyHistogram(self.precision, self.lowest)
+        histogram.buckets = dict(self.buckets)
+        histogram.count, histogram.total = self.count, self.total
+        histogram.min, histogram.max, histogram.last = self.min, self.max, self.last
+        return histogram
+
+    def since(self, earlier):
+        """Histogram of the values recorded after `earlier`, an older copy() of this histogram.
+        min/max are those of the whole histogram, which is exact once merged back onto the earlier part."""
+        delta = LatencyHistogram(self.precision, self.lowest)
+        for index, count in self.buckets.items():
+            added = count - earlier.buckets.get(index, 0)
+            if added:
+                delta.buckets[index] = added
+        delta.count = self.count - earlier.count
+        delta.total = self.total - earlier.total
+        if delta.count:
+            delta.min, delta.max, delta.last = self.min, self.max, self.last
+        return delta
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """Value at percentile q (0-100), None if nothing was recorded"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Exact extremes are known, so never report outside them
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Count, mean, min/max and p50/p95/p99 (seconds)"""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'p50': self.percentile(50) or 0.0,
+            'p95': self.percentile(95) or 0.0,
+            'p99': self.percentile(99) or 0.0,
+        }
+
+    def __len__(self):
+        return self.count
+
+    def to_state(self):
+        """JSON-serializable snapshot (bucket indexes become string keys in JSON)"""
+        return {
+            'precision': self.precision,
+            'lowest': self.lowest,
+            'buckets': {str(index): count for index, count in self.buckets.items()},
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'last': self.last,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a histogram from a to_state() snapshot"""
+        histogram = cls(state.get('precision', 0.01), state.get('lowest', 0.001))
+        histogram.buckets = {int(index): count for index, count in state.get('buckets', {}).items()}
+        histogram.count = state.get('count', 0)
+        histogram.total = state.get('total', 0.0)
+        histogram.min = state.get('min')
+        histogram.max = state.get('max')
+        histogram.last = state.get('last')
+        return histogram
+
+    @classmethod
+    def from_values(cls, values, **options):
+        """Histogram of an existing list of measurements"""
+        histogram = cls(**options)
+        for value in values:
+            histogram.record(value)
+        return histogram
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# off: never cache; readwrite: serve hits, store misses; record: always call the API and store
+# the result; replay: only serve from the cache and fail on a miss (no API calls at all)
+CACHE_MODES = ('off', 'readwrite', 'record', 'replay')
+
+# Raised in replay mode when a request was never recorded
+class CacheMiss(Exception):
+    pass
+
+# Collapse whitespace so formatting-only differences in a prompt map to the same key
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', text).strip()
+
+# Stable cache key for a chat completion request
+def completion_key(model, messages, temperature, seed=None, max_tokens=None):
+    payload = {
+        'model': model,
+        'messages': [{'role': m['role'], 'content': normalize_text(m['content'])} for m in messages],
+        'temperature': temperature,
+        'seed': seed,
+        'max_tokens': max_tokens,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Two-tier completion cache: an in-memory LRU in front of a SQLite file.
+# Values are JSON-serializable dicts; entries older than ttl seconds are treated as missing.
+class CompletionCache:
+    def __init__(self, path='llm_cache.db', max_entries=1024, ttl=None, mode='readwrite'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.mode = mode
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (created_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._db = None
+        if path and mode != 'off':
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+            self._db.commit()
+
+    @property
+    def reads(self):
+        """Whether cached results may be served"""
+        return self.mode in ('readwrite', 'replay')
+
+    @property
+    def writes(self):
+        """Whether fresh results are stored"""
+        return self.mode in ('readwrite', 'record')
+
+    def _is_fresh(self, created_at):
+        return self.ttl is None or time.time() - created_at <= self.ttl
+
+    def _remember(self, key, created_at, value):
+        """Insert into the LRU tier, evicting the least recently used entry when full"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def persistent(self):
+        """Whether lookups and stores also touch the SQLite file"""
+        return self._db is not None
+
+    def get_memory(self, key):
+        """Value from the LRU tier or None; a miss here is not counted, since the disk may still have it"""
+        with self._lock:
+            return self._get_memory(key)
+
+    def _get_memory(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            if self._is_fresh(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[1]
+            del self._memory[key]
+            self.expired += 1
+        return None
+
+    def get(self, key):
+        """Cached value for key or None (memory first, then disk)"""
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                return value
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if self._is_fresh(row[1]):
+                        value = json.loads(row[0])
+                        self._remember(key, row[1], value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store value in both tiers"""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), created_at))
+                self._db.commit()
+
+    def stats(self):
+        """Hit/miss/eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            'mode': self.mode,
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expired': self.expired,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
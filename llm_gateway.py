@@ -0,0 +1,289 @@
+import asyncio
+import random
+import time
+from collections import deque, namedtuple
+
+from clock import get_clock
+from conversation_context import count_tokens
+from llm_cache import CacheMiss, completion_key
+from tracing import span
+
+# Text and token usage of one chat completion (usage is a dict, empty if the API didn't report it)
+Completion = namedtuple('Completion', ['text', 'usage', 'cached'])
+
+# Per-call metrics kept by the gateway and passed to listeners (cached_tokens: the part of the
+# prompt the provider served from its prompt cache)
+CallMetrics = namedtuple('CallMetrics', ['label', 'latency', 'prompt_tokens', 'completion_tokens', 'attempts', 'ok',
+                                         'cached_tokens'], defaults=(0,))
+
+# USD per million input, cached input and output tokens when none are configured (gpt-4o-mini)
+DEFAULT_PRICES = (0.15, 0.075, 0.6)
+
+# Raised when a completion still fails after all retries (instead of falling back to canned text)
+class LLMError(Exception):
+    pass
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = (408, 409, 429)
+
+# Whether an OpenAI SDK error is transient
+def is_retryable(error):
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    # Connection errors and timeouts carry no status code
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError') or isinstance(error, (ConnectionError, TimeoutError))
+
+# Server-requested wait from a Retry-After header, if any
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+# Usage dict of a chat completion response: prompt, cached prompt and completion tokens ({} if not reported)
+def response_usage(response):
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return {}
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'cached_tokens': getattr(details, 'cached_tokens', None) or 0,
+        'completion_tokens': usage.completion_tokens,
+    }
+
+# Token usage, latency and cost of the gateway's calls per label. Calls are split by whether the
+# provider served part of the prompt from its cache, so the latency of hits and misses can be
+# compared; the saving is what the cached tokens would have cost at the full input price.
+class UsageTracker:
+    FIELDS = ('calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'hit_calls', 'hit_latency',
+              'miss_calls', 'miss_latency')
+
+    def __init__(self, prices=DEFAULT_PRICES):
+        self.prices = prices
+        self.labels = {}  # label -> {field: total}
+
+    def __call__(self, call):
+        """LLMGateway listener: add a successful call to its label's totals"""
+        if not call.ok:
+            return
+        totals = self.labels.setdefault(call.label, dict.fromkeys(self.FIELDS, 0))
+        totals['calls'] += 1
+        totals['prompt_tokens'] += call.prompt_tokens
+        totals['cached_tokens'] += call.cached_tokens
+        totals['completion_tokens'] += call.completion_tokens
+        kind = 'hit' if call.cached_tokens else 'miss'
+        totals[f'{kind}_calls'] += 1
+        totals[f'{kind}_latency'] += call.latency
+
+    def cost(self, prompt_tokens, cached_tokens, completion_tokens):
+        """USD for the tokens, cached prompt tokens at the cached input price"""
+        input_price, cached_price, output_price = self.prices
+        return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + completion_tokens * output_price) / 1e6
+
+    def summary(self):
+        """Per-label totals plus 'total', each with cache hit rate, mean hit/miss latency, cost and saving"""
+        rows = dict(self.labels)
+        rows['total'] = {field: sum(totals[field] for totals in self.labels.values()) for field in self.FIELDS}
+        report = {}
+        for label, totals in rows.items():
+            cost = self.cost(totals['prompt_tokens'], totals['cached_tokens'], totals['completion_tokens'])
+            report[label] = dict(
+                totals,
+                cached_share=totals['cached_tokens'] / totals['prompt_tokens'] if totals['prompt_tokens'] else 0.0,
+                hit_latency=totals['hit_latency'] / totals['hit_calls'] if totals['hit_calls'] else None,
+                miss_latency=totals['miss_latency'] / totals['miss_calls'] if totals['miss_calls'] else None,
+                cost=cost,
+                saved=self.cost(totals['prompt_tokens'], 0, totals['completion_tokens']) - cost,
+            )
+        return report
+
+# Tokens-per-minute budget as a token bucket refilled continuously
+class TokenBudget:
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.available = float(tokens_per_minute)
+        self.updated = get_clock().monotonic()
+        self.waited = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = get_clock().monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        """Wait until tokens fit in the budget, then spend them"""
+        tokens = min(tokens, self.capacity)
+        # The lock keeps waiters in order so a large request isn't starved by small ones
+        async with self._lock:
+            self._refill()
+            while self.available < tokens:
+                delay = (tokens - self.available) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self.available -= tokens
+
+    def adjust(self, tokens):
+        """Charge (or refund, if negative) the difference between estimated and actual usage"""
+        self._refill()
+        self.available = min(self.capacity, self.available - tokens)
+
+# Shared async gateway to the OpenAI API for every simulated client.
+# Caps concurrent requests, keeps under a tokens-per-minute budget, retries transient errors
+# with jittered exponential backoff and lets identical in-flight requests share one call.
+class LLMGateway:
+    def __init__(self, max_concurrency=8, tokens_per_minute=None, max_retries=5, base_delay=1.0, max_delay=30.0,
+                 cache=None, client=None, api_key=None, prices=DEFAULT_PRICES):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache
+        self.budget = TokenBudget(tokens_per_minute) if tokens_per_minute else None
+        self._client = client
+        self._api_key = api_key
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = {}
+        self.usage = UsageTracker(prices)
+        self.listeners = [self.usage]
+        self.recent_calls = deque(maxlen=1000)
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def client(self):
+        """AsyncOpenAI client, created on first use"""
+        if self._client is None:
+            import openai
+            self._client = openai.AsyncOpenAI(api_key=self._api_key)
+        return self._client
+
+    def add_listener(self, callback):
+        """Register callback(CallMetrics) to be called after every API call"""
+        self.listeners.append(callback)
+
+    async def complete(self, messages, max_tokens, temperature=0.8, model="gpt-4o-mini", seed=None, label="llm"):
+        """Chat completion as a Completion; raises LLMError once retries are exhausted"""
+        key = completion_key(model, messages, temperature, seed, max_tokens)
+        if self.cache is not None and self.cache.reads:
+            # The LRU tier is answered inline; only a memory miss goes to SQLite, on a worker thread
+            cached = self.cache.get_memory(key)
+            if cached is None:
+                cached = await asyncio.to_thread(self.cache.get, key) if self.cache.persistent else self.cache.get(key)
+            if cached is not None:
+                return Completion(cached['text'], cached['usage'], True)
+            if self.cache.mode == 'replay':
+                raise CacheMiss(f"No recorded completion for key {key[:12]}")
+
+        # An identical request is already on its way: wait for its result instead of paying twice.
+        # The call runs as its own task and every caller awaits it through a shield, so cancelling
+        # the caller that started it doesn't cancel the others.
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._complete(key, messages, max_tokens, temperature, model, seed, label))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    async def _complete(self, key, messages, max_tokens, temperature, model, seed, label):
+        with span('llm.call', label=label, model=model):
+            completion = await self._call(messages, max_tokens, temperature, model, seed, label)
+        if self.cache is not None and self.cache.writes:
+            value = {'text': completion.text, 'usage': completion.usage}
+            if self.cache.persistent:
+                await asyncio.to_thread(self.cache.put, key, value)
+            else:
+                self.cache.put(key, value)
+        return completion
+
+    def _finished(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved when every caller was cancelled
+
+    async def _call(self, messages, max_tokens, temperature, model, seed, label):
+        request = dict(model=model, messages=messages, max_tokens=max_tokens, temperature=temperature)
+        if seed is not None:
+            request['seed'] = seed
+        estimate = sum(count_tokens(message['content']) for message in messages) + max_tokens
+
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.budget is not None:
+                await self.budget.acquire(estimate)
+            try:
+                async with self._semaphore:
+                    response = await self.client.chat.completions.create(**request)
+                break
+            except Exception as e:
+                if not is_retryable(e) or attempt > self.max_retries:
+                    self._record(label, time.perf_counter() - started, 0, 0, attempt, False)
+                    raise LLMError(f"{label} failed after {attempt} attempt(s): {e}") from e
+                self.retries += 1
+                if self.budget is not None:
+                    self.budget.adjust(-estimate)  # nothing was consumed
+                # Full jitter keeps many clients that hit the same 429 from retrying in lockstep
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                delay = max(delay, retry_after(e) or 0)
+                print(f"[LLM] {label} attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        usage = response_usage(response)
+        if usage and self.budget is not None:
+            self.budget.adjust(usage['prompt_tokens'] + usage['completion_tokens'] - estimate)
+        self._record(label, time.perf_counter() - started, usage.get('prompt_tokens', 0),
+                     usage.get('completion_tokens', 0), attempt, True, usage.get('cached_tokens', 0))
+        return Completion(response.choices[0].message.content.strip(), usage, False)
+
+    def _record(self, label, latency, prompt_tokens, completion_tokens, attempts, ok, cached_tokens=0):
+        metrics = CallMetrics(label, latency, prompt_tokens, completion_tokens, attempts, ok, cached_tokens)
+        self.calls += 1
+        if not ok:
+            self.failures += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.recent_calls.append(metrics)
+        for callback in self.listeners:
+            try:
+                callback(metrics)
+            except Exception as e:
+                print(f"[LLM] Metrics listener error: {e}")
+
+    def stats(self):
+        """Aggregate call, retry and token counters"""
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries,
+            'coalesced': self.coalesced,
+            'avg_latency_seconds': self.latency_total / self.calls if self.calls else 0.0,
+            'max_latency_seconds': self.latency_max,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cached_tokens': self.cached_tokens,
+            'budget_wait_seconds': self.budget.waited if self.budget is not None else 0.0,
+        }
@@ -0,0 +1,207 @@
+import asyncio
+from collections import OrderedDict, defaultdict
+
+from email_client import iter_new_emails, message_ids, thread_subject
+from tracing import span
+
+# Replies that matched no conversation yet (e.g. one that resumes after the mail arrived) are kept
+# this long, oldest dropped first
+MAX_UNCLAIMED = 1000
+
+# Where an email sits in the mailbox. UIDs only grow within one UIDVALIDITY, and a new UIDVALIDITY
+# is greater than the one it replaces (RFC 3501), so this orders mail across a reset too.
+def mailbox_position(email):
+    return (email.uidvalidity or 0, email.uid)
+
+# Demultiplexes one shared mailbox into per-conversation inboxes. Every email a conversation sends
+# registers its Message-ID here; a single driver task scans the mailbox once per IDLE push (or
+# poll interval) and routes each reply with dict lookups on In-Reply-To, then References (newest
+# first), then the thread subject. Conversations wait on their own inbox, so a push wakes only the
+# conversations that actually got mail and N conversations share one scan instead of N searches.
+class MailRouter:
+    def __init__(self, mail_signal, poll_interval=120, from_email=None):
+        self.mail_signal = mail_signal
+        self.poll_interval = poll_interval
+        self.from_email = from_email
+        self.last_uid = None
+        self.uidvalidity = None  # UIDVALIDITY last_uid belongs to
+        self._owners = {}  # Message-ID -> conversation_id
+        self._subjects = {}  # thread subject -> conversation_id
+        self._default = None  # conversation that gets every reply nothing else claims
+        self._registered = {}  # conversation_id -> (thread subject or None, Message-IDs it owns)
+        self._inboxes = {}  # registered conversation_id -> routed emails not taken yet
+        self._waiters = {}  # conversation_id -> future resolved when mail is routed to it
+        self._unclaimed = OrderedDict()  # mailbox position -> email
+        self._unclaimed_keys = defaultdict(set)  # Message-ID or thread subject -> positions of unclaimed emails
+        self._task = None
+        self.scans = 0
+        self.routed = 0
+        self.unrouted = 0
+
+    def register(self, conversation_id, subject=None, known_ids=(), default=False):
+        """Add a conversation: the subject and Message-IDs it already used (e.g. when resuming).
+        The default conversation gets replies no other conversation claims (single-client mode)."""
+        key = thread_subject(subject) if subject else None
+        if key is not None:
+            self._subjects[key] = conversation_id
+        self._registered[conversation_id] = (key, self._registered.get(conversation_id, (None, set()))[1])
+        self._inboxes.setdefault(conversation_id, [])
+        for message_id in known_ids:
+            self.add_message_id(message_id, conversation_id)
+        if default:
+            self._default = conversation_id
+        # Mail that arrived before the conversation registered
+        if default:
+            candidates = list(self._unclaimed)
+        else:
+            keys = [key] if key is not None else []
+            candidates = sorted({position for key in [*keys, *known_ids] for position in self._unclaimed_keys.get(key, ())})
+        for position in candidates:
+            email = self._unclaimed.get(position)
+            if email is not None and self.route(email) == conversation_id:
+                self._claim(position)
+                self.add_message_id(email.message_id, conversation_id)
+                self._deliver(conversation_id, email)
+
+    def unregister(self, conversation_id):
+        """Forget a conversation; later replies to it wait as unclaimed mail (e.g. until it resumes)"""
+        self._inboxes.pop(conversation_id, None)
+        subject, owned = self._registered.pop(conversation_id, (None, ()))
+        for message_id in owned:
+            if self._owners.get(message_id) == conversation_id:
+                del self._owners[message_id]
+        if subject is not None and self._subjects.get(subject) == conversation_id:
+            del self._subjects[subject]
+        if self._default == conversation_id:
+            self._default = None
+        waiter = self._waiters.pop(conversation_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(False)
+
+    def add_message_id(self, message_id, conversation_id):
+        """Record a Message-ID of the conversation so replies to it are routed there"""
+        registered = self._registered.get(conversation_id)
+        if message_id and registered is not None:
+            self._owners[message_id] = conversation_id
+            registered[1].add(message_id)
+
+    def route(self, email):
+        """Conversation a reply belongs to, or None"""
+        for message_id in message_ids(email.in_reply_to):
+            owner = self._owners.get(message_id)
+            if owner is not None:
+                return owner
+        for message_id in reversed(message_ids(email.references)):
+            owner = self._owners.get(message_id)
+            if owner is not None:
+                return owner
+        return self._subjects.get(thread_subject(email.subject), self._default)
+
+    def dispatch(self, emails):
+        """Route fetched emails to their conversations' inboxes"""
+        for email in emails:
+            # After a UIDVALIDITY reset the old UIDs mean nothing
+            if email.uidvalidity != self.uidvalidity:
+                self.uidvalidity, self.last_uid = email.uidvalidity, None
+            self.last_uid = max(self.last_uid or 0, email.uid)
+            conversation_id = self.route(email)
+            if conversation_id is None:
+                self._hold(email)
+                continue
+            # Later replies in the thread point at this one
+            self.add_message_id(email.message_id, conversation_id)
+            self._deliver(conversation_id, email)
+
+    def _hold(self, email):
+        """Keep a reply no conversation claims until one registers for it"""
+        self.unrouted += 1
+        position = mailbox_position(email)
+        self._unclaimed[position] = email
+        for key in self._routing_keys(email):
+            self._unclaimed_keys[key].add(position)
+        while len(self._unclaimed) > MAX_UNCLAIMED:
+            self._claim(next(iter(self._unclaimed)))
+
+    @staticmethod
+    def _routing_keys(email):
+        return [*message_ids(email.in_reply_to), *message_ids(email.references), thread_subject(email.subject)]
+
+    def _claim(self, position):
+        """Remove an email from the unclaimed set and its key index"""
+        email = self._unclaimed.pop(position)
+        for key in self._routing_keys(email):
+            positions = self._unclaimed_keys.get(key)
+            if positions is not None:
+                positions.discard(position)
+                if not positions:
+                    del self._unclaimed_keys[key]
+        return email
+
+    def _deliver(self, conversation_id, email):
+        inbox = self._inboxes.get(conversation_id)
+        if inbox is None:
+            self._hold(email)
+            return
+        self.routed += 1
+        inbox.append(email)
+        waiter = self._waiters.pop(conversation_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(True)
+
+    def take(self, conversation_id):
+        """Every email routed to the conversation since the last take(), in mailbox order"""
+        emails = self._inboxes.get(conversation_id)
+        if not emails:
+            return []
+        self._inboxes[conversation_id] = []
+        return sorted(emails, key=mailbox_position)
+
+    async def wait(self, conversation_id, timeout):
+        """Wait until mail is routed to the conversation or timeout passes; True if it has mail"""
+        if self._inboxes.get(conversation_id):
+            return True
+        waiter = self.mail_signal.loop.create_future()
+        self._waiters[conversation_id] = waiter
+        deadline = self.mail_signal.scheduler.deadline(waiter, timeout, False, kind='inbox')
+        try:
+            return await waiter
+        finally:
+            deadline.cancel()
+            if self._waiters.get(conversation_id) is waiter:
+                del self._waiters[conversation_id]
+
+    async def scan(self):
+        """Fetch everything new from the mailbox once and route it"""
+        self.scans += 1
+        with span('router.scan'):
+            emails = await asyncio.to_thread(lambda: list(iter_new_emails(self.last_uid, self.from_email)))
+            self.dispatch(emails)
+        return len(emails)
+
+    async def run(self):
+        """Driver: scan on every push, or every poll_interval without IDLE"""
+        while True:
+            pending_mail = self.mail_signal.current()
+            try:
+                await self.scan()
+            except Exception as e:
+                print(f"[ROUTER] Mailbox scan failed: {e}")
+            await self.mail_signal.wait(pending_mail, self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            'scans': self.scans,
+            'routed': self.routed,
+            'unrouted': self.unrouted,
+            'message_ids': len(self._owners),
+        }
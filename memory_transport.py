@@ -0,0 +1,246 @@
+import json
+import random
+import threading
+from bisect import bisect_right
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+from clock import get_clock
+from email_client import InboundEmail, thread_subject
+
+# Build a latency sampler from a spec like "fixed:30", "uniform:10,120", "lognormal:60,0.6" or "exp:45" (seconds)
+def parse_latency(spec):
+    kind, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',') if value.strip()]
+    kind = kind.strip().lower()
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        # Parameterised by median and sigma of the underlying normal
+        median, sigma = values[0], values[1] if len(values) > 1 else 0.5
+        return lambda: random.lognormvariate(0, sigma) * median
+    if kind == 'exp':
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution {spec!r}")
+
+# In-memory mailbox that stands in for the client's IMAP inbox.
+# UIDs increase monotonically like a real server; fetching since a UID is a bisect, and replies are
+# indexed by thread subject so one conversation's fetch never scans the others' mail. It also plays
+# the part of the IDLE watcher: listeners are called as soon as a message is delivered.
+class MemoryMailbox:
+    def __init__(self):
+        self.supports_idle = True
+        self.handshakes = 0
+        self.pushes = 0
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._uids = []
+        self._messages = {}
+        self._threads = {}  # thread subject -> sorted uids
+        self._next_uid = 1
+
+    def add_listener(self, callback):
+        """Register callback() to be called whenever mail is delivered"""
+        self.listeners.append(callback)
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def deliver(self, msg):
+        """Store an EmailMessage and wake listeners, returns its UID"""
+        if not msg['Message-ID']:
+            msg['Message-ID'] = make_msgid(domain='wandero.local')
+        with self._lock:
+            uid = self._next_uid
+            self._next_uid += 1
+            subject = str(msg['Subject'] or "")
+            email = InboundEmail(
+                uid=uid,
+                subject=subject,
+                sender=str(msg['From'] or ""),
+                message_id=str(msg['Message-ID']),
+                in_reply_to=str(msg['In-Reply-To'] or ""),
+                received_at=get_clock().time(),
+                body=msg.get_content() if not msg.is_multipart() else "",
+                references=str(msg['References'] or ""),
+            )
+            self._uids.append(uid)
+            self._messages[uid] = (email, msg)
+            self._threads.setdefault(thread_subject(subject), []).append(uid)
+        self.pushes += 1
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[MEMORY] Listener error: {e}")
+        return uid
+
+    def fetch_new(self, last_uid=None, from_email=None, subject=None):
+        """Every message newer than last_uid in UID order, optionally only one sender/thread"""
+        with self._lock:
+            uids = self._threads.get(thread_subject(subject), []) if subject else self._uids
+            start = bisect_right(uids, last_uid or 0)
+            emails = [self._messages[uid][0] for uid in uids[start:]]
+        if from_email:
+            emails = [email for email in emails if from_email.lower() in email.sender.lower()]
+        return emails
+
+    def __len__(self):
+        return len(self._uids)
+
+# Text of a sent email (the first text/plain part of a multipart one)
+def _plain_body(msg):
+    part = msg.get_body(preferencelist=('plain',)) if msg.is_multipart() else msg
+    return part.get_content() if part is not None else ""
+
+# Scripted stand-in for Wandero: answers every email it receives after a sampled delay.
+# Replies walk through a fixed script per thread (questions, proposal, revisions, confirmation)
+# and are delivered into the client's mailbox by the clock: from its timer thread in real time,
+# or as soon as the event loop reaches the reply's time in virtual time.
+class FakeWandero:
+    SCRIPT = [
+        "Hi there,\n\nThanks so much for reaching out to Wandero! We'd love to help plan your trip.\n\n"
+        "Could you tell us your travel dates, how many people are travelling and your approximate budget? "
+        "Do you have any dietary requirements or accessibility needs we should know about?\n\nBest regards,\nThe Wandero Team",
+        "Hi there,\n\nBased on what you told us, here is a proposed itinerary:\n\n"
+        "Day 1-2: Arrival and a guided walking tour of the old town with a local guide\n"
+        "Day 3-4: Traditional cooking class and a day trip to the countryside\n"
+        "Day 5: Free day, with an optional premium wine tasting upgrade\n\n"
+        "The package price is $1,450 per person including accommodation and transfers. "
+        "If your dates are flexible, we can offer alternative dates at a lower cost.\n\n"
+        "Would you like us to make any changes?\n\nBest regards,\nThe Wandero Team",
+        "Hi there,\n\nNo problem at all, we've customized the plan specifically for your group. "
+        "We swapped day 4 for an authentic local market visit and kept the budget at $1,380 per person.\n\n"
+        "Do you want us to add airport transfers or an extra night?\n\nBest regards,\nThe Wandero Team",
+        "Hi there,\n\nWonderful, your trip is confirmed! We'll send the final itinerary and payment link shortly. "
+        "When you arrive, our local partner will meet you at the airport.\n\nBest regards,\nThe Wandero Team",
+    ]
+
+    def __init__(self, mailbox, address='hello@wandero.ai', latency='lognormal:60,0.6', clock=None):
+        self.mailbox = mailbox
+        self.address = address
+        self.sample_latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.clock = clock or get_clock()
+        self.received = 0
+        self.replied = 0
+        self._stage = {}  # thread subject -> replies sent so far
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def receive(self, msg):
+        """Accept an email sent to Wandero and schedule the reply"""
+        self.received += 1
+        subject = thread_subject(str(msg['Subject'] or ""))
+        stage = self._stage.get(subject, 0)
+        self._stage[subject] = stage + 1
+        body, delay = self.next_reply(subject, stage)
+        reply = self._build_reply(msg, subject, body)
+        with self._lock:
+            self._pending += 1
+        self.clock.call_later(max(0.0, delay), self._deliver, reply)
+
+    def next_reply(self, subject, stage):
+        """Body and delay (seconds) of the reply to the thread's stage-th email"""
+        return self.SCRIPT[min(stage, len(self.SCRIPT) - 1)], self.sample_latency()
+
+    def _build_reply(self, msg, subject, body):
+        reply = EmailMessage()
+        reply['From'] = self.address
+        reply['To'] = str(msg['From'] or "")
+        reply['Subject'] = f"Re: {subject}"
+        reply['Message-ID'] = make_msgid(domain='wandero.ai')
+        if msg['Message-ID']:
+            reply['In-Reply-To'] = msg['Message-ID']
+            references = f"{msg['References']} {msg['Message-ID']}" if msg['References'] else msg['Message-ID']
+            reply['References'] = references
+        # Quote the client's email below the reply like a real mail client
+        quoted = '\n'.join(f"> {line}" for line in _plain_body(msg).splitlines())
+        reply.set_content(f"{body}\n\nOn {msg['Date'] or formatdate(self.clock.time())}, {msg['From'] or 'you'} wrote:\n{quoted}\n")
+        return reply
+
+    def _deliver(self, reply):
+        with self._lock:
+            self._pending -= 1
+        if self._stopped:
+            return
+        self.mailbox.deliver(reply)
+        self.replied += 1
+
+    def pending(self):
+        """Replies scheduled but not delivered yet"""
+        with self._lock:
+            return self._pending
+
+    def stop(self):
+        """Drop every reply not delivered yet"""
+        self._stopped = True
+
+# Recorded Wandero threads from a JSON file written by `cli.py export-wandero`:
+# {"threads": {"<conversation>": [{"delay": seconds, "body": text}, ...], ...}}
+def load_wandero_recording(path):
+    with open(path) as f:
+        threads = json.load(f)['threads']
+    return {name: [(reply['delay'], reply['body']) for reply in replies] for name, replies in threads.items() if replies}
+
+# Stand-in for Wandero that replays recorded replies with their recorded delays instead of the
+# script. Recorded threads are handed out in the recording's order to threads in the order their
+# first email arrives (reused round-robin when there are more threads than recordings); a thread
+# that runs out of replies repeats its last one, like the script's confirmation.
+class ReplayWandero(FakeWandero):
+    def __init__(self, mailbox, recording, address='hello@wandero.ai', clock=None):
+        if not recording:
+            raise ValueError("Wandero recording has no replies")
+        super().__init__(mailbox, address, latency=None, clock=clock)
+        self.recording = recording
+        self._order = list(recording)
+        self._threads = {}  # thread subject -> recorded replies
+
+    def next_reply(self, subject, stage):
+        replies = self._threads.get(subject)
+        if replies is None:
+            replies = self._threads[subject] = self.recording[self._order[len(self._threads) % len(self._order)]]
+        delay, body = replies[min(stage, len(replies) - 1)]
+        return body, delay
+
+# Transport that keeps all mail in memory: sent emails go to a FakeWandero whose replies land in the mailbox
+class MemoryTransport:
+    name = 'memory'
+
+    def __init__(self, wandero_address='hello@wandero.ai', latency='lognormal:60,0.6', replay=None):
+        self.mailbox = MemoryMailbox()
+        if replay:
+            self.wandero = ReplayWandero(self.mailbox, load_wandero_recording(replay), wandero_address)
+        else:
+            self.wandero = FakeWandero(self.mailbox, wandero_address, latency)
+        self.sent = 0
+
+    def send(self, msg):
+        """'Send' an email: the client only ever writes to Wandero, so it goes to the fake responder"""
+        if not msg['Message-ID']:
+            msg['Message-ID'] = make_msgid(domain='wandero-simulator')
+        self.sent += 1
+        self.wandero.receive(msg)
+        return True
+
+    def fetch_new(self, last_uid=None, from_email=None, subject=None):
+        return self.mailbox.fetch_new(last_uid, from_email, subject)
+
+    def start_watcher(self):
+        return self.mailbox
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'delivered': len(self.mailbox),
+            'wandero_replies': self.wandero.replied,
+            'wandero_pending': self.wandero.pending(),
+        }
+
+    def close(self):
+        self.wandero.stop()
@@ -0,0 +1,216 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from latency import LatencyHistogram
+
+# Quantiles reported for every timer
+TIMER_QUANTILES = (0.5, 0.95, 0.99)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Label values may contain anything; escape the characters the text format reserves
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+# Metric names only allow [a-zA-Z0-9_:]
+def metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+
+# In-process metrics in Prometheus text format. Counters and timers are updated from the hot
+# paths with a lock and a dict lookup; anything that is cheaper to read than to keep in sync
+# (like the analytics counters) is provided by collectors that only run when the endpoint is scraped.
+class MetricsRegistry:
+    def __init__(self, namespace='wandero'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.timers = {}  # (name, labels) -> LatencyHistogram
+        self.help = {}
+        self.collectors = []
+
+    def _key(self, name, labels):
+        return metric_name(f"{self.namespace}_{name}"), tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        """Set the HELP text of a metric"""
+        self.help[metric_name(f"{self.namespace}_{name}")] = text
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in a timer"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.timers.get(key)
+            if histogram is None:
+                histogram = self.timers[key] = LatencyHistogram(lowest=1e-6)
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the enclosed block into the given timer"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def add_collector(self, collector):
+        """Register collector() -> iterable of (name, type, help, labels dict, value), called on every scrape"""
+        self.collectors.append(collector)
+
+    def render(self):
+        """Every metric in Prometheus text exposition format"""
+        families = {}  # name -> (type, help, [sample lines])
+
+        def family(name, kind, help_text=None):
+            if name not in families:
+                families[name] = (kind, help_text or self.help.get(name, name), [])
+            return families[name][2]
+
+        with self._lock:
+            counters = list(self.counters.items())
+            timers = [(key, histogram.summary()) for key, histogram in self.timers.items()]
+        for (name, labels), value in counters:
+            family(name, 'counter').append(f"{name}_total{_labels_text(labels)} {value}")
+        for (name, labels), summary in timers:
+            lines = family(name, 'summary')
+            for quantile in TIMER_QUANTILES:
+                quantile_labels = labels + (('quantile', quantile),)
+                lines.append(f"{name}{_labels_text(quantile_labels)} {summary[f'p{int(quantile * 100)}']:.6f}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {summary['mean'] * summary['count']:.6f}")
+            lines.append(f"{name}_count{_labels_text(labels)} {summary['count']}")
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"[METRICS] Collector error: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                name = metric_name(f"{self.namespace}_{name}")
+                suffix = '_total' if kind == 'counter' else ''
+                family(name, kind, help_text).append(f"{name}{suffix}{_labels_text(tuple(sorted(labels.items())))} {value}")
+
+        output = []
+        for name, (kind, help_text, lines) in families.items():
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
+
+# Scrape-time view of every live conversation's ConversationAnalytics, summed across the fleet.
+# conversations may be any live collection (e.g. a dict's values()); it is only read when scraped.
+class AnalyticsCollector:
+    def __init__(self, conversations=None):
+        self.conversations = [] if conversations is None else conversations
+
+    def add(self, analytics):
+        self.conversations.append(analytics)
+
+    def __call__(self):
+        conversations = list(self.conversations)
+        sent = received = 0
+        performance, issues, strengths = {}, {}, {}
+        latency = LatencyHistogram()
+        scores = []
+        for analytics in conversations:
+            sent += analytics.emails_sent
+            received += analytics.emails_received
+            for totals, counters in ((performance, analytics.wandero_performance), (issues, analytics.wandero_issues),
+                                     (strengths, analytics.wandero_strengths)):
+                for name, value in counters.items():
+                    totals[name] = totals.get(name, 0) + value
+            latency.merge(analytics.response_times)
+            if analytics.emails_received:
+                scores.append(analytics.calculate_wandero_performance_score())
+
+        yield 'conversations', 'gauge', "Conversations tracked", {}, len(conversations)
+        yield 'emails_sent', 'counter', "Emails sent by simulated clients", {}, sent
+        yield 'emails_received', 'counter', "Emails received from Wandero", {}, received
+        for name, value in performance.items():
+            yield 'performance', 'counter', "Wandero performance counters", {'metric': name}, value
+        for name, value in issues.items():
+            yield 'issues', 'counter', "Wandero issues found", {'issue': name}, value
+        for name, value in strengths.items():
+            yield 'strengths', 'counter', "Wandero strengths found", {'strength': name}, value
+        yield 'score', 'gauge', "Average running performance score (0-100)", {}, sum(scores) / len(scores) if scores else 0.0
+        summary = latency.summary()
+        for quantile in TIMER_QUANTILES:
+            yield ('response_seconds', 'gauge', "Wandero response time quantiles", {'quantile': quantile},
+                   summary[f'p{int(quantile * 100)}'])
+
+_registry = None
+_analytics_collector = None
+
+# Shared registry used by the simulator's hot paths
+def get_metrics():
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+        _registry.describe('llm_call_seconds', "LLM API call latency including retries")
+        _registry.describe('llm_calls', "LLM API calls by label and outcome")
+        _registry.describe('llm_tokens', "LLM tokens by label and kind (prompt, cached prompt, completion)")
+        _registry.describe('mail_fetch_seconds', "Mailbox search and fetch latency")
+        _registry.describe('mail_send_seconds', "Email send latency")
+        _registry.describe('analysis_seconds', "Time spent scoring one Wandero reply")
+        _registry.describe('body_removed_bytes', "Quoted text and signatures cut from received emails, in bytes")
+        _registry.describe('body_removed_tokens', "Quoted text and signatures cut from received emails, in tokens")
+    return _registry
+
+# Collector for conversation analytics, registered with the shared registry on first use
+def track_analytics(analytics):
+    global _analytics_collector
+    if _analytics_collector is None:
+        _analytics_collector = AnalyticsCollector()
+        get_metrics().add_collector(_analytics_collector)
+    _analytics_collector.add(analytics)
+
+# LLMGateway listener recording every API call
+def record_llm_call(call):
+    metrics = get_metrics()
+    metrics.observe('llm_call_seconds', call.latency, label=call.label)
+    metrics.inc('llm_calls', label=call.label, ok=str(call.ok).lower())
+    if call.prompt_tokens:
+        metrics.inc('llm_tokens', call.prompt_tokens, label=call.label, kind='prompt')
+    if call.cached_tokens:
+        metrics.inc('llm_tokens', call.cached_tokens, label=call.label, kind='cached')
+    if call.completion_tokens:
+        metrics.inc('llm_tokens', call.completion_tokens, label=call.label, kind='completion')
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the simulator's output
+
+# Serve /metrics on a background thread; returns the server (call shutdown() to stop it)
+def start_metrics_server(port, host='127.0.0.1', registry=None):
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry or get_metrics()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[METRICS] Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
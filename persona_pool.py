@@ -0,0 +1,165 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from collections import deque, namedtuple
+
+from clock import get_clock
+from config import get_settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS openers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company TEXT NOT NULL,
+    persona TEXT NOT NULL,
+    initial_email TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS openers_by_company ON openers (company, id);
+"""
+
+# A persona together with the first email it sends, generated ahead of time
+Opener = namedtuple('Opener', ['persona', 'initial_email'])
+
+# Openers moved from disk to memory at once: one short transaction per batch, not per client
+CLAIM_BATCH = 64
+# A background refill starts once fewer than this share of the target size is left
+REFILL_THRESHOLD = 0.25
+# Concurrent generations for a bulk fill, and for a refill running next to live conversations
+# (the gateway's concurrency cap and token budget apply on top)
+FILL_CONCURRENCY = 16
+REFILL_CONCURRENCY = 2
+# Seconds to wait before trying again after a refill produced nothing (API down, replay misses)
+REFILL_BACKOFF = 300
+
+# Warm pool of personas and their initial emails, so a fleet opens without waiting on the LLM.
+# Openers live in a SQLite file filled ahead of time (cli.py fill-pool). take() pops from an
+# in-memory batch in O(1); batches are claimed with DELETE ... RETURNING, so worker processes
+# sharing the file never get the same opener. When a claim finds the pool low, a background task
+# generates more through the shared gateway. Openers are kept per company, since the emails
+# name its country.
+class PersonaPool:
+    def __init__(self, path, company, target_size=200, claim_batch=CLAIM_BATCH):
+        self.path = path
+        self.company = company
+        self.target_size = target_size
+        self.claim_batch = claim_batch
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self._ready = deque()  # claimed openers not handed out yet
+        self._refill_task = None
+        self._retry_at = None  # clock.monotonic() before which no refill starts
+        self.taken = 0
+        self.empty = 0
+        self.generated = 0
+        self.failed = 0
+        self.refills = 0
+
+    def available(self):
+        """Openers left for this company, on disk and claimed by this process"""
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM openers WHERE company = ?", (self.company,)).fetchone()
+        return count + len(self._ready)
+
+    def take(self):
+        """Next opener, or None when the pool is empty (the caller generates its own)"""
+        if not self._ready:
+            self._ready.extend(self._claim(self.claim_batch))
+            self._maybe_refill()
+        if not self._ready:
+            self.empty += 1
+            return None
+        self.taken += 1
+        return self._ready.popleft()
+
+    def _claim(self, count):
+        with self._lock:
+            rows = self._db.execute(
+                "DELETE FROM openers WHERE id IN (SELECT id FROM openers WHERE company = ? ORDER BY id LIMIT ?) "
+                "RETURNING id, persona, initial_email", (self.company, count)).fetchall()
+            self._db.commit()
+        return [Opener(json.loads(persona), initial_email) for _, persona, initial_email in sorted(rows)]
+
+    def add(self, openers):
+        """Store generated openers"""
+        now = get_clock().time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO openers (company, persona, initial_email, created_at) VALUES (?, ?, ?, ?)",
+                [(self.company, json.dumps(opener.persona), opener.initial_email, now) for opener in openers])
+            self._db.commit()
+
+    async def fill(self, count, concurrency=FILL_CONCURRENCY):
+        """Generate count personas and their initial emails through the LLM gateway; returns how many
+        were stored. Each is stored as soon as it is ready, so an interrupted fill keeps its work."""
+        from ai_generator import agenerate_initial_email, random_persona
+        from llm_cache import CacheMiss
+        from llm_gateway import LLMError
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate():
+            persona = random_persona()
+            async with semaphore:
+                try:
+                    initial_email = await agenerate_initial_email(persona)
+                except (LLMError, CacheMiss) as e:
+                    if not self.failed:
+                        print(f"[POOL] Could not generate an initial email: {e}")
+                    self.failed += 1
+                    return False
+            self.add([Opener(persona, initial_email)])
+            self.generated += 1
+            return True
+
+        return sum(await asyncio.gather(*(generate() for _ in range(count))))
+
+    def _maybe_refill(self):
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        if self._retry_at is not None and get_clock().monotonic() < self._retry_at:
+            return
+        available = self.available()
+        if available >= self.target_size * REFILL_THRESHOLD:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refill_task = loop.create_task(self._refill(self.target_size - available))
+
+    async def _refill(self, count):
+        self.refills += 1
+        print(f"[POOL] Running low, generating {count} openers in the background")
+        if not await self.fill(count, REFILL_CONCURRENCY):
+            self._retry_at = get_clock().monotonic() + REFILL_BACKOFF
+
+    def stats(self):
+        return {
+            'taken': self.taken,
+            'empty': self.empty,
+            'generated': self.generated,
+            'failed': self.failed,
+            'refills': self.refills,
+            'available': self.available(),
+        }
+
+    def close(self):
+        """Stop refilling and put claimed openers nobody took back on disk"""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        if self._ready:
+            self.add(self._ready)
+            self._ready.clear()
+        self._db.close()
+
+# Pool at path for the configured company (target_size None uses PERSONA_POOL_SIZE)
+def open_persona_pool(path, target_size=None):
+    settings = get_settings()
+    return PersonaPool(path, f"{settings.COMPANY_NAME} / {settings.COMPANY_COUNTRY}",
+                       target_size or settings.PERSONA_POOL_SIZE)
@@ -0,0 +1,141 @@
+from functools import lru_cache
+
+from config import get_settings
+
+# Compiled templates kept before the least recently used is dropped (one per prompt kind and persona)
+MAX_TEMPLATES = 4096
+
+# A prompt laid out for provider-side prefix caching: the leading messages are identical on every
+# call made with the template, and everything that changes per call goes into one final user
+# message filled from `suffix`. Providers reuse the longest prefix they have seen (OpenAI from
+# 1,024 tokens on, in 128-token steps), so the order goes from most to least shared: the rules,
+# the same for every client of the company; then the persona, the same for every round of one
+# client; then the conversation, which only grows at its end between rounds.
+class PromptTemplate:
+    def __init__(self, prefix, suffix):
+        self.prefix = tuple(prefix)
+        self.suffix = suffix
+
+    def messages(self, **volatile):
+        """Chat messages with the volatile fields filled into the final user message"""
+        return [*(dict(message) for message in self.prefix), {"role": "user", "content": self.suffix.format(**volatile)}]
+
+# Persona lines added to prompts (empty when no persona is used). Dates, budget and quirk are
+# optional: personas checkpointed by older runs only have a name and party size.
+def persona_context(persona):
+    if not persona:
+        return ""
+    lines = [f"Your name is {persona['name']} and you are planning for a group of {persona['travelers']} people."]
+    if persona.get('dates'):
+        lines.append(f"Trip dates: {persona['dates']}.")
+    if persona.get('budget'):
+        lines.append(f"Budget: {persona['budget']}.")
+    if persona.get('quirk'):
+        lines.append(f"Keep in mind: {persona['quirk']}.")
+    lines.append("Stay consistent with this.")
+    return "\n" + "\n".join(lines) + "\n"
+
+def _client_response(company_name, company_country):
+    system = f"""You are a realistic client planning a trip to {company_country}. You are communicating with Wandero, a travel planning service. Be natural, conversational, and authentic in your responses.
+
+Company Context: {company_name} in {company_country}
+
+Instructions:
+1. Act as a natural, realistic client who might:
+   - Provide requested information (but sometimes forget details)
+   - Ask clarifying questions
+   - Request changes to proposals
+   - Confirm plans
+   - Send follow-up emails with forgotten details
+   - Show excitement or concern about travel plans
+   - Ask about specific details (prices, dates, locations, etc.)
+
+2. Be conversational and natural - use casual language, ask questions, show personality
+3. If Wandero asks for information, provide realistic details about {company_country} travel
+4. If Wandero sends a proposal, either confirm it or request specific changes
+5. Occasionally add forgotten details in follow-up messages
+6. Keep responses concise but informative
+7. Show genuine interest in the travel planning process
+8. Always focus on {company_country} - ask about specific cities, regions, or attractions in {company_country}
+9. DO NOT include "Subject:" or any email headers in the body - just write the email content directly
+10. Be human-like: occasionally make small typos, use informal language, forget to mention some details, and be a bit scattered in your thoughts
+11. Don't be too perfect - be realistic about what a real person would write in an email"""
+    suffix = """Previous conversation:
+{conversation}
+Latest email from Wandero:
+{latest}
+
+Generate a natural client response to Wandero's latest email:"""
+    return system, suffix
+
+def _initial_email(company_name, company_country):
+    system = f"""You are a realistic client planning a trip to {company_country}. Write natural, conversational emails with real names (never use placeholders like [Your Name]). Be specific and authentic.
+
+Company Context: {company_name} in {company_country}
+
+Instructions:
+1. Write a natural, realistic initial email
+2. Include basic trip information (number of travelers, dates, destination preferences)
+3. Ask for help with planning a trip to {company_country} specifically
+4. Be friendly and conversational
+5. Show excitement about the trip to {company_country}
+6. Keep it concise but informative
+7. Use a realistic name (like "Sarah", "Michael", "Emma", "David", etc.) - DO NOT use placeholder text like [Your Name]
+8. Make it specific to {company_country} travel - mention specific cities, regions, or attractions in {company_country}
+9. DO NOT include "Subject:" or any email headers in the body - just write the email content directly
+10. Be human-like: occasionally make small typos, use informal language, forget to mention some details, and be a bit scattered in your thoughts
+11. Don't be too perfect - be realistic about what a real person would write in an email
+12. Use casual language like "hey", "thanks so much", "that sounds great", etc."""
+    suffix = "Generate an initial email to Wandero (a travel planning service) requesting help with trip planning:"
+    return system, suffix
+
+def _follow_up(company_name, company_country):
+    system = """You are a client who forgot to mention something important. Based on the conversation history, write a realistic follow-up email where the client remembers something they forgot to mention.
+
+Instructions:
+1. Write a natural follow-up email starting with something like "Oops, I forgot to mention..." or "By the way..."
+2. Add a realistic forgotten detail (dietary restrictions, accessibility needs, special requests, etc.)
+3. Keep it brief and casual
+4. Make it sound like a real person remembering something
+5. Be human-like: occasionally make small typos, use informal language, and be a bit scattered
+6. Use casual language like "hey", "btw", "thanks", etc.
+7. Don't be too perfect - be realistic about what a real person would write in a quick follow-up"""
+    suffix = """Previous conversation:
+{conversation}
+
+Generate the follow-up email:"""
+    return system, suffix
+
+# Builders of each client prompt: (system message, suffix format string) for a company
+CLIENT_PROMPTS = {
+    'client_response': _client_response,
+    'initial_email': _initial_email,
+    'follow_up': _follow_up,
+}
+
+@lru_cache(maxsize=MAX_TEMPLATES)
+def _compile(kind, persona_items, company_name, company_country):
+    system, suffix = CLIENT_PROMPTS[kind](company_name, company_country)
+    prefix = [{"role": "system", "content": system}]
+    persona = persona_context(dict(persona_items)).strip()
+    if persona:
+        prefix.append({"role": "system", "content": persona})
+    return PromptTemplate(prefix, suffix)
+
+# Compiled template of a client prompt kind for a persona and the configured company
+def client_template(kind, persona=None):
+    settings = get_settings()
+    return _compile(kind, tuple(sorted((persona or {}).items())), settings.COMPANY_NAME, settings.COMPANY_COUNTRY)
+
+# Template asking the LLM to fold aged-out turns into the running summary
+@lru_cache(maxsize=16)
+def summary_template(max_tokens):
+    system = f"""You summarize email threads accurately and concisely.
+
+You update the running summary of an email conversation between a travel client and Wandero, a travel planning service. Write the updated summary in at most {max_tokens} tokens. Keep concrete facts: names, number of travelers, dates, destinations, budget, requests, open questions and anything already agreed."""
+    suffix = """Current summary:
+{summary}
+
+New emails to fold in:
+{turns}"""
+    return PromptTemplate([{"role": "system", "content": system}], suffix)
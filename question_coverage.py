@@ -0,0 +1,121 @@
+import math
+from collections import Counter
+from functools import lru_cache
+from itertools import chain, compress, repeat
+from operator import itemgetter
+
+# A question counts as answered when its TF-IDF cosine similarity with some sentence of the reply reaches this
+ANSWER_THRESHOLD = 0.3
+
+# The token -> term cache is cleared when it grows past this many entries
+MAX_CACHED_TOKENS = 100000
+
+# Words that say nothing about what a question is about ("is breakfast included?" is about breakfast)
+STOP_WORDS = frozenset("""
+a about after again all also am an and any are as at be been before being but by can could did do does doing
+don dont for from had has have having he her here hers him his how i if im in into is it its just let like me
+more most my no nor not now of off on once only or other our ours out over own please same she should so some
+such than that the their theirs them then there these they this those through to too under until up us very
+was we were what when where which while who whom why will with would you your yours hi hello hey thanks thank
+""".split())
+
+_terms = {}  # token -> term ('' for stop words)
+
+# Index term for a token: stop words and single letters ("don't" -> "don", "t") dropped, plurals
+# folded into the singular ("costs" matches "cost")
+def term(token):
+    cached = _terms.get(token)
+    if cached is None:
+        if len(_terms) >= MAX_CACHED_TOKENS:
+            _terms.clear()
+        if token in STOP_WORDS or len(token) < 2:
+            cached = ''
+        elif len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+            cached = token[:-1]
+        else:
+            cached = token
+        _terms[token] = cached
+    return cached
+
+# Terms of each question (token tuples), skipping questions made only of stop words. Cached: the
+# same client email is scored against every reply that answers it.
+@lru_cache(maxsize=256)
+def question_terms(questions):
+    return tuple(terms for terms in (frozenset(map(term, question)) - {''} for question in questions) if terms)
+
+# Squared IDF weight of a term found in document_frequency of the reply's sentences. Cached: replies
+# have few distinct (sentences, frequency) pairs and every reply repeats them.
+@lru_cache(maxsize=4096)
+def _weight(documents, document_frequency):
+    return (math.log((1 + documents) / (1 + document_frequency)) + 1) ** 2
+
+# Scores how many of a client's questions a reply answers. The reply's sentences are the documents
+# of a small TF-IDF index (IDF from the reply itself, so words every sentence uses count for little;
+# TF is binary, sentences rarely repeat a content word). Each question is compared with every
+# sentence by cosine similarity and counts as answered when its best match reaches the threshold.
+# Only the reply's vocabulary is folded into terms in Python; document frequencies, the question
+# words each sentence holds and sentence norms are set, Counter and map passes over the sentences,
+# so the per-token work runs in C, and a reply holding no question word is settled once counted.
+# The question x sentence similarities are sparse dot products: each sentence is reduced to the
+# question terms it holds, and a question is scored against it from the terms they share, so the
+# work is questions x sentences x shared terms and no numpy is needed.
+class QuestionCoverage:
+    def __init__(self, threshold=ANSWER_THRESHOLD):
+        self.threshold = threshold
+
+    def score(self, questions, passages):
+        """(questions asked, questions answered) for the questions (tuple of token tuples) and reply sentences (token lists)"""
+        similarities = self.similarities(questions, passages)
+        return len(similarities), sum(1 for similarity in similarities if similarity >= self.threshold)
+
+    def similarities(self, questions, passages):
+        """Best similarity of each question with any passage; questions made only of stop words are skipped"""
+        questions = question_terms(questions)
+        if not questions:
+            return []
+        passages = list(map(set, passages))
+        token_frequency = Counter(chain.from_iterable(passages))
+        # Fold the reply's distinct tokens into terms ("cost" and "costs" share one)
+        term_frequency = Counter()
+        token_terms = {}
+        cached = _terms.get
+        for token, frequency in token_frequency.items():
+            word = cached(token)
+            if word is None:
+                word = term(token)
+            token_terms[token] = word
+            if word:
+                term_frequency[word] += frequency
+        asked = set().union(*questions)
+        wanted = {token: word for token, word in token_terms.items() if word in asked}
+        if not wanted:
+            return [0.0] * len(questions)
+        total = len(passages)
+        weights = {word: _weight(total, frequency) for word, frequency in term_frequency.items()}
+        token_weights = {token: weights.get(word, 0.0) for token, word in token_terms.items()}
+
+        # Sparse question x sentence matrix: the question tokens each sentence holds. Of sentences
+        # holding the same ones only the one with the smallest norm can be a best match; sorting
+        # by norm, largest first, lets dict() keep it.
+        held = list(map(frozenset(wanted).intersection, passages))
+        norms = map(math.sqrt, map(sum, map(map, repeat(token_weights.__getitem__), compress(passages, held))))
+        rows = dict(sorted(zip(filter(None, held), norms), key=itemgetter(1), reverse=True))
+        # Smallest norms first: a question's summed term weights over a sentence's norm bounds its
+        # similarity with that sentence and every later one, so the scan stops once it can't win
+        rows = sorted(rows.items(), key=itemgetter(1))
+        if any(token != word for token, word in wanted.items()):
+            rows = [(frozenset(map(wanted.__getitem__, tokens)), norm) for tokens, norm in rows]
+
+        unseen = _weight(total, 0)
+        best = []
+        for terms in questions:
+            norm = math.sqrt(sum(weights.get(word, unseen) for word in terms))
+            reachable = sum(weights.get(word, 0.0) for word in terms)
+            match = 0.0
+            for held, sentence_norm in rows:
+                if reachable <= match * sentence_norm:
+                    break
+                if not terms.isdisjoint(held):
+                    match = max(match, sum(map(weights.__getitem__, terms & held)) / sentence_norm)
+            best.append(match / norm)
+        return best
@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import random
+import weakref
+
+# Share of the heap that may be cancelled entries before it is rebuilt without them
+COMPACT_RATIO = 0.5
+COMPACT_MIN_SIZE = 64
+
+# Spread a delay uniformly over delay * (1 ± jitter) so timers armed together don't fire together
+def jittered(delay, jitter=0.0):
+    if not jitter:
+        return delay
+    return max(0.0, delay * random.uniform(1.0 - jitter, 1.0 + jitter))
+
+# One pending callback. cancel() is O(1): the entry stays in the heap and is skipped when it
+# reaches the top (or dropped when the heap is compacted).
+class Timer:
+    __slots__ = ('when', 'kind', 'callback', 'args', 'cancelled', 'fired', '_scheduler')
+
+    def __init__(self, scheduler, when, kind, callback, args):
+        self._scheduler = scheduler
+        self.when = when
+        self.kind = kind
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
+
+    @property
+    def pending(self):
+        return not (self.cancelled or self.fired)
+
+    def cancel(self):
+        """Stop the timer from firing; returns False if it already fired or was cancelled"""
+        if not self.pending:
+            return False
+        self.cancelled = True
+        self.callback = self.args = None  # drop references held by the heap entry
+        self._scheduler._cancelled(self)
+        return True
+
+    def remaining(self):
+        """Seconds until the timer fires"""
+        return max(0.0, self.when - self._scheduler.time())
+
+# Timers for every conversation on one event loop: follow-ups, poll deadlines and send retries.
+# Entries live in a single binary heap (schedule O(log n), cancel O(1), firing O(log n)) and the
+# loop holds one call_at handle for the earliest of them, so thousands of waiting conversations
+# cost the loop a single timer instead of one each.
+class TimerScheduler:
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self._heap = []  # (when, sequence, Timer)
+        self._sequence = itertools.count()
+        self._handle = None
+        self._handle_when = None
+        self._cancelled_in_heap = 0
+        self.scheduled = {}  # kind -> timers scheduled
+        self.fired = {}  # kind -> timers fired
+        self.cancelled = {}  # kind -> timers cancelled
+
+    def time(self):
+        return self.loop.time()
+
+    def __len__(self):
+        """Timers still pending"""
+        return len(self._heap) - self._cancelled_in_heap
+
+    def call_later(self, delay, callback, *args, jitter=0.0, kind='timer'):
+        """Run callback(*args) on the loop after delay seconds (± jitter as a fraction of delay)"""
+        return self.call_at(self.time() + jittered(delay, jitter), callback, *args, kind=kind)
+
+    def call_at(self, when, callback, *args, kind='timer'):
+        """Run callback(*args) on the loop at loop time `when`"""
+        timer = Timer(self, when, kind, callback, args)
+        heapq.heappush(self._heap, (when, next(self._sequence), timer))
+        self.scheduled[kind] = self.scheduled.get(kind, 0) + 1
+        if self._handle_when is None or when < self._handle_when:
+            self._arm(when)
+        return timer
+
+    async def sleep(self, delay, jitter=0.0, kind='sleep'):
+        """Suspend the calling task for delay seconds (± jitter); returns the delay actually slept"""
+        waiter = self.loop.create_future()
+        timer = self.call_later(delay, _resolve, waiter, None, jitter=jitter, kind=kind)
+        started = self.time()
+        try:
+            await waiter
+        finally:
+            timer.cancel()
+        return self.time() - started
+
+    def deadline(self, future, timeout, result=None, jitter=0.0, kind='deadline'):
+        """Resolve future with result after timeout seconds unless something else completes it first"""
+        return self.call_later(timeout, _resolve, future, result, jitter=jitter, kind=kind)
+
+    def stats(self):
+        return {
+            'pending': len(self),
+            'scheduled': dict(self.scheduled),
+            'fired': dict(self.fired),
+            'cancelled': dict(self.cancelled),
+        }
+
+    def _arm(self, when):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = self.loop.call_at(when, self._run)
+        self._handle_when = when
+
+    def _cancelled(self, timer):
+        self.cancelled[timer.kind] = self.cancelled.get(timer.kind, 0) + 1
+        self._cancelled_in_heap += 1
+        if len(self._heap) >= COMPACT_MIN_SIZE and self._cancelled_in_heap > len(self._heap) * COMPACT_RATIO:
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+
+    def _run(self):
+        """Fire every timer that is due, then re-arm the loop for the next one"""
+        self._handle = self._handle_when = None
+        now = self.time()
+        # self._heap is re-read each time: a callback that cancels timers may compact it
+        while self._heap and self._heap[0][0] <= now:
+            timer = heapq.heappop(self._heap)[2]
+            if timer.cancelled:
+                self._cancelled_in_heap -= 1
+                continue
+            timer.fired = True
+            self.fired[timer.kind] = self.fired.get(timer.kind, 0) + 1
+            callback, args = timer.callback, timer.args
+            timer.callback = timer.args = None
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"[SCHEDULER] {timer.kind} timer failed: {e}")
+        # Cancelled entries at the top would only cause empty wake-ups
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._cancelled_in_heap -= 1
+        if self._heap:
+            self._arm(self._heap[0][0])
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+_schedulers = weakref.WeakKeyDictionary()  # event loop -> TimerScheduler
+
+# Shared scheduler for the running event loop
+def get_scheduler():
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        scheduler = _schedulers[loop] = TimerScheduler(loop)
+    return scheduler
@@ -0,0 +1,180 @@
+import re
+import string
+from collections import namedtuple
+from functools import lru_cache
+from itertools import chain
+
+from question_coverage import QuestionCoverage
+
+# Keyword lexicons used to score Wandero's replies. Terms match whole words, so inflections are
+# listed explicitly; multi-word terms allow any whitespace between their words, and symbol
+# terms ("$") match anywhere.
+LEXICONS = {
+    'proposals': ['proposal', 'proposals', 'offer', 'offers', 'offered', 'package', 'packages',
+                  'itinerary', 'itineraries', 'plan', 'plans', 'planned', 'planning'],
+    'personalization': ['your', 'based on', 'specifically', 'customized', 'customised', 'tailored'],
+    'follow_up': ['could you', 'would you', 'do you', 'what about', 'when'],
+    'upsell': ['premium', 'upgrade', 'upgrades', 'upgraded', 'additional', 'extra', 'extras', 'luxury', 'luxurious'],
+    'pricing': ['$', '€', '£', 'dollar', 'dollars', 'euro', 'euros', 'price', 'prices', 'priced', 'pricing',
+                'cost', 'costs', 'budget', 'budgets'],
+    'date_flexibility': ['alternative', 'alternatives', 'different dates', 'flexible', 'flexibility',
+                         'change', 'changes', 'changed'],
+    'local_knowledge': ['local', 'locals', 'authentic', 'traditional', 'culture', 'cultural', 'custom', 'customs'],
+}
+
+# Characters that end a word besides whitespace
+_PUNCTUATION = string.punctuation + '“”‘’–—…€£'
+
+# Punctuation becomes whitespace so str.split() yields plain words (both run in C)
+_WORD_BREAKS = str.maketrans({char: ' ' for char in _PUNCTUATION})
+
+# Lowercased text as a list of words
+def tokenize(text_lower):
+    return text_lower.translate(_WORD_BREAKS).split()
+
+# Like _WORD_BREAKS, but sentence-ending punctuation becomes a NUL that marks the sentence break
+_SENTENCE_WORD_BREAKS = str.maketrans({**{char: ' ' for char in _PUNCTUATION},
+                                       '.': '\0', '!': '\0', '?': '\0'})
+
+# Lowercased text as a list of sentences (split after '.', '!', '?' and at blank lines), each a
+# list of words; the same words tokenize() gives, from one translate pass
+def tokenize_sentences(text_lower):
+    marked = text_lower.replace('\n\n', '\0').translate(_SENTENCE_WORD_BREAKS)
+    return [words for words in map(str.split, marked.split('\0')) if words]
+
+# Lookahead for the end of a word: whitespace, punctuation or the end of the text
+_WORD_END = '(?![^\\s' + re.escape(_PUNCTUATION) + '])'
+
+# Whether any of the term patterns (a term, then the end of a word) matches lowercased text at
+# the beginning of a word, as tokenize() splits words
+def _find_terms(text_lower, patterns):
+    for pattern in patterns:
+        match = pattern.search(text_lower)
+        while match:
+            start = match.start()
+            if start == 0 or text_lower[start - 1].isspace() or text_lower[start - 1] in _PUNCTUATION:
+                return True
+            match = pattern.search(text_lower, start + 1)
+    return False
+
+# Sentence boundaries: whitespace after '.', '!' or '?', or a blank line
+_SENTENCE_BREAKS = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+# Words of every question (sentence ending in '?') in a lowercased client email. Cached: the same
+# client email is scored against every reply that answers it.
+@lru_cache(maxsize=256)
+def split_questions(text_lower):
+    questions = []
+    for sentence in _SENTENCE_BREAKS.split(text_lower):
+        sentence = sentence.rstrip(')"\'”’ ')
+        if sentence.endswith('?'):
+            questions.append(tuple(tokenize(sentence)))
+    return tuple(questions)
+
+# Categories hit by one message and, when client questions were given, how many were answered
+MessageScore = namedtuple('MessageScore', ['categories', 'questions_asked', 'questions_answered'])
+
+# Shortest substrings every lexicon term contains at least one of, chosen greedily: each pick is
+# the substring of min_length or more characters found in the most terms not yet covered (a
+# shorter word only for terms made of short words, like "do you"). "plan" stands for plan, plans,
+# planned and planning and "ditional" for additional and traditional, so a message without
+# keywords costs fewer scans than there are terms. Returns probe -> terms it stands for.
+def _probes(terms, min_length=4):
+    candidates = {}
+    for term in terms:
+        words = term.split()
+        for word in words:
+            if len(word) >= min_length or max(map(len, words)) < min_length:
+                candidates.setdefault(word, set())
+            for start in range(len(word) - min_length + 1):
+                for end in range(start + min_length, len(word) + 1):
+                    candidates.setdefault(word[start:end], set())
+    for candidate, covered in candidates.items():
+        covered.update(term for term in terms if any(candidate in word for word in term.split()))
+    uncovered, probes = set(terms), {}
+    while uncovered:
+        probe = max(candidates, key=lambda candidate: (len(candidates[candidate] & uncovered), len(candidate)))
+        probes[probe] = candidates[probe] & uncovered
+        uncovered -= candidates[probe]
+    return probes
+
+# Compiles every lexicon once into substring probes (see _probes). A probe is one C-level
+# substring scan; only when it occurs are the terms it stands for confirmed as whole words by
+# looking at their occurrences, so matches are whole words ("plan" no longer matches "planet")
+# while a message without keywords costs about what the old substring scans did. Like those scans
+# each category stops at its first hit, and a probe shared by categories is scanned for once.
+# Words end where tokenize() splits them; multi-word terms allow any whitespace between their
+# words. A message scored for question coverage is tokenized once, split by sentence (see
+# question_coverage.py), and its categories then come from that tokenization instead: one set of
+# its words, checked against each category's words, with a multi-word term confirmed by its
+# pattern only when all its words occur. Without client questions the probes are cheaper than
+# tokenizing (they stop at a category's first hit).
+class ScoringEngine:
+    def __init__(self, lexicons=LEXICONS, coverage=None):
+        self.lexicons = lexicons
+        self.coverage = coverage or QuestionCoverage()
+        words = [term for terms in lexicons.values() for term in terms if term[0].isalnum()]
+        term_probes = {term: probe for probe, terms in _probes(words).items() for term in terms}
+        # [(category, [(probe, [term patterns], or None for a symbol)])]. Single words go first: a
+        # multi-word term's probe is often a common word ("you"), so ruling the term out takes a
+        # full regex scan, while the category's single words may already settle it.
+        self.categories = []
+        # [(category, {single words}, [(words of a multi-word term, [its pattern])], [symbols])]
+        self.category_words = []
+        for category, terms in lexicons.items():
+            probes = {}
+            words, phrases, symbols = set(), [], []
+            for term in sorted(terms, key=lambda term: len(term.split())):
+                if not term[0].isalnum():
+                    probes[term] = None
+                    symbols.append(term)
+                    continue
+                pattern = re.compile(r'\s+'.join(map(re.escape, term.split())) + _WORD_END)
+                probes.setdefault(term_probes[term], []).append(pattern)
+                if ' ' in term:
+                    phrases.append((frozenset(term.split()), [pattern]))
+                else:
+                    words.add(term)
+            self.categories.append((category, list(probes.items())))
+            self.category_words.append((category, frozenset(words), phrases, symbols))
+
+    def score(self, text, client_questions=None):
+        """Score one message: every category hit plus, when client questions are given, question coverage"""
+        text_lower = text.lower()
+        if not client_questions:
+            return MessageScore(self._probe_categories(text_lower), 0, 0)
+        sentences = tokenize_sentences(text_lower)
+        found = self._word_categories(text_lower, set(chain.from_iterable(sentences)))
+        asked, answered = self.coverage.score(split_questions(client_questions.lower()), sentences)
+        return MessageScore(found, asked, answered)
+
+    def _probe_categories(self, text_lower):
+        found = set()
+        occurs = {}  # probe -> whether it is in the text
+        for category, probes in self.categories:
+            for probe, patterns in probes:
+                present = occurs.get(probe)
+                if present is None:
+                    present = occurs[probe] = probe in text_lower
+                if present and (patterns is None or _find_terms(text_lower, patterns)):
+                    found.add(category)
+                    break
+        return found
+
+    def _word_categories(self, text_lower, words):
+        found = set()
+        for category, single, phrases, symbols in self.category_words:
+            if (not single.isdisjoint(words)
+                    or any(phrase <= words and _find_terms(text_lower, patterns) for phrase, patterns in phrases)
+                    or any(symbol in text_lower for symbol in symbols)):
+                found.add(category)
+        return found
+
+_default_engine = None
+
+# Shared engine compiled once on first use
+def get_scoring_engine():
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = ScoringEngine()
+    return _default_engine
@@ -1,158 +1,646 @@
-import time
+import argparse
+import asyncio
 import random
-import uuid
-from config import *
+from concurrent.futures import ThreadPoolExecutor
+from clock import CLOCK_MODES, configure_clock, get_clock
+from config import ConfigError, get_settings
 from email_client import *
 from ai_generator import *
 from analytics import ConversationAnalytics
+from conversation_context import ConversationContext
+from latency import LatencyHistogram
+from mail_router import MailRouter
+from persona_pool import open_persona_pool
+from metrics import get_metrics, record_llm_call, start_metrics_server, track_analytics
+from scheduler import get_scheduler
+from state_store import StateStore
+from tracing import configure_tracing, get_tracer
+from transcript import new_transcript
+from llm_cache import CACHE_MODES, CacheMiss
+from llm_gateway import LLMError
+
+DEFAULT_SUBJECT = "Trip Planning Request"
+
+# Poll deadlines and send retries are spread by this fraction so a fleet started together doesn't
+# hit the mailbox or the LLM in lockstep
+POLL_JITTER = 0.1
+RETRY_JITTER = 0.2
+
+# Chance of a follow-up with forgotten details after each response from round 3 on, and its delay
+FOLLOW_UP_CHANCE = 0.15
+FOLLOW_UP_DELAY = 120
+FOLLOW_UP_JITTER = 0.5  # 60-180 seconds
+
+# Emails reloaded into the history on resume besides those the prompt context hasn't seen: the
+# context checkpoint holds the summary and recent turns, and follow-ups quote the last four emails
+RESUME_HISTORY = 4
+
+# Subject line for a conversation (fleet clients get a unique tag so replies can be told apart)
+def conversation_subject(client_id=None):
+    if client_id is None:
+        return DEFAULT_SUBJECT
+    return f"{DEFAULT_SUBJECT} #{client_id:04d}"
+
+# Key a conversation is stored under in the state store
+def conversation_key(client_id=None, run_id='default'):
+    if client_id is None:
+        return f"{run_id}/single"
+    return f"{run_id}/client-{client_id:04d}"
+
+# Bridges IDLE pushes from the watcher thread onto the event loop so waiting conversations wake at once.
+# Each waiting conversation is a future plus a poll deadline in the shared scheduler; a push
+# resolves every waiter and their deadlines are cancelled.
+class MailSignal:
+    def __init__(self, watcher=None, scheduler=None):
+        self.loop = asyncio.get_running_loop()
+        self.scheduler = scheduler or get_scheduler()
+        self.watcher = watcher
+        self.last_push_time = None
+        self._generation = 0
+        self._waiters = set()
+        if watcher is not None:
+            watcher.add_listener(self.notify_threadsafe)
+
+    def notify_threadsafe(self):
+        """Called from the watcher thread when new mail arrives"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self):
+        self.last_push_time = get_clock().time()
+        self._generation += 1
+        waiters, self._waiters = self._waiters, set()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+
+    def current(self):
+        """Snapshot to take before checking the mailbox, so a push during the check isn't missed"""
+        return self._generation
+
+    async def wait(self, since, timeout):
+        """Wait until new mail is pushed or the poll deadline (timeout ± POLL_JITTER) passes"""
+        if self.watcher is None or not self.watcher.supports_idle:
+            await self.scheduler.sleep(timeout, jitter=POLL_JITTER, kind='poll')
+            return False
+        if self._generation != since:
+            return True
+        waiter = self.loop.create_future()
+        self._waiters.add(waiter)
+        deadline = self.scheduler.deadline(waiter, timeout, False, jitter=POLL_JITTER, kind='poll')
+        try:
+            return await waiter
+        finally:
+            deadline.cancel()
+            self._waiters.discard(waiter)
+
+# Start the transport's new-mail watcher (IMAP IDLE or the in-memory mailbox) and its event-loop
+# bridge; plain polling when use_idle is False
+def start_mail_signal(use_idle=True):
+    watcher = get_transport().start_watcher() if use_idle else None
+    return MailSignal(watcher)
+
+# Print how many logins, pushes and sends the run needed
+def print_mail_stats(mail_signal, router=None):
+    transport = get_transport()
+    stats = transport.stats()
+    if mail_signal.watcher is not None:
+        stats['watcher_pushes'] = mail_signal.watcher.pushes
+        stats['watcher_handshakes'] = mail_signal.watcher.handshakes
+    if router is not None:
+        stats.update({f'router_{name}': value for name, value in router.stats().items()})
+    print(f"[MAIL] Transport: {transport.name}")
+    for name, value in stats.items():
+        print(f"  {name.replace('_', ' ').capitalize()}: {value:.2f}" if isinstance(value, float) else
+              f"  {name.replace('_', ' ').capitalize()}: {value}")
+
+# Print how many timers the scheduler ran or cancelled, by kind
+def print_scheduler_stats(scheduler):
+    stats = scheduler.stats()
+    kinds = sorted(stats['scheduled'])
+    print(f"[SCHEDULER] Pending: {stats['pending']} | " + " | ".join(
+        f"{kind}: {stats['fired'].get(kind, 0)} fired, {stats['cancelled'].get(kind, 0)} cancelled" for kind in kinds))
+
+# Print completion cache effectiveness for the run
+def print_llm_stats():
+    gateway = get_llm_gateway().stats()
+    print(f"[LLM] Calls: {gateway['calls']} | Failures: {gateway['failures']} | Retries: {gateway['retries']}"
+          f" | Coalesced: {gateway['coalesced']} | Avg latency: {gateway['avg_latency_seconds']:.2f}s"
+          f" | Tokens: {gateway['prompt_tokens']} prompt ({gateway['cached_tokens']} cached), {gateway['completion_tokens']} completion")
+    # Prompt-cache share, latency of calls with and without a cache hit, and cost per label
+    tracker = get_llm_gateway().usage
+    for label, usage in tracker.summary().items():
+        if not usage['calls'] or (label == 'total' and len(tracker.labels) < 2):
+            continue
+        latency = ", ".join(f"{kind} {usage[f'{kind}_latency']:.2f}s" for kind in ('hit', 'miss')
+                             if usage[f'{kind}_latency'] is not None)
+        print(f"[LLM]   {label}: {usage['calls']} calls | Prompt cache: {usage['cached_share']:.0%} of prompt tokens"
+              f" | Latency {latency} | Cost ${usage['cost']:.4f} (saved ${usage['saved']:.4f})")
+    cache = get_completion_cache().stats()
+    if cache['mode'] == 'off':
+        return
+    print(f"[LLM] Cache ({cache['mode']}): {cache['hits']} hits ({cache['memory_hits']} memory, {cache['disk_hits']} disk)"
+          f" | {cache['misses']} misses | {cache['evictions']} evictions | Hit rate: {cache['hit_rate']:.0%}")
+
+# How many conversations opened with a pre-generated persona and email
+def print_pool_stats(pool):
+    stats = pool.stats()
+    print(f"[POOL] Openers taken: {stats['taken']} | Pool empty: {stats['empty']} | Generated: {stats['generated']}"
+          f" ({stats['failed']} failed, {stats['refills']} refills) | Left: {stats['available']}")
+
+# Run one simulated client conversation on the event loop.
+# LLM calls go through the shared async gateway and blocking mailbox calls run in the loop's
+# executor, so conversations overlap.
+# With a store, every message and analytics event is journaled and the conversation resumes
+# from its last checkpoint after a crash instead of re-sending the initial email.
+async def run_conversation(client_id=None, persona=None, history=None, max_rounds=50, check_interval=120,
+                           mail_signal=None, store=None, run_id='default', on_analytics=None, router=None, pool=None):
+    tag = f"[Client {client_id}]" if client_id is not None else ""
+    mail_signal = mail_signal or MailSignal()
+    scheduler = mail_signal.scheduler
+    tracer = get_tracer()
+    # Replies reach the conversation through the router's shared mailbox scan
+    own_router = router is None
+    router = router or MailRouter(mail_signal, check_interval).start()
+    history = history if history is not None else new_transcript()
+    subject = conversation_subject(client_id)
+    conversation_id = conversation_key(client_id, run_id)
 
-# Main conversation loop
-def main():
-    print("=== Wandero Client Simulator ===")
-    print(f"Starting conversation with {WANDERO_EMAIL}")
-    print(f"Company: {COMPANY_NAME} in {COMPANY_COUNTRY}")
-    print("=" * 40)
-    
     # Check if we should send initial email or continue existing conversation
     initial_email_sent = False
+    awaiting_reply = False
+    pending_reply = None  # latest Wandero email the client hasn't answered yet
     last_uid = None
+    uidvalidity = None  # UIDVALIDITY last_uid belongs to
     conversation_rounds = 0
-    max_rounds = 50  # Increased for continuous operation
-    check_interval = 120  # Check every 2 minutes (120 seconds)
-    
+    follow_up_timer = None  # pending follow-up, cancelled if Wandero replies first
+    follow_up_task = None
+
     # Initialize analytics
     analytics = ConversationAnalytics()
-    
+    # Bounded prompt context: recent turns verbatim plus a rolling summary of older ones
+    settings = get_settings()
+    context = ConversationContext(settings.CONTEXT_KEEP_TURNS, settings.CONTEXT_TOKEN_BUDGET)
+
+    saved = store.load_checkpoint(conversation_id) if store else None
+    if saved:
+        initial_email_sent = saved['initial_email_sent']
+        awaiting_reply = saved['awaiting_reply']
+        pending_reply = saved.get('pending_reply')
+        last_uid = saved['last_uid']
+        uidvalidity = saved.get('uidvalidity')
+        conversation_rounds = saved['rounds']
+        persona = saved.get('persona') or persona
+        analytics = ConversationAnalytics.from_state(saved['analytics'])
+        if saved.get('context'):
+            context.load_state(saved['context'])
+        total = store.message_count(conversation_id)
+        recent = store.load_history(conversation_id, limit=max(RESUME_HISTORY, total - context.seen))
+        history.extend(recent)
+        context.history_start = total - len(recent)
+        print(f"\n{tag}[STATE] Resumed {conversation_id} at round {conversation_rounds} (last UID {last_uid})")
+    # A pre-generated persona and first email, so opening doesn't wait on the LLM
+    pooled_email = None
+    if pool is not None and not initial_email_sent:
+        opener = pool.take()
+        if opener is not None:
+            persona, pooled_email = opener.persona, opener.initial_email
+    track_analytics(analytics)
+    if on_analytics is not None:
+        on_analytics(conversation_id, analytics)
+    if saved and saved.get('completed'):
+        print(f"{tag}[STATE] Conversation already completed")
+        if own_router:
+            router.stop()
+        return analytics
+    # Fleet replies are also matched by their subject tag; a single client takes every reply
+    router.register(conversation_id, subject if client_id is not None else None, analytics.email_references,
+                    default=client_id is None)
+
+    def checkpoint(completed=False):
+        if store:
+            store.save_checkpoint(conversation_id, {
+                'initial_email_sent': initial_email_sent,
+                'awaiting_reply': awaiting_reply,
+                'pending_reply': pending_reply,
+                'last_uid': last_uid,
+                'uidvalidity': uidvalidity,
+                'rounds': conversation_rounds,
+                'persona': persona,
+                'completed': completed,
+                'analytics': analytics.to_state(),
+                'context': context.to_state(),
+            })
+
+    def journal_sent(body, message_id):
+        if store:
+            store.record_message(conversation_id, "Client", body, message_id=message_id)
+            store.record_event(conversation_id, 'email_sent', message_id=message_id)
+
+    # Follow-up with forgotten details, run as its own task when its timer fires
+    async def send_follow_up():
+        try:
+            follow_up = await agenerate_follow_up_email(history, persona)
+        except (LLMError, CacheMiss) as e:
+            print(f"\n{tag}[LLM] Error generating follow-up: {e}")
+            return
+        if not follow_up:
+            return
+        print(f"\n{tag}[CLIENT] Sending follow-up email...")
+        print(f"{tag}Subject: {subject}")
+        print(f"{tag}Body: {follow_up}")
+
+        # Prepare threading headers for follow-up
+        in_reply_to, references = analytics.get_threading_headers()
+
+        message_id = await asyncio.to_thread(send_email, subject, follow_up, in_reply_to=in_reply_to, references=references)
+        if message_id:
+            history.append(("Client", follow_up))
+            router.add_message_id(message_id, conversation_id)
+            analytics.record_email_sent(message_id)
+            journal_sent(follow_up, message_id)
+            checkpoint()
+            print(f"\n{tag}[CLIENT] Follow-up sent successfully!")
+
+    def start_follow_up():
+        nonlocal follow_up_task
+        follow_up_task = asyncio.create_task(send_follow_up())
+
     while conversation_rounds < max_rounds:
         conversation_rounds += 1
-        print(f"\n--- Round {conversation_rounds} ---")
-        
-        # Send initial email if not sent yet
-        if not initial_email_sent:
-            print("\n[CLIENT] Sending initial email...")
-            initial_email = generate_initial_email()
-            subject = "Trip Planning Request"
-            print(f"Subject: {subject}")
-            print(f"Body: {initial_email}")
-            
-            if send_email(subject, initial_email):
-                conversation_history.append(("Client", initial_email))
-                # Generate a Message-ID for threading
-                message_id = f"<{uuid.uuid4()}@wandero-simulator>"
-                analytics.record_email_sent(message_id)
-                print("\n[CLIENT] Initial email sent successfully!")
-                
-                # Show real-time analytics
-                print(f"\n[ANALYTICS] Round {conversation_rounds} Stats:")
-                print(f"  - Emails sent: {analytics.emails_sent}")
-                print(f"  - Emails received: {analytics.emails_received}")
-                
-                initial_email_sent = True
-                # Wait before checking for response
-                print(f"\n[CLIENT] Waiting {check_interval//60} minutes before checking for response...")
-                time.sleep(check_interval)
-                continue
-            else:
-                print("\n[ERROR] Failed to send initial email. Retrying in 5 minutes...")
-                time.sleep(check_interval)
-                continue
-        
-        # Wait for Wandero's response
-        print(f"\n[CLIENT] Checking for Wandero's response (checking every {check_interval//60} minutes)...")
-        wandero_response, new_uid = check_for_new_email(last_uid, wait_time=check_interval)
-        
-        if wandero_response:
-            print(f"\n[WANDERO] Response received:")
-            print(f"Body: {wandero_response}")
-            conversation_history.append(("Wandero", wandero_response))
-            analytics.record_email_received()
-            
-            # Calculate response time AFTER recording email received
-            response_time = analytics.record_response_time()
-            if response_time:
-                print(f"\n[ANALYTICS] Wandero responded in {response_time/60:.1f} minutes")
-            
-            # Analyze Wandero's performance
-            client_questions = None
-            if conversation_history and conversation_history[-2][0] == "Client":
-                client_questions = conversation_history[-2][1]  # Get the last client message
-            analytics.analyze_wandero_response(wandero_response, client_questions)
-            
-            last_uid = new_uid
-            
-            # Show basic real-time stats only
-            print(f"\n[ANALYTICS] Round {conversation_rounds} - Basic Stats:")
-            print(f"  Emails sent: {analytics.emails_sent} | Received: {analytics.emails_received}")
-            if analytics.response_times:
-                avg_time = sum(analytics.response_times) / len(analytics.response_times)
-                print(f"  Average response time: {avg_time/60:.1f} minutes")
-                print(f"  Current score: {analytics.calculate_wandero_performance_score():.1f}/100")
-            
-            # Generate client response
-            print("\n[CLIENT] Generating response...")
-            client_response = generate_client_response(conversation_history, wandero_response)
-            
-            # Use consistent subject line
-            subject = "Trip Planning Request"
-            
-            print(f"\n[CLIENT] Sending response...")
-            print(f"Subject: {subject}")
-            print(f"Body: {client_response}")
-            
-            # Prepare threading headers
-            in_reply_to, references = analytics.get_threading_headers()
-            
-            if send_email(subject, client_response, in_reply_to=in_reply_to, references=references):
-                conversation_history.append(("Client", client_response))
-                # Generate a Message-ID for threading
-                message_id = f"<{uuid.uuid4()}@wandero-simulator>"
-                analytics.record_email_sent(message_id)
-                print("\n[CLIENT] Response sent successfully!")
-                
-                # Show basic stats after client response
-                print(f"\n[ANALYTICS] Round {conversation_rounds} - Client response sent")
-                print(f"  Total emails: {analytics.emails_sent} sent | {analytics.emails_received} received")
+        with tracer.round(conversation_id, conversation_rounds):
+            print(f"\n{tag}--- Round {conversation_rounds} ---")
+
+            # Send initial email if not sent yet
+            if not initial_email_sent:
+                print(f"\n{tag}[CLIENT] Sending initial email...")
+                try:
+                    initial_email = pooled_email or await agenerate_initial_email(persona)
+                except (LLMError, CacheMiss) as e:
+                    print(f"\n{tag}[ERROR] Could not generate initial email: {e}. Retrying in {check_interval//60} minutes...")
+                    with tracer.waiting():
+                        await scheduler.sleep(check_interval, jitter=RETRY_JITTER, kind='retry')
+                    continue
+                print(f"{tag}Subject: {subject}")
+                print(f"{tag}Body: {initial_email}")
+
+                message_id = await asyncio.to_thread(send_email, subject, initial_email)
+                if message_id:
+                    history.append(("Client", initial_email))
+                    router.add_message_id(message_id, conversation_id)
+                    analytics.record_email_sent(message_id)
+                    awaiting_reply = True
+                    initial_email_sent = True
+                    journal_sent(initial_email, message_id)
+                    checkpoint()
+                    print(f"\n{tag}[CLIENT] Initial email sent successfully!")
+
+                    # Show real-time analytics
+                    print(f"\n{tag}[ANALYTICS] Round {conversation_rounds} Stats:")
+                    print(f"  - Emails sent: {analytics.emails_sent}")
+                    print(f"  - Emails received: {analytics.emails_received}")
+
+                    # Wait for new mail (or the polling fallback) before checking for response
+                    print(f"\n{tag}[CLIENT] Waiting up to {check_interval//60} minutes for a response...")
+                    with tracer.waiting():
+                        await router.wait(conversation_id, check_interval)
+                    continue
+                else:
+                    print(f"\n{tag}[ERROR] Failed to send initial email. Retrying in {check_interval//60} minutes...")
+                    with tracer.waiting():
+                        await scheduler.sleep(check_interval, jitter=RETRY_JITTER, kind='retry')
+                    continue
+
+            # Wait for Wandero's response
+            print(f"\n{tag}[CLIENT] Checking for Wandero's response (checking every {check_interval//60} minutes)...")
+            # UIDs only compare within one UIDVALIDITY; after a reset the mailbox sync itself skips the
+            # mail it returned before, so everything routed here is new
+            new_emails = [email for email in router.take(conversation_id)
+                          if not last_uid or email.uid > last_uid or email.uidvalidity != uidvalidity]
+
+            if new_emails:
+                # The reply arrived first, so the client answers it instead of following up
+                if follow_up_timer is not None and follow_up_timer.cancel():
+                    print(f"\n{tag}[CLIENT] Reply arrived; follow-up cancelled")
+                # Process every new reply in UID order so none is skipped; the client answers the latest one
+                for email in new_emails:
+                    print(f"\n{tag}[WANDERO] Response received:")
+                    print(f"{tag}Body: {email.body}")
+                    # Get the last client message before this reply
+                    client_questions = history[-1][1] if history and history[-1][0] == "Client" else None
+                    history.append(("Wandero", email.body))
+                    analytics.record_email_received(email.message_id)
+                    normalized = email.normalized
+                    if normalized is not None and normalized.removed_bytes:
+                        print(f"{tag}[CLIENT] Stripped {normalized.removed_bytes} bytes (~{normalized.removed_tokens} tokens) "
+                              f"of quotes and signature")
+                        get_metrics().inc('body_removed_bytes', normalized.removed_bytes)
+                        get_metrics().inc('body_removed_tokens', normalized.removed_tokens)
+                    if store:
+                        store.record_message(conversation_id, "Wandero", email.body, uid=email.uid, message_id=email.message_id)
+                        store.record_event(conversation_id, 'email_received', uid=email.uid)
+                        # The received body as it was, for audit
+                        if normalized is not None and normalized.removed_bytes:
+                            store.record_event(conversation_id, 'body_normalized', uid=email.uid, original=normalized.original,
+                                               removed_bytes=normalized.removed_bytes, removed_tokens=normalized.removed_tokens)
+
+                    # Only the first reply since our last email measures response time (from the server's receive time)
+                    if awaiting_reply:
+                        awaiting_reply = False
+                        response_time = analytics.record_response_time(received_at=email.received_at or mail_signal.last_push_time)
+                        if response_time:
+                            print(f"\n{tag}[ANALYTICS] Wandero responded in {response_time/60:.1f} minutes")
+                            if store:
+                                store.record_event(conversation_id, 'response_time', seconds=response_time)
+
+                    # Analyze Wandero's performance
+                    with get_metrics().timer('analysis_seconds'), tracer.span('analysis'):
+                        analytics.analyze_wandero_response(email.body, client_questions)
+                    last_uid, uidvalidity = email.uid, email.uidvalidity
+                    pending_reply = email.body
+                    checkpoint()
+
+                # Show basic real-time stats only
+                print(f"\n{tag}[ANALYTICS] Round {conversation_rounds} - Basic Stats:")
+                print(f"  Emails sent: {analytics.emails_sent} | Received: {analytics.emails_received}")
                 if analytics.response_times:
-                    avg_time = sum(analytics.response_times) / len(analytics.response_times)
-                    print(f"  Avg response time: {avg_time/60:.1f} min | Score: {analytics.calculate_wandero_performance_score():.1f}/100")
-                
-                # Wait before checking for next response
-                print(f"\n[CLIENT] Waiting {check_interval//60} minutes before checking for response...")
-                time.sleep(check_interval)
-                continue
-                
-                # Occasionally send a follow-up email with forgotten details (more realistic frequency)
-                if random.random() < 0.15 and conversation_rounds > 2:  # 15% chance after round 2
-                    time.sleep(random.randint(60, 180))  # Wait 1-3 minutes
-                    follow_up = generate_follow_up_email(conversation_history)
-                    if follow_up:
-                        print(f"\n[CLIENT] Sending follow-up email...")
-                        follow_up_subject = "Trip Planning Request"
-                        print(f"Subject: {follow_up_subject}")
-                        print(f"Body: {follow_up}")
-                        
-                        # Prepare threading headers for follow-up
-                        in_reply_to, references = analytics.get_threading_headers()
-                        
-                        if send_email(follow_up_subject, follow_up, in_reply_to=in_reply_to, references=references):
-                            conversation_history.append(("Client", follow_up))
-                            # Generate a Message-ID for threading
-                            message_id = f"<{uuid.uuid4()}@wandero-simulator>"
-                            analytics.record_email_sent(message_id)
-                            print("\n[CLIENT] Follow-up sent successfully!")
+                    avg_time = analytics.response_times.mean
+                    print(f"  Average response time: {avg_time/60:.1f} minutes")
+                    print(f"  Current score: {analytics.calculate_wandero_performance_score():.1f}/100")
+
+            # Answer the latest Wandero email (kept pending across rounds if generating or sending failed)
+            if pending_reply:
+                print(f"\n{tag}[CLIENT] Generating response...")
+                try:
+                    client_response = await agenerate_client_response(history, pending_reply, persona, context)
+                except (LLMError, CacheMiss) as e:
+                    print(f"\n{tag}[ERROR] Could not generate response: {e}. Will retry in {check_interval//60} minutes...")
+                    with tracer.waiting():
+                        await scheduler.sleep(check_interval, jitter=RETRY_JITTER, kind='retry')
+                    continue
+
+                print(f"\n{tag}[CLIENT] Sending response...")
+                print(f"{tag}Subject: {subject}")
+                print(f"{tag}Body: {client_response}")
+
+                # Prepare threading headers
+                in_reply_to, references = analytics.get_threading_headers()
+
+                message_id = await asyncio.to_thread(send_email, subject, client_response, in_reply_to=in_reply_to,
+                                                     references=references)
+                if message_id:
+                    history.append(("Client", client_response))
+                    router.add_message_id(message_id, conversation_id)
+                    analytics.record_email_sent(message_id)
+                    awaiting_reply = True
+                    pending_reply = None
+                    journal_sent(client_response, message_id)
+                    checkpoint()
+                    print(f"\n{tag}[CLIENT] Response sent successfully!")
+
+                    # Show basic stats after client response
+                    print(f"\n{tag}[ANALYTICS] Round {conversation_rounds} - Client response sent")
+                    print(f"  Total emails: {analytics.emails_sent} sent | {analytics.emails_received} received")
+                    if context.prompt_tokens:
+                        print(f"  Prompt tokens this round: {context.prompt_tokens[-1]} ({context.cached_tokens[-1]} cached)"
+                              f" | Summaries computed: {context.summaries_computed}")
+                    if analytics.response_times:
+                        avg_time = analytics.response_times.mean
+                        print(f"  Avg response time: {avg_time/60:.1f} min | Score: {analytics.calculate_wandero_performance_score():.1f}/100")
+
+                    # Occasionally follow up with forgotten details while waiting for the reply
+                    if conversation_rounds > 2 and random.random() < FOLLOW_UP_CHANCE:
+                        follow_up_timer = scheduler.call_later(FOLLOW_UP_DELAY, start_follow_up, jitter=FOLLOW_UP_JITTER,
+                                                               kind='follow_up')
+
+                    # Wait for new mail (or the polling fallback) before checking for next response
+                    print(f"\n{tag}[CLIENT] Waiting up to {check_interval//60} minutes for a response...")
+                    with tracer.waiting():
+                        await router.wait(conversation_id, check_interval)
+                    continue
+
+                else:
+                    print(f"\n{tag}[ERROR] Failed to send response. Will retry in {check_interval//60} minutes...")
+                    with tracer.waiting():
+                        await scheduler.sleep(check_interval, jitter=RETRY_JITTER, kind='retry')
+                    continue
             else:
-                print("\n[ERROR] Failed to send response. Will retry in 5 minutes...")
-                time.sleep(check_interval)
+                print(f"\n{tag}[CLIENT] No new response from Wandero. Waiting up to {check_interval//60} minutes for new mail...")
+                with tracer.waiting():
+                    await router.wait(conversation_id, check_interval)
                 continue
-        else:
-            print(f"\n[CLIENT] No new response from Wandero. Checking again in {check_interval//60} minutes...")
-            time.sleep(check_interval)
+
+    if follow_up_timer is not None:
+        follow_up_timer.cancel()
+    if follow_up_task is not None:
+        await follow_up_task
+    router.unregister(conversation_id)
+    if own_router:
+        router.stop()
+    checkpoint(completed=True)
+    print(f"\n{tag}=== Conversation completed after {conversation_rounds} rounds ===")
+    return analytics
+
+# Per-client results, average score and fleet-wide response-time percentiles.
+# results holds (client_id, ConversationAnalytics or the exception the client failed with).
+def print_fleet_summary(results, title="FLEET SUMMARY"):
+    print("\n" + "=" * 50)
+    print(f"{title} ({len(results)} clients)")
+    print("=" * 50)
+    scores = []
+    fleet_latency = LatencyHistogram()
+    for client_id, result in results:
+        if isinstance(result, BaseException):
+            print(f"  • Client {client_id}: failed ({result})")
             continue
-    
+        score = result.calculate_wandero_performance_score()
+        scores.append(score)
+        fleet_latency.merge(result.response_times)
+        print(f"  • Client {client_id}: {result.emails_sent} sent | {result.emails_received} received | Score: {score:.1f}/100")
+    if scores:
+        print(f"\nAverage score across fleet: {sum(scores) / len(scores):.1f}/100")
+    if fleet_latency:
+        latency = fleet_latency.summary()
+        print(f"Wandero response times across fleet ({latency['count']} replies): "
+              f"p50 {latency['p50']/60:.1f} | p95 {latency['p95']/60:.1f} | p99 {latency['p99']/60:.1f} | "
+              f"max {latency['max']/60:.1f} minutes")
+
+# Run many independent simulated clients on one event loop (client_ids picks which ones, e.g. a
+# worker's shard; on_analytics is passed to every conversation)
+async def run_fleet(num_clients, max_rounds=50, check_interval=120, ramp_seconds=30, max_workers=64, use_idle=True,
+                    store=None, run_id='default', client_ids=None, on_analytics=None, summary=True, pool=None):
+    client_ids = list(range(num_clients)) if client_ids is None else list(client_ids)
+    # Blocking calls share one thread pool; size it for the fleet instead of the small default
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+    # Every client shares one LLM gateway so the fleet stays inside the API key's limits
+    get_llm_gateway().add_listener(record_llm_call)
+    # One IDLE connection wakes every conversation instead of each one polling on its own
+    mail_signal = start_mail_signal(use_idle)
+    # One mailbox scan per push routes replies to every conversation
+    router = MailRouter(mail_signal, check_interval).start()
+
+    async def start_client(client_id):
+        # Spread the initial emails out so the fleet doesn't start in one burst
+        await mail_signal.scheduler.sleep(ramp_seconds / 2, jitter=1.0, kind='ramp')
+        return await run_conversation(client_id, random_persona(), max_rounds=max_rounds, check_interval=check_interval,
+                                      mail_signal=mail_signal, store=store, run_id=run_id, on_analytics=on_analytics,
+                                      router=router, pool=pool)
+
+    try:
+        results = await asyncio.gather(*(start_client(i) for i in client_ids), return_exceptions=True)
+    finally:
+        router.stop()
+        if mail_signal.watcher is not None:
+            mail_signal.watcher.stop()
+
+    if summary:
+        print_fleet_summary(list(zip(client_ids, results)))
+    print_mail_stats(mail_signal, router)
+    print_scheduler_stats(mail_signal.scheduler)
+    print_llm_stats()
+    if pool is not None:
+        print_pool_stats(pool)
+    get_transport().close()
+    return results
+
+# Run the single-client conversation with its own IDLE watcher
+async def run_single(max_rounds=50, check_interval=120, use_idle=True, store=None, run_id='default'):
+    get_llm_gateway().add_listener(record_llm_call)
+    mail_signal = start_mail_signal(use_idle)
+    router = MailRouter(mail_signal, check_interval).start()
+    try:
+        return await run_conversation(max_rounds=max_rounds, check_interval=check_interval,
+                                      mail_signal=mail_signal, store=store, run_id=run_id, router=router)
+    finally:
+        router.stop()
+        if mail_signal.watcher is not None:
+            mail_signal.watcher.stop()
+        print_mail_stats(mail_signal, router)
+        print_scheduler_stats(mail_signal.scheduler)
+        print_llm_stats()
+        get_transport().close()
+
+# How much scenario time a virtual run covered
+def print_clock_stats(clock):
+    if clock.virtual:
+        print(f"[CLOCK] Virtual time: {clock.elapsed / 3600:.2f} hours simulated")
+
+# Export the recorded spans and print where the time went
+def write_trace(path):
+    tracer = get_tracer()
+    count = tracer.export_chrome_trace(path)
+    print(f"\n[TRACE] {count} spans written to {path}")
+    for name, stats in tracer.summary().items():
+        print(f"  {name:<14} {stats['count']:>6} spans | total {stats['total_ms'] / 1000:8.2f}s | max {stats['max_ms']:9.1f}ms")
+    if tracer.profile_threshold is not None:
+        print(f"  Slow rounds profiled: {tracer.slow_rounds} (busy over {tracer.profile_threshold}s)")
+
+# Main conversation loop
+def main(argv=None):
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Wandero Client Simulator")
+    parser.add_argument('--clients', type=int, default=1, help="number of simulated clients to run concurrently")
+    parser.add_argument('--rounds', type=int, default=50, help="maximum rounds per conversation")
+    parser.add_argument('--interval', type=int, default=120, help="longest wait between mailbox checks (IDLE wakes earlier)")
+    parser.add_argument('--no-idle', action='store_true', help="disable IMAP IDLE and poll every --interval seconds")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes to shard fleet clients across (each runs its share on its own event loop)")
+    parser.add_argument('--ramp', type=int, default=30, help="seconds over which fleet clients start")
+    parser.add_argument('--state-db', default='wandero_state.db', help="SQLite file conversations are journaled to and resumed from")
+    parser.add_argument('--run-id', default='default', help="name of this run in the state store (use a new one to start over)")
+    parser.add_argument('--no-state', action='store_true', help="keep conversation state in memory only")
+    parser.add_argument('--llm-cache', choices=CACHE_MODES, default=settings.LLM_CACHE_MODE,
+                        help="completion cache mode: record a scenario once, then replay it without API calls")
+    parser.add_argument('--transport', choices=('imap', 'memory'), default=settings.MAIL_TRANSPORT,
+                        help="mail transport: real IMAP/SMTP servers or an offline in-memory mailbox with a fake Wandero")
+    parser.add_argument('--wandero-latency', default=settings.WANDERO_LATENCY,
+                        help="fake Wandero reply delay for --transport memory, e.g. fixed:5, uniform:10,120, lognormal:60,0.6, exp:45")
+    parser.add_argument('--wandero-replay', metavar='FILE',
+                        help="with --transport memory, replay Wandero replies recorded by `cli.py export-wandero` instead of the script")
+    parser.add_argument('--clock', choices=CLOCK_MODES, default='real',
+                        help="virtual: skip every wait instantly (needs --transport memory and --llm-cache replay)")
+    parser.add_argument('--seed', type=int, help="seed personas, jitter and fake Wandero delays so runs repeat exactly")
+    parser.add_argument('--persona-pool', metavar='FILE', default=settings.PERSONA_POOL_PATH,
+                        help="open conversations with personas and emails pre-generated by `cli.py fill-pool`, refilled in the background")
+    parser.add_argument('--metrics-port', type=int, default=settings.METRICS_PORT,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while the simulator runs")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="record per-round spans and write them as Chrome trace JSON (chrome://tracing, ui.perfetto.dev)")
+    parser.add_argument('--profile-slow-rounds', type=float, metavar='SECONDS',
+                        help="with --trace, profile sampled rounds and attach the profile to those busy for longer than this")
+    parser.add_argument('--profile-sample', type=float, default=0.1, help="share of rounds profiled with --profile-slow-rounds")
+    args = parser.parse_args(argv)
+    # Only ask for what this run will actually use
+    required = [] if args.llm_cache == 'replay' else ['OPENAI_API_KEY']
+    if args.transport == 'imap':
+        required += ['EMAIL_ADDRESS', 'EMAIL_PASSWORD', 'WANDERO_EMAIL']
+    # Virtual time would jump ahead while a real server or the API is answering
+    if args.clock == 'virtual' and (args.transport != 'memory' or args.llm_cache != 'replay'):
+        parser.error("--clock virtual needs --transport memory and --llm-cache replay")
+    if args.wandero_replay and args.transport != 'memory':
+        parser.error("--wandero-replay needs --transport memory")
+    try:
+        settings.validate(required)
+    except ConfigError as e:
+        parser.error(str(e))
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.trace:
+        configure_tracing(profile_threshold=args.profile_slow_rounds, profile_sample=args.profile_sample)
+    if args.seed is not None:
+        random.seed(args.seed)
+    clock = configure_clock(args.clock)
+
+    print("=== Wandero Client Simulator ===")
+    print(f"Starting conversation with {settings.WANDERO_EMAIL}")
+    print(f"Company: {settings.COMPANY_NAME} in {settings.COMPANY_COUNTRY}")
+    print("=" * 40)
+
+    if args.workers > 1 and args.clients > 1:
+        from supervisor import run_supervised
+        run_supervised(args.clients, args.workers, {
+            'rounds': args.rounds, 'interval': args.interval, 'ramp': args.ramp, 'use_idle': not args.no_idle,
+            'state_db': None if args.no_state else args.state_db, 'run_id': args.run_id, 'llm_cache': args.llm_cache,
+            'transport': args.transport, 'wandero_latency': args.wandero_latency, 'trace': args.trace,
+            'profile_slow_rounds': args.profile_slow_rounds, 'profile_sample': args.profile_sample,
+            'clock': args.clock, 'seed': args.seed, 'wandero_replay': args.wandero_replay,
+            'persona_pool': args.persona_pool,
+        })
+        return
+
+    store = None if args.no_state else StateStore(args.state_db)
+    configure_completion_cache(mode=args.llm_cache)
+    if args.transport == 'memory':
+        configure_transport('memory', latency=args.wandero_latency, replay=args.wandero_replay)
+    else:
+        configure_transport('imap', store=store, sync_name=args.run_id or 'default')
+
+    if args.clients > 1:
+        pool = open_persona_pool(args.persona_pool) if args.persona_pool else None
+        try:
+            clock.run(run_fleet(args.clients, max_rounds=args.rounds, check_interval=args.interval, ramp_seconds=args.ramp,
+                                use_idle=not args.no_idle, store=store, run_id=args.run_id, pool=pool))
+            print_clock_stats(clock)
+        finally:
+            if pool is not None:
+                pool.close()
+            if args.trace:
+                write_trace(args.trace)
+        return
+
+    try:
+        analytics = clock.run(run_single(max_rounds=args.rounds, check_interval=args.interval, use_idle=not args.no_idle,
+                                         store=store, run_id=args.run_id))
+        print_clock_stats(clock)
+    finally:
+        if args.trace:
+            write_trace(args.trace)
+
     # Print analytics summary
-    print(f"\n=== Conversation completed after {conversation_rounds} rounds ===")
     analytics.print_summary()
     print("Conversation history saved.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+
+from clock import get_clock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    body TEXT NOT NULL,
+    uid INTEGER,
+    message_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, id);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_conversation ON events (conversation_id, id);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    conversation_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS mailbox_cursors (
+    mailbox TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    uidnext INTEGER NOT NULL,
+    highestmodseq INTEGER,
+    synced_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS mailbox_seen_ids (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mailbox TEXT NOT NULL,
+    message_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mailbox_seen_ids_by_mailbox ON mailbox_seen_ids (mailbox, id);
+"""
+
+# Append-only SQLite journal of every conversation plus one checkpoint row per conversation.
+# messages and events are never updated; the checkpoint is overwritten so resuming a
+# conversation reads a single row instead of replaying its events or the mailbox. Mailbox sync
+# cursors (see email_client.MailboxSync) are overwritten the same way, together with the
+# Message-IDs the sync returned most recently.
+class StateStore:
+    def __init__(self, path='wandero_state.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def record_message(self, conversation_id, sender, body, uid=None, message_id=None):
+        """Append a sent or received message to the journal"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO messages (conversation_id, sender, body, uid, message_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation_id, sender, body, uid, message_id, get_clock().time()))
+            self._db.commit()
+
+    def record_event(self, conversation_id, kind, **payload):
+        """Append an analytics event (e.g. 'email_sent', 'response_time') to the journal"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO events (conversation_id, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                (conversation_id, kind, json.dumps(payload), get_clock().time()))
+            self._db.commit()
+
+    def save_checkpoint(self, conversation_id, state):
+        """Overwrite the conversation's checkpoint with a JSON-serializable state dict"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO checkpoints (conversation_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(conversation_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (conversation_id, json.dumps(state), get_clock().time()))
+            self._db.commit()
+
+    def load_checkpoint(self, conversation_id):
+        """Latest checkpoint state for a conversation, or None if it never started"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM checkpoints WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_history(self, conversation_id, with_times=False, limit=None):
+        """Conversation history as (sender, message) tuples in send/receive order
+        ((sender, message, created_at) with with_times); only the newest limit messages when given"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT sender, body, created_at FROM (SELECT id, sender, body, created_at FROM messages "
+                "WHERE conversation_id = ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (conversation_id, -1 if limit is None else limit)).fetchall()
+        if with_times:
+            return rows
+        return [(sender, body) for sender, body, _ in rows]
+
+    def message_count(self, conversation_id):
+        """How many messages are journaled for a conversation"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+
+    def load_events(self, conversation_id, kind=None):
+        """Journaled events for a conversation as (kind, payload, created_at) tuples"""
+        query = "SELECT kind, payload, created_at FROM events WHERE conversation_id = ?"
+        params = [conversation_id]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY id", params).fetchall()
+        return [(kind, json.loads(payload) if payload else {}, created_at) for kind, payload, created_at in rows]
+
+    def save_mailbox_cursor(self, mailbox, cursor, seen_ids=(), keep_seen=None):
+        """Overwrite a mailbox's sync cursor (dict with uidvalidity, uidnext, highestmodseq, synced_at)
+        and add the Message-IDs returned since it was last saved, keeping the newest keep_seen"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO mailbox_cursors (mailbox, uidvalidity, uidnext, highestmodseq, synced_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(mailbox) DO UPDATE SET uidvalidity = excluded.uidvalidity, uidnext = excluded.uidnext, "
+                "highestmodseq = excluded.highestmodseq, synced_at = excluded.synced_at",
+                (mailbox, cursor['uidvalidity'], cursor['uidnext'], cursor['highestmodseq'], cursor['synced_at']))
+            if seen_ids:
+                self._db.executemany("INSERT INTO mailbox_seen_ids (mailbox, message_id) VALUES (?, ?)",
+                                     [(mailbox, message_id) for message_id in seen_ids])
+                if keep_seen is not None:
+                    self._db.execute(
+                        "DELETE FROM mailbox_seen_ids WHERE mailbox = ? AND id NOT IN "
+                        "(SELECT id FROM mailbox_seen_ids WHERE mailbox = ? ORDER BY id DESC LIMIT ?)",
+                        (mailbox, mailbox, keep_seen))
+            self._db.commit()
+
+    def load_mailbox_cursor(self, mailbox):
+        """Saved sync cursor of a mailbox as a dict, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity, uidnext, highestmodseq, synced_at FROM mailbox_cursors WHERE mailbox = ?",
+                (mailbox,)).fetchone()
+        return dict(zip(('uidvalidity', 'uidnext', 'highestmodseq', 'synced_at'), row)) if row else None
+
+    def load_mailbox_seen_ids(self, mailbox):
+        """Message-IDs saved with a mailbox's sync cursor, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT message_id FROM mailbox_seen_ids WHERE mailbox = ? ORDER BY id", (mailbox,)).fetchall()
+        return [row[0] for row in rows]
+
+    def conversation_ids(self, prefix=""):
+        """Every conversation that has a checkpoint (optionally only ids starting with prefix)"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT conversation_id FROM checkpoints WHERE substr(conversation_id, 1, ?) = ? ORDER BY conversation_id",
+                (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,249 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import queue
+import random
+import time
+
+from analytics import ConversationAnalytics
+from config import get_settings
+from metrics import AnalyticsCollector, get_metrics
+
+# Runs a fleet across worker processes so scoring, MIME decoding and response parsing use every
+# core. Clients are sharded round-robin; each worker runs its shard on its own event loop with its
+# own mailbox sessions, IDLE watcher, LLM gateway (with its share of the API limits) and state
+# store connection. Workers stream per-conversation counter deltas (a few small dicts, never the
+# transcripts) to the parent, which merges them into one ConversationAnalytics per conversation.
+# A worker that dies is started again on the same shard; with a state store its conversations
+# resume from their checkpoints, and their first delta replaces what the parent had for them.
+#
+# Messages on the results queue are (kind, shard, payload):
+#   'deltas'  [(conversation_id, delta), ...] from ConversationAnalytics.delta_since()
+#   'failed'  (client_id, error text) for a conversation that raised
+#   'done'    None once the shard's conversations have all finished
+
+# Seconds between delta batches sent by each worker
+REPORT_INTERVAL = 2.0
+
+# Times one shard is restarted after crashing before its clients are given up on
+MAX_RESTARTS = 3
+
+# Split client ids round-robin over at most `workers` shards
+def shard_clients(num_clients, workers):
+    return [list(range(shard, num_clients, workers)) for shard in range(min(workers, num_clients))]
+
+# Each worker writes its own trace file: trace.json -> trace.shard0.json, trace.shard1.json, ...
+def shard_trace_path(path, shard):
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext or '.json'}"
+
+# Collects the shard's conversations and sends what changed since the last batch
+class DeltaReporter:
+    def __init__(self, shard, results):
+        self.shard = shard
+        self.results = results
+        self.conversations = {}  # conversation_id -> [analytics, last snapshot sent]
+
+    def track(self, conversation_id, analytics):
+        """run_conversation's on_analytics hook"""
+        self.conversations[conversation_id] = [analytics, None]
+
+    def flush(self):
+        batch = []
+        for conversation_id, entry in self.conversations.items():
+            delta, entry[1] = entry[0].delta_since(entry[1])
+            if delta:
+                batch.append((conversation_id, delta))
+        if batch:
+            self.results.put(('deltas', self.shard, batch))
+
+    async def run(self, interval):
+        from scheduler import get_scheduler
+        while True:
+            await get_scheduler().sleep(interval, kind='report')
+            self.flush()
+
+async def _run_shard(shard, client_ids, options, results):
+    from ai_generator import configure_llm_gateway
+    from email_client import configure_transport
+    from persona_pool import open_persona_pool
+    from simulator import run_fleet
+    from state_store import StateStore
+
+    # The API key's limits are shared by every worker
+    settings = get_settings()
+    workers = options['workers']
+    tokens_per_minute = settings.LLM_TOKENS_PER_MINUTE
+    configure_llm_gateway(max_concurrency=max(1, settings.LLM_MAX_CONCURRENCY // workers),
+                          tokens_per_minute=tokens_per_minute // workers if tokens_per_minute else None)
+
+    store = StateStore(options['state_db']) if options['state_db'] else None
+    if options['transport'] != 'memory':
+        # Each shard scans the mailbox with its own sync cursor
+        configure_transport('imap', store=store, sync_name=f"{options['run_id'] or 'default'}/shard{shard}")
+    # Shards claim openers from the shared pool file in batches that never overlap
+    pool = open_persona_pool(options['persona_pool']) if options.get('persona_pool') else None
+    reporter = DeltaReporter(shard, results)
+    flusher = asyncio.create_task(reporter.run(options['report_interval']))
+    try:
+        outcomes = await run_fleet(len(client_ids), max_rounds=options['rounds'], check_interval=options['interval'],
+                                   ramp_seconds=options['ramp'], use_idle=options['use_idle'], store=store,
+                                   run_id=options['run_id'], client_ids=client_ids, on_analytics=reporter.track,
+                                   summary=False, pool=pool)
+    finally:
+        flusher.cancel()
+        reporter.flush()
+        if pool is not None:
+            pool.close()
+        if store:
+            store.close()
+    for client_id, outcome in zip(client_ids, outcomes):
+        if isinstance(outcome, BaseException):
+            results.put(('failed', shard, (client_id, f"{type(outcome).__name__}: {outcome}")))
+
+# Worker process entry point (must stay importable at module level for the spawn start method)
+def _worker_main(shard, client_ids, options, results):
+    from ai_generator import configure_completion_cache
+    from clock import configure_clock
+    from email_client import configure_transport
+
+    configure_completion_cache(mode=options['llm_cache'])
+    clock = configure_clock(options.get('clock', 'real'))
+    if options.get('seed') is not None:
+        # Each shard draws its own sequence, the same one on every run
+        random.seed(options['seed'] * 1000 + shard)
+    if options.get('trace'):
+        from tracing import configure_tracing
+        configure_tracing(profile_threshold=options.get('profile_slow_rounds'), profile_sample=options.get('profile_sample', 0.1))
+    if options['transport'] == 'memory':
+        configure_transport('memory', latency=options['wandero_latency'], replay=options.get('wandero_replay'))
+    print(f"[SUPERVISOR] Shard {shard} started with {len(client_ids)} clients")
+    try:
+        clock.run(_run_shard(shard, client_ids, options, results))
+    finally:
+        if options.get('trace'):
+            from simulator import write_trace
+            write_trace(shard_trace_path(options['trace'], shard))
+    results.put(('done', shard, None))
+
+# One shard of clients and the process running it
+class WorkerShard:
+    def __init__(self, index, client_ids):
+        self.index = index
+        self.client_ids = client_ids
+        self.process = None
+        self.restarts = 0
+        self.done = False
+        self.gave_up = False
+
+class Supervisor:
+    def __init__(self, num_clients, workers, options, max_restarts=MAX_RESTARTS):
+        self.options = dict(options, workers=workers)
+        self.options.setdefault('report_interval', REPORT_INTERVAL)
+        self.max_restarts = max_restarts
+        # spawn: workers start clean instead of inheriting the parent's threads and sockets
+        self.context = multiprocessing.get_context('spawn')
+        self.results = self.context.Queue()
+        self.shards = [WorkerShard(index, client_ids) for index, client_ids in enumerate(shard_clients(num_clients, workers))]
+        self.analytics = {}  # conversation_id -> merged ConversationAnalytics
+        self.failures = {}  # client_id -> error text
+        self.deltas_applied = 0
+        # The parent's metrics endpoint shows the merged fleet
+        get_metrics().add_collector(AnalyticsCollector(self.analytics.values()))
+
+    def _start(self, shard):
+        shard.process = self.context.Process(target=_worker_main, name=f"wandero-shard-{shard.index}",
+                                             args=(shard.index, shard.client_ids, self.options, self.results))
+        shard.process.start()
+
+    def _handle(self, kind, shard_index, payload):
+        if kind == 'deltas':
+            for conversation_id, delta in payload:
+                if delta.get('base') or conversation_id not in self.analytics:
+                    self.analytics[conversation_id] = ConversationAnalytics()
+                self.analytics[conversation_id].apply_delta(delta)
+                self.deltas_applied += 1
+        elif kind == 'failed':
+            client_id, error = payload
+            self.failures[client_id] = error
+        elif kind == 'done':
+            self.shards[shard_index].done = True
+
+    def _drain(self, timeout=None):
+        """Handle queued messages; waits up to timeout for the first one"""
+        try:
+            message = self.results.get(timeout=timeout) if timeout else self.results.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            self._handle(*message)
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def _check_workers(self):
+        for shard in self.shards:
+            if shard.done or shard.gave_up or shard.process.is_alive():
+                continue
+            # The worker may have exited right after its last messages; read them before deciding
+            self._drain(timeout=0.5)
+            if shard.done:
+                shard.process.join()
+                continue
+            exitcode = shard.process.exitcode
+            if shard.restarts >= self.max_restarts:
+                shard.gave_up = True
+                print(f"[SUPERVISOR] Shard {shard.index} exited with code {exitcode}; "
+                      f"giving up after {shard.restarts} restarts")
+                for client_id in shard.client_ids:
+                    self.failures.setdefault(client_id, f"worker exited with code {exitcode}")
+                continue
+            shard.restarts += 1
+            print(f"[SUPERVISOR] Shard {shard.index} exited with code {exitcode}; "
+                  f"restarting ({shard.restarts}/{self.max_restarts})")
+            self._start(shard)
+
+    def run(self):
+        """Start every shard and merge results until all of them finish; returns the merged analytics"""
+        started = time.time()
+        for shard in self.shards:
+            self._start(shard)
+        try:
+            while not all(shard.done or shard.gave_up for shard in self.shards):
+                self._drain(timeout=1.0)
+                self._check_workers()
+            self._drain()
+        finally:
+            for shard in self.shards:
+                if shard.process is not None and shard.process.is_alive():
+                    shard.process.terminate()
+                if shard.process is not None:
+                    shard.process.join()
+        print(f"\n[SUPERVISOR] {len(self.shards)} workers | {sum(shard.restarts for shard in self.shards)} restarts | "
+              f"{self.deltas_applied} deltas merged | {time.time() - started:.0f}s")
+        return self.analytics
+
+    def fleet_results(self, num_clients, run_id):
+        """(client_id, merged analytics or failure) for every client, as print_fleet_summary expects"""
+        from simulator import conversation_key
+        results = []
+        for client_id in range(num_clients):
+            analytics = self.analytics.get(conversation_key(client_id, run_id))
+            if client_id in self.failures or analytics is None:
+                results.append((client_id, RuntimeError(self.failures.get(client_id, "no results"))))
+            else:
+                results.append((client_id, analytics))
+        return results
+
+# Run num_clients conversations across `workers` processes and print the merged fleet summary
+def run_supervised(num_clients, workers, options):
+    from simulator import print_fleet_summary
+    workers = max(1, min(workers, num_clients))
+    print(f"[SUPERVISOR] Sharding {num_clients} clients across {workers} workers "
+          f"(~{math.ceil(num_clients / workers)} each)")
+    supervisor = Supervisor(num_clients, workers, options)
+    supervisor.run()
+    print_fleet_summary(supervisor.fleet_results(num_clients, options['run_id']), "FLEET SUMMARY (all workers)")
+    return supervisor
@@ -0,0 +1,42 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import CLI_PATH, HEAVY_MODULES, STARTUP_BUDGET, STARTUP_COMMANDS
+from state_store import StateStore
+
+# Cold starts timed per command; the budget applies to their median
+RUNS = 5
+
+@pytest.fixture
+def state_db(tmp_path):
+    path = str(tmp_path / 'state.db')
+    StateStore(path).close()
+    return path
+
+# Each offline command starts in a fresh interpreter within STARTUP_BUDGET
+@pytest.mark.parametrize('command', STARTUP_COMMANDS)
+def test_cold_start_within_budget(command, state_db):
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, CLI_PATH, command, '--state-db', state_db], check=True, capture_output=True)
+        timings.append(time.perf_counter() - started)
+    assert statistics.median(timings) <= STARTUP_BUDGET, f"cli.py {command} cold start {statistics.median(timings):.2f}s"
+
+# ... and never imports the OpenAI SDK, the IMAP client or the rest of the mail/LLM stack
+@pytest.mark.parametrize('command', STARTUP_COMMANDS)
+def test_no_heavy_imports(command, state_db):
+    check = (f"import sys; sys.argv[0] = {CLI_PATH!r}; sys.path.insert(0, {ROOT!r}); "
+             f"import cli; cli.main({[command, '--state-db', state_db]!r}); "
+             f"print('loaded:', *(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True).stdout
+    loaded = output.rsplit('loaded:', 1)[-1].split()
+    assert not loaded, f"cli.py {command} imported {', '.join(loaded)}"
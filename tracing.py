@@ -0,0 +1,177 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# Returned by span() while tracing is off: entering and leaving it does nothing
+_NOOP = nullcontext()
+
+# Tags (conversation, round) inherited by every span opened in the current task; asyncio tasks
+# and asyncio.to_thread calls get a copy, so spans in executor threads are tagged too
+_current_tags = contextvars.ContextVar('trace_tags', default=None)
+# The round being traced in the current task, to subtract the time it spends waiting
+_current_round = contextvars.ContextVar('trace_round', default=None)
+
+class _RoundState:
+    __slots__ = ('waited',)
+
+    def __init__(self):
+        self.waited = 0.0
+
+# Spans of the simulator's stages (mailbox connect/search/fetch, MIME decoding, LLM calls, SMTP,
+# reply analysis) recorded as Chrome trace events; open the exported JSON in chrome://tracing or
+# https://ui.perfetto.dev. Each conversation gets its own lane. Rounds can be profiled: a sampled
+# round runs under cProfile, and if its busy time (wall time minus waits for mail) exceeds
+# profile_threshold, the top functions are attached to the round's event. cProfile watches the
+# whole thread, so with concurrent conversations the profile also covers their work.
+# Disabled (the default), span() costs one attribute check.
+class Tracer:
+    def __init__(self, enabled=False, max_events=200000, profile_threshold=None, profile_sample=0.1, profile_top=15):
+        self.enabled = enabled
+        self.profile_threshold = profile_threshold
+        self.profile_sample = profile_sample
+        self.profile_top = profile_top
+        self.events = deque(maxlen=max_events)  # oldest dropped first
+        self.slow_rounds = 0
+        self._origin = time.perf_counter()
+        self._lanes = {}  # lane name -> Chrome trace tid
+        self._lock = threading.Lock()
+        self._profiling = False
+
+    def span(self, name, **tags):
+        """Context manager timing the enclosed block as one event"""
+        if not self.enabled:
+            return _NOOP
+        return self._span(name, tags)
+
+    def round(self, conversation_id, round_number):
+        """Context manager for one conversation round; spans inside are tagged with both IDs"""
+        if not self.enabled:
+            return _NOOP
+        return self._round(conversation_id, round_number)
+
+    def waiting(self):
+        """Context manager for time a round spends waiting (excluded from its busy time)"""
+        if not self.enabled:
+            return _NOOP
+        return self._waiting()
+
+    @contextmanager
+    def _span(self, name, tags):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, started, time.perf_counter(), tags)
+
+    @contextmanager
+    def _waiting(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            state = _current_round.get()
+            if state is not None:
+                state.waited += ended - started
+            self._record('mail.wait', started, ended, {})
+
+    @contextmanager
+    def _round(self, conversation_id, round_number):
+        tags_token = _current_tags.set({'conversation': conversation_id, 'round': round_number})
+        state = _RoundState()
+        round_token = _current_round.set(state)
+        profiler = None
+        if self.profile_threshold is not None and not self._profiling and random.random() < self.profile_sample:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            busy = ended - started - state.waited
+            extra = {'busy_ms': round(busy * 1000, 3)}
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                if busy >= self.profile_threshold:
+                    self.slow_rounds += 1
+                    extra['profile'] = self._profile_text(profiler)
+            self._record('round', started, ended, extra)
+            _current_round.reset(round_token)
+            _current_tags.reset(tags_token)
+
+    def _profile_text(self, profiler):
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(self.profile_top)
+        return output.getvalue()
+
+    def _lane(self, name):
+        lane = self._lanes.get(name)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.setdefault(name, len(self._lanes) + 1)
+        return lane
+
+    def _record(self, name, started, ended, tags):
+        context = _current_tags.get()
+        args = {**context, **tags} if context else dict(tags)
+        lane = args.get('conversation') or threading.current_thread().name
+        self.events.append({
+            'name': name,
+            'cat': name.split('.', 1)[0],
+            'ph': 'X',
+            'ts': (started - self._origin) * 1e6,
+            'dur': (ended - started) * 1e6,
+            'pid': os.getpid(),
+            'tid': self._lane(lane),
+            'args': args,
+        })
+
+    def summary(self):
+        """Count, total and max milliseconds per span name"""
+        totals = {}
+        for event in list(self.events):
+            count, total, longest = totals.get(event['name'], (0, 0.0, 0.0))
+            duration = event['dur'] / 1000
+            totals[event['name']] = (count + 1, total + duration, max(longest, duration))
+        return {name: {'count': count, 'total_ms': total, 'max_ms': longest}
+                for name, (count, total, longest) in sorted(totals.items())}
+
+    def export_chrome_trace(self, path):
+        """Write every recorded span as Chrome trace-event JSON; returns the number of events"""
+        pid = os.getpid()
+        lanes = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': str(name)}}
+                 for name, tid in list(self._lanes.items())]
+        events = list(self.events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': lanes + events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+_tracer = Tracer()
+
+# Shared tracer; off until configure_tracing() turns it on
+def get_tracer():
+    return _tracer
+
+# Turn tracing on or off for the process (the tracer object stays the same, so modules holding it see the change)
+def configure_tracing(enabled=True, profile_threshold=None, profile_sample=0.1, max_events=None):
+    _tracer.enabled = enabled
+    _tracer.profile_threshold = profile_threshold
+    _tracer.profile_sample = profile_sample
+    if max_events is not None:
+        _tracer.events = deque(_tracer.events, maxlen=max_events)
+    return _tracer
+
+# Shorthand for get_tracer().span(...)
+def span(name, **tags):
+    return _tracer.span(name, **tags)
@@ -0,0 +1,122 @@
+import os
+import sys
+import tempfile
+import threading
+import zlib
+
+# Bodies shorter than this stay as plain text even when old (compression wouldn't pay for itself)
+MIN_COMPRESS_CHARS = 256
+
+COLD_STORAGE_MODES = ('off', 'compress', 'spill')
+
+# Append-only temporary file holding compressed bodies of old turns for every transcript in the
+# process. Records are read back with pread, so readers never move a shared file position.
+class SpillFile:
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix='wandero-spill-', buffering=0)
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def write(self, data):
+        """Append data, returns its offset"""
+        with self._lock:
+            offset = self.size
+            self._file.write(data)
+            self.size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        return os.pread(self._file.fileno(), length, offset)
+
+_spill_file = None
+_spill_lock = threading.Lock()
+
+def get_spill_file():
+    global _spill_file
+    with _spill_lock:
+        if _spill_file is None:
+            _spill_file = SpillFile()
+        return _spill_file
+
+# One email in a conversation. Behaves like the (sender, message) tuple it replaces (unpacking,
+# [0]/[1]) in three slots. Old bodies can be frozen: zlib-compressed in memory, or spilled to the
+# shared SpillFile leaving only its offset; they are decompressed again only when read.
+class Message:
+    __slots__ = ('sender', '_data', '_length')
+
+    def __init__(self, sender, body):
+        self.sender = sys.intern(sender)  # every record shares one "Client" and one "Wandero" string
+        self._data = body  # str, zlib bytes, or the spill offset
+        self._length = None  # spilled record length; None while the body is held in memory
+
+    @property
+    def body(self):
+        data = self._data
+        if isinstance(data, str):
+            return data
+        if self._length is not None:
+            data = get_spill_file().read(data, self._length)
+        return zlib.decompress(data).decode('utf-8')
+
+    @property
+    def frozen(self):
+        return not isinstance(self._data, str)
+
+    def freeze(self, mode='compress'):
+        """Move the body to cold storage ('compress' or 'spill'); short bodies are left alone"""
+        if mode == 'off' or self.frozen or len(self._data) < MIN_COMPRESS_CHARS:
+            return
+        packed = zlib.compress(self._data.encode('utf-8'))
+        if mode == 'spill':
+            self._data, self._length = get_spill_file().write(packed), len(packed)
+        else:
+            self._data = packed
+
+    def __iter__(self):
+        yield self.sender
+        yield self.body
+
+    def __getitem__(self, index):
+        return (self.sender, self.body)[index]
+
+    def __len__(self):
+        return 2
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f"Message({self.sender!r}, {self.body[:40]!r}{'...' if len(self.body) > 40 else ''})"
+
+# A conversation's history: a list of Message records. Anything appended as a (sender, message)
+# pair becomes a Message, and once more than keep_recent turns follow a message its body goes
+# to cold storage. Prompts only read the recent turns verbatim, so frozen bodies are rarely
+# decompressed (the rolling summary, rescoring and follow-ups that quote old turns do so lazily).
+class Transcript(list):
+    def __init__(self, messages=(), keep_recent=8, cold_storage='compress'):
+        super().__init__()
+        if cold_storage not in COLD_STORAGE_MODES:
+            raise ValueError(f"Unknown cold storage {cold_storage!r}, expected one of {', '.join(COLD_STORAGE_MODES)}")
+        self.keep_recent = keep_recent
+        self.cold_storage = cold_storage
+        self.extend(messages)
+
+    def append(self, message):
+        if not isinstance(message, Message):
+            message = Message(*message)
+        super().append(message)
+        if len(self) > self.keep_recent:
+            self[-self.keep_recent - 1].freeze(self.cold_storage)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def frozen_count(self):
+        return sum(1 for message in self if message.frozen)
+
+# Transcript configured from TRANSCRIPT_KEEP_RECENT and TRANSCRIPT_COLD_STORAGE
+def new_transcript(messages=()):
+    from config import get_settings
+    settings = get_settings()
+    return Transcript(messages, settings.TRANSCRIPT_KEEP_RECENT, settings.TRANSCRIPT_COLD_STORAGE)